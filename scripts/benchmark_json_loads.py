@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""Compare JSON loaders used to decode system profiles returned by the database.
+
+Each host in the inventory fixture is encoded to bytes the way psycopg receives
+a jsonb column, then decoded with each loader available in roadmap.database.
+"""
+
+import argparse
+import gzip
+import json
+import timeit
+
+from pathlib import Path
+
+from roadmap.database import JSON_LOADERS
+
+
+FIXTURE = Path(__file__).parent.parent / "tests" / "fixtures" / "inventory_db_response.json.gz"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20, help="Number of passes over the fixture per repeat")
+    parser.add_argument("--repeat", type=int, default=5)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with gzip.open(FIXTURE) as gzfile:
+        hosts = json.load(gzfile)
+
+    documents = [json.dumps(host.get("system_profile_facts", {})).encode("utf-8") for host in hosts]
+    size = sum(len(document) for document in documents)
+    print(f"Decoding {len(documents)} system profiles ({size / 1024 / 1024:.1f} MiB) {args.number} times")
+
+    results = {}
+    for name, loads in JSON_LOADERS.items():
+        timer = timeit.Timer(lambda: [loads(document) for document in documents])
+        results[name] = min(timer.repeat(repeat=args.repeat, number=args.number)) / args.number
+        print(f"{name:>8}: {results[name] * 1000:8.2f} ms per pass")
+
+    baseline = results["json"]
+    for name, result in results.items():
+        if name != "json":
+            print(f"{name} is {baseline / result:.1f}x faster than json")
+
+
+if __name__ == "__main__":
+    main()
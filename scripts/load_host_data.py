@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import gzip
+import logging
 import sys
 
 from datetime import datetime
@@ -11,6 +12,8 @@ from uuid import uuid4
 
 from app_common_python import json
 from faker import Faker
+from replication import check_or_create_hosts_notify
+from replication import check_or_create_roadmap_hosts
 from sqlalchemy import create_engine
 from sqlalchemy import delete
 from sqlalchemy.orm import DeclarativeBase
@@ -80,6 +83,11 @@ def main():
     # Create the table and table schema
     Host.metadata.create_all(engine)
 
+    # Create hbi.roadmap_hosts and the triggers that keep it and API caches in sync with hbi.hosts
+    with Session(engine) as session:
+        check_or_create_roadmap_hosts(logging.getLogger(__name__), session, engine)
+        check_or_create_hosts_notify(logging.getLogger(__name__), session)
+
     # Use data in the file to populate the database
     response_data_file = Path(__file__).parent.parent / "tests" / "fixtures" / "inventory_db_response.json.gz"
     with gzip.open(response_data_file) as gzfile:
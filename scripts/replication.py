@@ -15,6 +15,7 @@ import app_common_python
 
 from sqlalchemy import create_engine
 from sqlalchemy import text as sa_text
+from sqlalchemy.engine import URL
 from sqlalchemy.orm import sessionmaker
 
 
@@ -23,12 +24,6 @@ __all__ = ("main", "run")
 LOGGER_NAME = "replication-subscriber"
 SSL_VERIFY_FULL = "verify-full"
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
-
 
 class ShutdownHandler:
     def __init__(self):
@@ -111,31 +106,99 @@ def check_or_create_view(logger, engine):
         connection.execute(sa_text(view_template))
 
 
+HOSTS_INDEXES = {
+    "hosts_account_index": "(account)",
+    "hosts_org_id_index": "(org_id)",
+    "hosts_display_name_index": "(display_name)",
+    "hosts_tags_index": "USING GIN (tags JSONB_PATH_OPS)",
+    "hosts_stale_timestamp_index": "(stale_timestamp)",
+    "hosts_system_profile_index": "USING GIN (system_profile_facts JSONB_PATH_OPS)",
+    "hosts_insights_id_index": "USING btree (((canonical_facts ->> 'insights_id'::text)))",
+    "hosts_insights_reporter_index": "(reporter)",
+    "hosts_per_reporter_staleness_index": "USING GIN (per_reporter_staleness JSONB_PATH_OPS)",
+    "hosts_org_id_id_index": "(org_id,id)",
+    "hosts_modified_on_index": "(modified_on)",
+    # Covers the cache watermark query in roadmap.common so it is answered by an index only scan.
+    "hosts_org_id_watermark_index": "(org_id, modified_on, stale_timestamp)",
+    "hosts_groups_index": "USING GIN (groups JSONB_PATH_OPS)",
+    # The expressions must match OS_MAJOR_SQL and OS_MINOR_SQL in roadmap.common.
+    # Hosts without an OS version are never returned by a version filter, so leave them out of the index.
+    "hosts_org_id_os_version_index": """(
+            org_id,
+            (system_profile_facts #>> '{operating_system,major}'),
+            (system_profile_facts #>> '{operating_system,minor}')
+        ) WHERE (system_profile_facts #>> '{operating_system,major}') IS NOT NULL""",
+}
+
+
+def _hosts_partitions(connection):
+    """Return the partition names of hbi.hosts, or an empty list if it is not partitioned."""
+    sql = """SELECT child.relname FROM pg_inherits
+        JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+        JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+        JOIN pg_namespace ON parent.relnamespace = pg_namespace.oid
+        WHERE pg_namespace.nspname = 'hbi' AND parent.relname = 'hosts'
+        ORDER BY child.relname"""
+    return [row[0] for row in connection.execute(sa_text(sql))]
+
+
+def _partition_index_name(name, partition):
+    return name.replace("hosts_", f"{partition}_", 1)
+
+
+def _partition_index_ddl(name, definition, partition):
+    """Return the statements that build index name on one partition and attach it to the parent index."""
+    partition_index = _partition_index_name(name, partition)
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition_index} ON hbi.{partition} {definition}",
+        f"ALTER INDEX hbi.{name} ATTACH PARTITION hbi.{partition_index}",
+    )
+
+
 def check_or_create_indexes(logger, engine):
-    db_indexes = [
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_account_index ON hbi.hosts (account)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_org_id_index ON hbi.hosts (org_id)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_display_name_index ON hbi.hosts (display_name)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_tags_index ON hbi.hosts USING GIN (tags JSONB_PATH_OPS)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_stale_timestamp_index ON hbi.hosts (stale_timestamp)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_system_profile_index ON hbi.hosts USING GIN (system_profile_facts JSONB_PATH_OPS)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_insights_id_index ON hbi.hosts USING btree (((canonical_facts ->> 'insights_id'::text)))",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_insights_reporter_index ON hbi.hosts (reporter)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_per_reporter_staleness_index ON hbi.hosts USING GIN (per_reporter_staleness JSONB_PATH_OPS)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_org_id_id_index ON hbi.hosts (org_id,id)",
-        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_groups_index ON hbi.hosts USING GIN (groups JSONB_PATH_OPS)",
-    ]
-    for db_index in db_indexes:
-        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
-            connection.execute(sa_text(db_index))
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        partitions = _hosts_partitions(connection)
 
+    for name, definition in HOSTS_INDEXES.items():
+        if not partitions:
+            db_index = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON hbi.hosts {definition}"
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(sa_text(db_index))
 
-def check_or_create_hosts_tables(logger, session):
-    check_table = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'hbi' AND table_name ='hosts'"
-    if not _db_exists(logger, session, check_table):
-        logger.info("hbi.hosts not found.")
-        hosts_table_create = """CREATE TABLE hbi.hosts (
-            id uuid NOT NULL PRIMARY KEY,
+            continue
+
+        # Indexes cannot be created concurrently on a partitioned table. Create an invalid
+        # index on the parent only, build each partition index concurrently, then attach
+        # them. The parent index becomes valid once every partition index is attached.
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(sa_text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY hbi.hosts {definition}"))
+
+        for partition in partitions:
+            partition_index = _partition_index_name(name, partition)
+            create_index, attach_index = _partition_index_ddl(name, definition, partition)
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(sa_text(create_index))
+                attached = connection.execute(
+                    sa_text(
+                        "SELECT 1 FROM pg_inherits"
+                        " WHERE inhrelid = CAST(:child AS regclass) AND inhparent = CAST(:parent AS regclass)"
+                    ),
+                    {"child": f"hbi.{partition_index}", "parent": f"hbi.{name}"},
+                ).fetchall()
+                if not attached:
+                    connection.execute(sa_text(attach_index))
+
+        logger.debug(f"{name} created on {len(partitions)} partitions.")
+
+
+def _hosts_table_ddl(partitions):
+    """Return the statements that create hbi.hosts, hash partitioned on org_id if partitions is not zero."""
+    # A partitioned table must include the partition key in its primary key.
+    primary_key = "PRIMARY KEY (org_id, id)" if partitions else "PRIMARY KEY (id)"
+    partition_by = " PARTITION BY HASH (org_id)" if partitions else ""
+    statements = [
+        f"""CREATE TABLE hbi.hosts (
+            id uuid NOT NULL,
             account character varying(10),
             display_name character varying(200),
             created_on timestamp with time zone NOT NULL,
@@ -147,15 +210,388 @@ def check_or_create_hosts_tables(logger, session):
             ansible_host character varying(255),
             stale_timestamp timestamp with time zone NOT NULL,
             reporter character varying(255) NOT NULL,
-            per_reporter_staleness jsonb DEFAULT '{}'::jsonb NOT NULL,
+            per_reporter_staleness jsonb DEFAULT '{{}}'::jsonb NOT NULL,
             org_id character varying(36) NOT NULL,
             groups jsonb NOT NULL,
             tags_alt jsonb,
-            last_check_in timestamp with time zone
-        );"""
-        session.execute(sa_text(hosts_table_create))
+            last_check_in timestamp with time zone,
+            {primary_key}
+        ){partition_by};"""
+    ]
+    for remainder in range(partitions):
+        statements.append(
+            f"CREATE TABLE hbi.hosts_p{remainder} PARTITION OF hbi.hosts"
+            f" FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+
+    return statements
+
+
+# True if the replica identity of hbi.hosts on the publisher includes org_id. The replica identity
+# is the key sent with replicated updates and deletes. The subscriber routes them to a partition by
+# org_id, so without it they fail or are skipped as missing rows. HBI's default identity is (id).
+HOSTS_REPLICA_IDENTITY_QUERY = """SELECT
+        pg_class.relreplident = 'f' OR EXISTS (
+            SELECT FROM pg_index
+            JOIN pg_attribute ON pg_attribute.attrelid = pg_index.indrelid
+                AND pg_attribute.attnum = ANY(pg_index.indkey)
+            WHERE pg_index.indrelid = pg_class.oid
+                AND pg_attribute.attname = 'org_id'
+                AND (
+                    (pg_class.relreplident = 'd' AND pg_index.indisprimary)
+                    OR (pg_class.relreplident = 'i' AND pg_index.indisreplident)
+                )
+        )
+    FROM pg_class
+    WHERE pg_class.oid = to_regclass('hbi.hosts')"""
+
+
+def _hbi_connection_info():
+    """Return the HBI database connection details from the mounted secret, or None if it is missing."""
+    names = ("db_host", "db_port", "db_name", "db_user", "db_password")
+    paths = {name: f"/etc/db/hbi/{name}" for name in names}
+    if not all(os.path.isfile(path) for path in paths.values()):
+        return None
+
+    info = {}
+    for name, path in paths.items():
+        with open(path) as file:
+            info[name] = file.read().rstrip()
+
+    return info
+
+
+def _publisher_replica_identity_includes_org_id(logger):
+    hbi = _hbi_connection_info()
+    if hbi is None:
+        logger.error("HBI secret files not found. Unable to check the replica identity of hbi.hosts.")
+        return False
+
+    url = URL.create(
+        "postgresql+psycopg",
+        username=hbi["db_user"],
+        password=hbi["db_password"],
+        host=hbi["db_host"],
+        port=int(hbi["db_port"]),
+        database=hbi["db_name"],
+    )
+    connect_args = {}
+    db_ssl_mode = os.getenv("DB_SSL_MODE", "")
+    if db_ssl_mode and os.path.isfile("/etc/db/rdsclientca/rds_cacert"):
+        connect_args = {"sslmode": db_ssl_mode, "sslrootcert": "/etc/db/rdsclientca/rds_cacert"}
+
+    engine = create_engine(url, connect_args=connect_args)
+    try:
+        with engine.connect() as connection:
+            return bool(connection.scalar(sa_text(HOSTS_REPLICA_IDENTITY_QUERY)))
+    finally:
+        engine.dispose()
+
+
+def check_or_create_hosts_tables(logger, session):
+    check_table = "SELECT table_name FROM information_schema.tables WHERE table_schema = 'hbi' AND table_name ='hosts'"
+    if not _db_exists(logger, session, check_table):
+        logger.info("hbi.hosts not found.")
+        # Only partition if the publisher sends org_id with replicated updates and deletes
+        partitions = int(os.getenv("HBI_HOSTS_PARTITIONS") or 0)
+        if partitions and not _publisher_replica_identity_includes_org_id(logger):
+            logger.error(
+                "The replica identity of hbi.hosts on the publisher does not include org_id."
+                " Creating hbi.hosts without partitions."
+            )
+            partitions = 0
+
+        for statement in _hosts_table_ddl(partitions):
+            session.execute(sa_text(statement))
+
         session.commit()
-        logger.info("hbi.hosts created.")
+        if partitions:
+            logger.info(f"hbi.hosts created with {partitions} partitions.")
+        else:
+            logger.info("hbi.hosts created.")
+
+
+# A slim projection of hbi.hosts holding only what the roadmap endpoints read. It is kept
+# current by a trigger on hbi.hosts so the API does not parse system profile JSON per request.
+ROADMAP_HOSTS_TABLE = """CREATE TABLE IF NOT EXISTS hbi.roadmap_hosts (
+    id uuid PRIMARY KEY,
+    org_id character varying(36) NOT NULL,
+    os_name text,
+    os_major integer,
+    os_minor integer,
+    lifecycle text NOT NULL,
+    dnf_modules jsonb NOT NULL,
+    package_names text[] NOT NULL,
+    stale_timestamp timestamp with time zone NOT NULL,
+    modified_on timestamp with time zone NOT NULL
+)"""
+
+ROADMAP_HOSTS_INDEXES = {
+    "roadmap_hosts_org_id_id_index": "(org_id, id)",
+    "roadmap_hosts_org_id_os_version_index": "(org_id, os_major, os_minor)",
+    "roadmap_hosts_modified_on_index": "(modified_on)",
+    "roadmap_hosts_org_id_stale_timestamp_index": "(org_id, stale_timestamp)",
+    "roadmap_hosts_org_id_watermark_index": "(org_id, modified_on, stale_timestamp)",
+    # Finds hosts with a given package, e.g. package_names @> ARRAY['nodejs']
+    "roadmap_hosts_package_names_index": "USING GIN (package_names)",
+}
+
+# Builds one hbi.roadmap_hosts row from the replicated columns. Columns are passed individually
+# because the row type of a partition of hbi.hosts is not the row type of hbi.hosts.
+# The lifecycle expression must match LIFECYCLE_TYPE_SQL and the package name expression must
+# match get_package_names in roadmap.common. Malformed versions become NULL rather than raising,
+# since an error here would stop the replication apply worker.
+ROADMAP_HOST_FUNCTION = """CREATE OR REPLACE FUNCTION hbi.roadmap_host(
+    host_id uuid,
+    host_org_id character varying,
+    profile jsonb,
+    host_stale_timestamp timestamp with time zone,
+    host_modified_on timestamp with time zone
+) RETURNS hbi.roadmap_hosts LANGUAGE sql STABLE AS $$
+    SELECT
+        host_id,
+        host_org_id,
+        profile #>> '{operating_system,name}',
+        CASE WHEN profile #>> '{operating_system,major}' ~ '^[0-9]+$'
+            THEN (profile #>> '{operating_system,major}')::integer END,
+        CASE WHEN profile #>> '{operating_system,minor}' ~ '^[0-9]+$'
+            THEN (profile #>> '{operating_system,minor}')::integer END,
+        CASE
+            WHEN profile -> 'installed_products' @> '[{"id": "241"}]' THEN 'E4S'
+            WHEN profile -> 'installed_products' @> '[{"id": "204"}]' THEN 'ELS'
+            WHEN profile -> 'installed_products' @> ANY (
+                ARRAY['[{"id": "70"}]', '[{"id": "73"}]', '[{"id": "75"}]']::jsonb[]
+            ) THEN 'EUS'
+            ELSE 'mainline'
+        END,
+        CASE WHEN jsonb_typeof(profile -> 'dnf_modules') = 'array' THEN (
+            SELECT coalesce(jsonb_agg(jsonb_build_object('name', module ->> 'name', 'stream', module ->> 'stream')), '[]')
+            FROM jsonb_array_elements(profile -> 'dnf_modules') AS module
+            WHERE jsonb_typeof(module) = 'object'
+        ) ELSE '[]' END,
+        CASE WHEN jsonb_typeof(profile -> 'installed_packages') = 'array' THEN ARRAY(
+            SELECT DISTINCT regexp_replace(split_part(package, ':', 1), '-[^-]*$', '')
+            FROM jsonb_array_elements_text(profile -> 'installed_packages') AS package
+        ) ELSE '{}' END,
+        host_stale_timestamp,
+        host_modified_on
+$$"""
+
+ROADMAP_HOSTS_SYNC_FUNCTION = """CREATE OR REPLACE FUNCTION hbi.roadmap_hosts_sync() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE hbi.roadmap_hosts;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        DELETE FROM hbi.roadmap_hosts WHERE id = OLD.id;
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO hbi.roadmap_hosts
+    SELECT * FROM hbi.roadmap_host(
+        NEW.id, NEW.org_id, NEW.system_profile_facts::jsonb, NEW.stale_timestamp, NEW.modified_on
+    )
+    ON CONFLICT (id) DO UPDATE SET
+        org_id = EXCLUDED.org_id,
+        os_name = EXCLUDED.os_name,
+        os_major = EXCLUDED.os_major,
+        os_minor = EXCLUDED.os_minor,
+        lifecycle = EXCLUDED.lifecycle,
+        dnf_modules = EXCLUDED.dnf_modules,
+        package_names = EXCLUDED.package_names,
+        stale_timestamp = EXCLUDED.stale_timestamp,
+        modified_on = EXCLUDED.modified_on;
+    RETURN NULL;
+END
+$$"""
+
+ROADMAP_HOSTS_BACKFILL = """INSERT INTO hbi.roadmap_hosts
+    SELECT projection.* FROM hbi.hosts, hbi.roadmap_host(
+        hosts.id, hosts.org_id, hosts.system_profile_facts::jsonb, hosts.stale_timestamp, hosts.modified_on
+    ) AS projection
+    ON CONFLICT (id) DO NOTHING"""
+
+
+# Host counts per org, OS version, and lifecycle type, kept current by a trigger on hbi.roadmap_hosts.
+# Hosts are bucketed by the hour of their stale_timestamp so counts can still be filtered by staleness.
+ROADMAP_RHEL_COUNTS_TABLE = """CREATE TABLE IF NOT EXISTS hbi.roadmap_rhel_counts (
+    org_id character varying(36) NOT NULL,
+    stale_bucket timestamp with time zone NOT NULL,
+    lifecycle text NOT NULL,
+    os_name text,
+    os_major integer,
+    os_minor integer,
+    count bigint NOT NULL,
+    UNIQUE NULLS NOT DISTINCT (org_id, stale_bucket, lifecycle, os_name, os_major, os_minor)
+)"""
+
+ROADMAP_RHEL_COUNTS_SYNC_FUNCTION = """CREATE OR REPLACE FUNCTION hbi.roadmap_rhel_counts_sync() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE hbi.roadmap_rhel_counts;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND (
+        OLD.org_id, date_trunc('hour', OLD.stale_timestamp, 'UTC'), OLD.lifecycle, OLD.os_name, OLD.os_major, OLD.os_minor
+    ) IS NOT DISTINCT FROM (
+        NEW.org_id, date_trunc('hour', NEW.stale_timestamp, 'UTC'), NEW.lifecycle, NEW.os_name, NEW.os_major, NEW.os_minor
+    ) THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE hbi.roadmap_rhel_counts SET count = count - 1
+        WHERE org_id = OLD.org_id
+            AND stale_bucket = date_trunc('hour', OLD.stale_timestamp, 'UTC')
+            AND lifecycle = OLD.lifecycle
+            AND os_name IS NOT DISTINCT FROM OLD.os_name
+            AND os_major IS NOT DISTINCT FROM OLD.os_major
+            AND os_minor IS NOT DISTINCT FROM OLD.os_minor;
+        DELETE FROM hbi.roadmap_rhel_counts
+        WHERE org_id = OLD.org_id
+            AND stale_bucket = date_trunc('hour', OLD.stale_timestamp, 'UTC')
+            AND count <= 0;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO hbi.roadmap_rhel_counts
+        VALUES (
+            NEW.org_id, date_trunc('hour', NEW.stale_timestamp, 'UTC'), NEW.lifecycle,
+            NEW.os_name, NEW.os_major, NEW.os_minor, 1
+        )
+        ON CONFLICT (org_id, stale_bucket, lifecycle, os_name, os_major, os_minor)
+        DO UPDATE SET count = roadmap_rhel_counts.count + 1;
+    END IF;
+
+    RETURN NULL;
+END
+$$"""
+
+ROADMAP_RHEL_COUNTS_BACKFILL = """INSERT INTO hbi.roadmap_rhel_counts
+    SELECT org_id, date_trunc('hour', stale_timestamp, 'UTC'), lifecycle, os_name, os_major, os_minor, count(*)
+    FROM hbi.roadmap_hosts
+    GROUP BY 1, 2, 3, 4, 5, 6"""
+
+
+def check_or_create_roadmap_rhel_counts(logger, session):
+    check_table = (
+        "SELECT table_name FROM information_schema.tables"
+        " WHERE table_schema = 'hbi' AND table_name = 'roadmap_rhel_counts'"
+    )
+    created = not _db_exists(logger, session, check_table)
+    session.execute(sa_text(ROADMAP_RHEL_COUNTS_TABLE))
+    session.execute(sa_text(ROADMAP_RHEL_COUNTS_SYNC_FUNCTION))
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER roadmap_rhel_counts_sync AFTER INSERT OR UPDATE OR DELETE ON hbi.roadmap_hosts"
+            " FOR EACH ROW EXECUTE FUNCTION hbi.roadmap_rhel_counts_sync()"
+        )
+    )
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER roadmap_rhel_counts_truncate AFTER TRUNCATE ON hbi.roadmap_hosts"
+            " FOR EACH STATEMENT EXECUTE FUNCTION hbi.roadmap_rhel_counts_sync()"
+        )
+    )
+    # hbi.roadmap_hosts is written by a trigger running in the subscription's apply worker,
+    # so its triggers must also be enabled ALWAYS.
+    session.execute(sa_text("ALTER TABLE hbi.roadmap_hosts ENABLE ALWAYS TRIGGER roadmap_rhel_counts_sync"))
+    session.execute(sa_text("ALTER TABLE hbi.roadmap_hosts ENABLE ALWAYS TRIGGER roadmap_rhel_counts_truncate"))
+    if created:
+        session.execute(sa_text("LOCK TABLE hbi.roadmap_hosts IN SHARE MODE"))
+        session.execute(sa_text(ROADMAP_RHEL_COUNTS_BACKFILL))
+
+    session.commit()
+    if created:
+        logger.info("hbi.roadmap_rhel_counts created.")
+
+
+def check_or_create_roadmap_hosts(logger, session, engine):
+    check_table = (
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = 'hbi' AND table_name = 'roadmap_hosts'"
+    )
+    created = not _db_exists(logger, session, check_table)
+    session.execute(sa_text(ROADMAP_HOSTS_TABLE))
+    session.execute(sa_text(ROADMAP_HOST_FUNCTION))
+    session.execute(sa_text(ROADMAP_HOSTS_SYNC_FUNCTION))
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER roadmap_hosts_sync AFTER INSERT OR UPDATE OR DELETE ON hbi.hosts"
+            " FOR EACH ROW EXECUTE FUNCTION hbi.roadmap_hosts_sync()"
+        )
+    )
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER roadmap_hosts_truncate AFTER TRUNCATE ON hbi.hosts"
+            " FOR EACH STATEMENT EXECUTE FUNCTION hbi.roadmap_hosts_sync()"
+        )
+    )
+    # Triggers do not fire for changes applied by a subscription unless enabled ALWAYS.
+    session.execute(sa_text("ALTER TABLE hbi.hosts ENABLE ALWAYS TRIGGER roadmap_hosts_sync"))
+    session.execute(sa_text("ALTER TABLE hbi.hosts ENABLE ALWAYS TRIGGER roadmap_hosts_truncate"))
+    if created:
+        # Lock out replicated writes while copying so no change falls between the backfill and the trigger.
+        session.execute(sa_text("LOCK TABLE hbi.hosts IN SHARE MODE"))
+        session.execute(sa_text(ROADMAP_HOSTS_BACKFILL))
+
+    session.commit()
+    if created:
+        logger.info("hbi.roadmap_hosts created.")
+
+    for name, definition in ROADMAP_HOSTS_INDEXES.items():
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(
+                sa_text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON hbi.roadmap_hosts {definition}")
+            )
+
+    check_or_create_roadmap_rhel_counts(logger, session)
+
+
+# Notify API workers of the org of every changed host so they can evict cached results.
+# Postgres folds identical notifications sent in one transaction, so a batch of changes
+# to one org is delivered once. An empty payload means every org changed.
+HOSTS_NOTIFY_CHANNEL = "roadmap_hosts_changed"
+HOSTS_NOTIFY_FUNCTION = f"""CREATE OR REPLACE FUNCTION hbi.hosts_notify() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        PERFORM pg_notify('{HOSTS_NOTIFY_CHANNEL}', '');
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('{HOSTS_NOTIFY_CHANNEL}', OLD.org_id);
+    ELSE
+        PERFORM pg_notify('{HOSTS_NOTIFY_CHANNEL}', NEW.org_id);
+        IF TG_OP = 'UPDATE' AND OLD.org_id IS DISTINCT FROM NEW.org_id THEN
+            PERFORM pg_notify('{HOSTS_NOTIFY_CHANNEL}', OLD.org_id);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$"""
+
+
+def check_or_create_hosts_notify(logger, session):
+    session.execute(sa_text(HOSTS_NOTIFY_FUNCTION))
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER hosts_notify AFTER INSERT OR UPDATE OR DELETE ON hbi.hosts"
+            " FOR EACH ROW EXECUTE FUNCTION hbi.hosts_notify()"
+        )
+    )
+    session.execute(
+        sa_text(
+            "CREATE OR REPLACE TRIGGER hosts_notify_truncate AFTER TRUNCATE ON hbi.hosts"
+            " FOR EACH STATEMENT EXECUTE FUNCTION hbi.hosts_notify()"
+        )
+    )
+    session.execute(sa_text("ALTER TABLE hbi.hosts ENABLE ALWAYS TRIGGER hosts_notify"))
+    session.execute(sa_text("ALTER TABLE hbi.hosts ENABLE ALWAYS TRIGGER hosts_notify_truncate"))
+    session.commit()
+    logger.debug("hbi.hosts notification trigger created.")
 
 
 def check_or_create_schema(logger, session, engine):
@@ -168,6 +604,8 @@ def check_or_create_schema(logger, session, engine):
     check_or_create_hosts_tables(logger, session)
     check_or_create_indexes(logger, engine)
     check_or_create_view(logger, engine)
+    check_or_create_roadmap_hosts(logger, session, engine)
+    check_or_create_hosts_notify(logger, session)
 
 
 def check_or_create_subscription(logger, session, engine):
@@ -177,25 +615,16 @@ def check_or_create_subscription(logger, session, engine):
         logger.debug(f"{hbi_subscription} found.")
         return
     logger.info(f"{hbi_subscription} not found.")
-    hbi_file_list = [
-        "/etc/db/hbi/db_host",
-        "/etc/db/hbi/db_port",
-        "/etc/db/hbi/db_name",
-        "/etc/db/hbi/db_user",
-        "/etc/db/hbi/db_password",
-    ]
-    if all(list(map(os.path.isfile, hbi_file_list))):
-        logger.info("HBI secret files exist.")
-        with open("/etc/db/hbi/db_host") as file:
-            hbi_host = file.read().rstrip()
-        with open("/etc/db/hbi/db_port") as file:
-            hbi_port = file.read().rstrip()
-        with open("/etc/db/hbi/db_name") as file:
-            hbi_db_name = file.read().rstrip()
-        with open("/etc/db/hbi/db_user") as file:
-            hbi_user = file.read().rstrip()
-        with open("/etc/db/hbi/db_password") as file:
-            hbi_password = file.read().rstrip()
+    hbi = _hbi_connection_info()
+    if hbi is None:
+        sys.exit("Missing HBI database connection information.")
+
+    logger.info("HBI secret files exist.")
+    hbi_host = hbi["db_host"]
+    hbi_port = hbi["db_port"]
+    hbi_db_name = hbi["db_name"]
+    hbi_user = hbi["db_user"]
+    hbi_password = hbi["db_password"]
     db_ssl_mode = os.getenv("DB_SSL_MODE", "")
     ssl_connect = ""
     if db_ssl_mode and os.path.isfile("/etc/db/rdsclientca/rds_cacert"):
@@ -256,7 +685,7 @@ def drop_table(logger, engine):
     if not os.getenv("DROP_HBI_TABLE"):
         return
 
-    statement = "DROP TABLE IF EXISTS hbi.hosts CASCADE"
+    statement = "DROP TABLE IF EXISTS hbi.hosts, hbi.roadmap_hosts, hbi.roadmap_rhel_counts CASCADE"
     with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
         connection.execute(sa_text(statement))
         logger.info("hosts table was dropped.")
@@ -287,6 +716,12 @@ def main(logger):
 
 
 if __name__ == "__main__":
+    # Configured here so importing the DDL helpers, as scripts/load_host_data.py does, has no side effects
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
     logger = logging.getLogger(f"{LOGGER_NAME}")
     sys.excepthook = partial(_excepthook, logger)
 
@@ -0,0 +1,439 @@
+import asyncio
+import datetime
+import logging
+import time
+import typing as t
+import urllib.parse
+import zlib
+
+from collections import OrderedDict
+from contextlib import suppress
+
+import orjson
+import redis.asyncio
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
+
+from roadmap.config import Settings
+from roadmap.invalidation import add_listener
+from roadmap.invalidation import remove_listener
+from roadmap.metrics import COALESCED_REQUESTS
+from roadmap.metrics import RESPONSE_CACHE_ENTRY_BYTES
+from roadmap.metrics import RESPONSE_CACHE_REQUESTS
+
+
+logger = logging.getLogger("uvicorn.error")
+
+_cache: "ResponseCache | None" = None
+
+
+class CacheBackend(t.Protocol):
+    """Storage for serialized responses.
+
+    Keys start with the org_id followed by a colon.
+    """
+
+    async def get(self, key: str) -> bytes | None: ...
+
+    async def set(self, key: str, value: bytes, ttl: float): ...
+
+    def evict_org(self, org_id: str | None): ...
+
+    async def close(self): ...
+
+
+class MemoryBackend:
+    """Keep responses in this process.
+
+    The least recently used entry is evicted once max_entries are stored.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # Values are the time.monotonic() the entry expires and the entry
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            return None
+
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def evict_org(self, org_id: str | None):
+        if org_id is None:
+            self._entries.clear()
+            return
+
+        prefix = f"{org_id}:"
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    async def close(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """Share responses between processes through a server that speaks the Redis protocol.
+
+    Entries expire on the server, which is also responsible for evicting entries
+    when it is full. Stale entries are never used since each entry is validated
+    against the org's watermark, so they are left to expire rather than deleted
+    on host change notifications.
+
+    The cache is an optimization, so errors talking to the server are logged and
+    treated as a miss.
+    """
+
+    prefix = "roadmap:response:"
+
+    def __init__(self, url: str, timeout: float):
+        self.client = redis.asyncio.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    async def get(self, key: str) -> bytes | None:
+        try:
+            return await self.client.get(f"{self.prefix}{key}")
+        except (RedisError, OSError) as exc:
+            logger.warning(f"Unable to read from the response cache: {exc}")
+            return None
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        try:
+            await self.client.set(f"{self.prefix}{key}", value, px=max(int(ttl * 1000), 1))
+        except (RedisError, OSError) as exc:
+            logger.warning(f"Unable to write to the response cache: {exc}")
+
+    def evict_org(self, org_id: str | None):
+        pass
+
+    async def close(self):
+        await self.client.aclose()
+
+
+class ResponseCache:
+    """Cache computed responses in a backend.
+
+    Responses are stored as compressed JSON along with the watermark of the org's
+    hosts when they were computed. A response is current if it has the same watermark
+    and has not expired. Responses with support statuses expire when the first of
+    those statuses changes.
+
+    Responses computed at most max_stale seconds ago are also returned when they are
+    not current, marked as stale so they can be recomputed in the background. Responses
+    whose support statuses have changed are never returned.
+    """
+
+    def __init__(self, backend: CacheBackend, max_stale: float = 0):
+        self.backend = backend
+        self.max_stale = max_stale
+
+    async def lookup(self, key: str, watermark: tuple, ttl: float, stale: bool = True) -> "CachedResponse":
+        """Return the cached response for key.
+
+        If stale is False, only return a current response.
+        """
+        token = watermark_token(watermark)
+        cached = CachedResponse(self, key, token, ttl)
+        data = await self.backend.get(key)
+        if data is None:
+            RESPONSE_CACHE_REQUESTS.labels("miss").inc()
+            return cached
+
+        entry = orjson.loads(zlib.decompress(data))
+        now = time.time()
+        age = now - entry["computed_on"]
+        status_change = entry.get("status_change")
+        if entry["watermark"] == token and now < entry["expires"]:
+            RESPONSE_CACHE_REQUESTS.labels("hit").inc()
+        elif stale and age <= self.max_stale and (status_change is None or now < status_change):
+            RESPONSE_CACHE_REQUESTS.labels("stale").inc()
+            cached.stale = True
+        else:
+            RESPONSE_CACHE_REQUESTS.labels("invalid").inc()
+            return cached
+
+        cached.hit = True
+        cached.value = entry["value"]
+        if isinstance(cached.value, dict) and "meta" in cached.value:
+            # Report the age in RelevantMeta
+            cached.value["meta"]["age"] = int(age)
+
+        return cached
+
+    async def store(self, key: str, token: str, value: t.Any, ttl: float, status_change: datetime.date | None = None):
+        """Store value for at most ttl seconds.
+
+        If status_change is given, value expires at the start of that day instead if it is sooner.
+        """
+        now = time.time()
+        # Keep the entry while it may still be returned as stale
+        keep = max(ttl, self.max_stale)
+        expires = now + ttl
+        if status_change is not None:
+            # Local midnight, since statuses are calculated from date.today()
+            changes_at = datetime.datetime.combine(status_change, datetime.time()).timestamp()
+            keep = min(keep, changes_at - now)
+            expires = min(expires, changes_at)
+        else:
+            changes_at = None
+
+        entry = {
+            "watermark": token,
+            "computed_on": now,
+            "expires": expires,
+            "status_change": changes_at,
+            "value": jsonable_encoder(value),
+        }
+        data = zlib.compress(orjson.dumps(entry))
+        RESPONSE_CACHE_ENTRY_BYTES.observe(len(data))
+        await self.backend.set(key, data, keep)
+
+    def evict_org(self, org_id: str | None):
+        """Evict entries for an org. Called when a host change notification is received.
+
+        Entries are kept if outdated responses may be returned, since they are
+        recomputed in the background when they are next requested.
+        """
+        if not self.max_stale:
+            self.backend.evict_org(org_id)
+
+    async def close(self):
+        await self.backend.close()
+
+
+# The result of a flight that ended without a response
+ABORTED = object()
+
+
+class SingleFlight:
+    """Share one computation between concurrent requests with the same key.
+
+    The first request starts a flight and computes the response. Requests for
+    the same key that arrive before it lands wait for its result instead.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, asyncio.Future] = {}
+
+    async def join(self, key: str) -> t.Any:
+        """Wait for the flight in progress for key.
+
+        Return ABORTED if there is none or it ended without a response.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            return ABORTED
+
+        # Do not cancel the flight for everyone else if this request is canceled
+        value = await asyncio.shield(flight)
+        if value is not ABORTED:
+            COALESCED_REQUESTS.inc()
+
+        return value
+
+    def start(self, key: str) -> asyncio.Future:
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        return flight
+
+    def land(self, key: str, flight: asyncio.Future, value: t.Any = ABORTED):
+        """End the flight and pass value to the waiting requests."""
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+        if not flight.done():
+            flight.set_result(value)
+
+
+IN_FLIGHT = SingleFlight()
+
+
+class CachedResponse:
+    """The result of looking up a response in the cache for one request.
+
+    On a miss, the endpoint computes the response and stores it with set().
+    On a hit, value is the cached response or the response computed by a
+    concurrent request.
+    """
+
+    def __init__(
+        self,
+        cache: ResponseCache | None = None,
+        key: str = "",
+        token: str = "",
+        ttl: float = 0,
+    ):
+        self.cache = cache
+        self.key = key
+        self.token = token
+        self.ttl = ttl
+        self.hit = False
+        # True if value is outdated and should be recomputed
+        self.stale = False
+        self.value = None
+        # Set when other requests may be waiting for this response
+        self.flight: asyncio.Future | None = None
+
+    async def set(self, value: t.Any, status_change: datetime.date | None = None):
+        """Store the computed response.
+
+        status_change is the first date on which a support status in value changes.
+        """
+        if self.flight is not None:
+            IN_FLIGHT.land(self.key, self.flight, value)
+
+        if self.cache is None:
+            return
+
+        await self.cache.store(self.key, self.token, value, self.ttl, status_change)
+
+
+# Used when caching is disabled or a dependency is called directly
+NOT_CACHED = CachedResponse()
+
+
+def cache_key(org_id: str, endpoint: str, params: t.Iterable[tuple[str, t.Any]]) -> str:
+    """Build a cache key. Responses depend on the app stream catalog and RHEL lifecycle dates,
+    so their version is part of the key."""
+    # roadmap.catalog imports roadmap.data, which imports roadmap.common, which imports this module.
+    from roadmap.catalog import DATA_VERSION
+
+    query = urllib.parse.urlencode(sorted((str(name), str(value)) for name, value in params))
+    return f"{org_id}:{DATA_VERSION}:{endpoint}?{query}"
+
+
+def watermark_token(watermark: tuple) -> str:
+    return orjson.dumps(watermark, default=str).decode()
+
+
+# Set in the scope of requests that recompute an outdated response
+REVALIDATE_SCOPE_KEY = "roadmap.revalidate"
+
+# Set in the scope of requests that fill the cache at startup. They are not made
+# on behalf of a user, so RBAC is not queried for them.
+WARM_UP_SCOPE_KEY = "roadmap.warm_up"
+
+# Scope keys copied from a request to the request that recomputes its response
+_REVALIDATE_SCOPE_KEYS = (
+    "type",
+    "asgi",
+    "http_version",
+    "method",
+    "scheme",
+    "server",
+    "client",
+    "root_path",
+    "path",
+    "raw_path",
+    "query_string",
+    "headers",
+    "state",
+)
+
+_revalidations: dict[str, asyncio.Task] = {}
+
+
+def schedule_revalidation(request: Request, key: str):
+    """Recompute the response to request in the background.
+
+    The request is sent through the application again, marked so that it does
+    not accept an outdated response. Only one recompute runs for each key.
+    """
+    if key in _revalidations:
+        return
+
+    scope = {name: value for name, value in request.scope.items() if name in _REVALIDATE_SCOPE_KEYS}
+    scope[REVALIDATE_SCOPE_KEY] = True
+    task = asyncio.create_task(_revalidate(request.app, scope))
+    _revalidations[key] = task
+    task.add_done_callback(lambda task: _revalidations.pop(key, None))
+
+
+async def _revalidate(app: t.Callable, scope: dict):
+    try:
+        status = await send_request(app, scope)
+    except Exception:
+        logger.exception(f"Error recomputing the response to {scope['path']}")
+        return
+
+    if status != 200:
+        logger.warning(f"Recomputing the response to {scope['path']} failed with status {status}")
+
+
+async def send_request(app: t.Callable, scope: dict) -> int | None:
+    """Send a request without a body through the application and return the response status.
+
+    The response body is discarded.
+    """
+    received = asyncio.Event()
+    status = None
+
+    async def receive():
+        if received.is_set():
+            # Like a client that stays connected until the response is sent
+            await asyncio.Event().wait()
+
+        received.set()
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def create_backend(settings: Settings) -> CacheBackend:
+    if settings.response_cache_backend == "redis":
+        return RedisBackend(settings.redis_url, settings.redis_timeout)
+
+    return MemoryBackend(settings.response_cache_size)
+
+
+def get_response_cache(settings: Settings) -> ResponseCache:
+    """Return the process wide response cache, creating it on first use.
+
+    Entries for an org are evicted when a host change notification is received for it.
+    """
+    global _cache
+
+    if _cache is None:
+        _cache = ResponseCache(create_backend(settings), settings.response_cache_max_stale)
+        add_listener(_cache.evict_org)
+
+    return _cache
+
+
+async def close_response_cache():
+    """Close the connection to the cache backend and discard the process wide cache."""
+    global _cache
+
+    for task in list(_revalidations.values()):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+    if _cache is not None:
+        remove_listener(_cache.evict_org)
+        await _cache.close()
+
+    _cache = None
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import text
+
+from roadmap.data.app_streams import APP_STREAM_MODULES_BY_KEY
+from roadmap.data.app_streams import APP_STREAM_PACKAGES
+from roadmap.data.app_streams import AppStreamEntity
+from roadmap.data.systems import OS_LIFECYCLE_DATES
+
+
+logger = logging.getLogger("uvicorn.error")
+
+CATALOG_DDL = (
+    """CREATE TABLE IF NOT EXISTS app_stream_catalog (
+        impl text NOT NULL,
+        name text NOT NULL,
+        os_major integer,
+        stream text NOT NULL,
+        application_stream_name text NOT NULL,
+        start_date date,
+        end_date date,
+        rolling boolean NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS app_stream_catalog_module_index ON app_stream_catalog (name, os_major, stream)"
+    " WHERE impl = 'dnf_module'",
+    "CREATE INDEX IF NOT EXISTS app_stream_catalog_package_index ON app_stream_catalog (name) WHERE impl = 'package'",
+    """CREATE TABLE IF NOT EXISTS app_stream_catalog_version (
+        version text NOT NULL,
+        loaded_on timestamp with time zone NOT NULL
+    )""",
+)
+
+
+def catalog_entries() -> list[AppStreamEntity]:
+    """Return the entries used for matching hosts to app streams.
+
+    Modules are deduplicated by (name, os_major, stream) the same way as
+    APP_STREAM_MODULES_BY_KEY so the database matches the Python lookups.
+    """
+    return [*APP_STREAM_MODULES_BY_KEY.values(), *APP_STREAM_PACKAGES.values()]
+
+
+def get_catalog_version(entries: list[BaseModel]) -> str:
+    digest = hashlib.sha256()
+    for entry in entries:
+        digest.update(entry.model_dump_json().encode())
+
+    return digest.hexdigest()[:16]
+
+
+CATALOG_VERSION = get_catalog_version(catalog_entries())
+# Cached relevant responses are computed from the catalog and RHEL lifecycle dates
+DATA_VERSION = get_catalog_version([*catalog_entries(), *OS_LIFECYCLE_DATES.values()])
+
+
+async def load_app_stream_catalog(engine: AsyncEngine) -> bool:
+    """Create the app_stream_catalog table and load the catalog into it.
+
+    The table is only rewritten when the stored version differs from this
+    release's catalog. Return True if the catalog was loaded.
+    """
+    entries = catalog_entries()
+    async with engine.begin() as connection:
+        # Serialize loading between processes starting at the same time
+        await connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('app_stream_catalog'))"))
+        for statement in CATALOG_DDL:
+            await connection.execute(text(statement))
+
+        result = await connection.execute(text("SELECT version FROM app_stream_catalog_version"))
+        if result.scalar() == CATALOG_VERSION:
+            logger.debug(f"App stream catalog {CATALOG_VERSION} is already loaded")
+            return False
+
+        await connection.execute(text("DELETE FROM app_stream_catalog"))
+        await connection.execute(
+            text(
+                """INSERT INTO app_stream_catalog
+                    (impl, name, os_major, stream, application_stream_name, start_date, end_date, rolling)
+                VALUES
+                    (:impl, :name, :os_major, :stream, :application_stream_name, :start_date, :end_date, :rolling)"""
+            ),
+            [
+                {
+                    "impl": str(entry.impl),
+                    "name": entry.name,
+                    "os_major": entry.os_major,
+                    "stream": entry.stream,
+                    "application_stream_name": entry.application_stream_name,
+                    "start_date": entry.start_date,
+                    "end_date": entry.end_date,
+                    "rolling": entry.rolling,
+                }
+                for entry in entries
+            ],
+        )
+        await connection.execute(text("DELETE FROM app_stream_catalog_version"))
+        await connection.execute(
+            text("INSERT INTO app_stream_catalog_version (version, loaded_on) VALUES (:version, now())"),
+            {"version": CATALOG_VERSION},
+        )
+
+    logger.info(f"Loaded {len(entries)} app stream catalog entries, version {CATALOG_VERSION}")
+    return True
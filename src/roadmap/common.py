@@ -1,22 +1,44 @@
+import asyncio
 import base64
 import json
 import logging
 import typing as t
-import urllib.parse
-import urllib.request
 
+from contextlib import aclosing
+from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack
+from contextlib import suppress
 from datetime import date
-from urllib.error import HTTPError
 
 from fastapi import Depends
 from fastapi import Header
 from fastapi import HTTPException
+from fastapi import Request
+from psycopg.errors import QueryCanceled
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncResult
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import text
 
+from roadmap.cache import ABORTED
+from roadmap.cache import cache_key
+from roadmap.cache import CachedResponse
+from roadmap.cache import get_response_cache
+from roadmap.cache import IN_FLIGHT
+from roadmap.cache import NOT_CACHED
+from roadmap.cache import REVALIDATE_SCOPE_KEY
+from roadmap.cache import schedule_revalidation
+from roadmap.cache import WARM_UP_SCOPE_KEY
 from roadmap.config import Settings
-from roadmap.database import get_db
+from roadmap.database import get_read_db
+from roadmap.database import set_statement_timeout
+from roadmap.metrics import DB_QUERY_ROWS
+from roadmap.metrics import HOST_FETCH_BATCH_ROWS
+from roadmap.metrics import HOST_FETCH_BATCHES
+from roadmap.models import HostStaleness
 from roadmap.models import LifecycleType
+from roadmap.rbac import get_rbac_client
 
 
 logger = logging.getLogger("uvicorn.error")
@@ -24,7 +46,8 @@ logger = logging.getLogger("uvicorn.error")
 
 class HealthCheckFilter(logging.Filter):
     def filter(self, record: logging.LogRecord) -> bool:
-        return record.getMessage().find("/v1/ping") == -1
+        message = record.getMessage()
+        return "/v1/ping" not in message and "/v1/ready" not in message
 
 
 async def decode_header(
@@ -43,10 +66,11 @@ async def decode_header(
 
 
 async def query_rbac(
+    request: Request,
     settings: t.Annotated[Settings, Depends(Settings.create)],
     x_rh_identity: t.Annotated[str | None, Header(include_in_schema=False)] = None,
 ) -> list[dict[t.Any, t.Any]]:
-    if settings.dev:
+    if settings.dev or request.scope.get(WARM_UP_SCOPE_KEY):
         return [
             {
                 "permission": "inventory:*:*",
@@ -54,28 +78,10 @@ async def query_rbac(
             }
         ]
 
-    params = {
-        "application": "inventory",
-        "limit": 1000,
-    }
-
-    headers = {"X-RH-Identity": x_rh_identity} if x_rh_identity else {}
     if not settings.rbac_url:
         return [{}]
 
-    req = urllib.request.Request(
-        f"{settings.rbac_url}/api/rbac/v1/access/?{urllib.parse.urlencode(params, doseq=True)}",
-        headers=headers,
-    )
-
-    try:
-        with urllib.request.urlopen(req) as response:
-            data = json.load(response)
-    except HTTPError as err:
-        logger.error(f"Problem querying RBAC: {err}")
-        raise HTTPException(status_code=err.code, detail=err.msg)
-
-    return data.get("data", [{}])
+    return await get_rbac_client(settings).get_access(x_rh_identity)
 
 
 async def check_inventory_access(
@@ -102,15 +108,110 @@ async def check_inventory_access(
     return resource_definitions
 
 
-# FIXME: This should be cached
-async def query_host_inventory(
-    org_id: t.Annotated[str, Depends(decode_header)],
-    session: t.Annotated[AsyncSession, Depends(get_db)],
-    settings: t.Annotated[Settings, Depends(Settings.create)],
-    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+SYSTEM_PROFILE_FIELDS = {
+    "operating_system": "system_profile_facts -> 'operating_system'",
+    "installed_products": "system_profile_facts -> 'installed_products'",
+    "dnf_modules": "system_profile_facts -> 'dnf_modules'",
+    "installed_packages": "system_profile_facts -> 'installed_packages'",
+}
+
+# hbi.roadmap_hosts is kept current from hbi.hosts by a trigger created in scripts/replication.py.
+# It stores the OS version, lifecycle type, and package names already extracted from the system
+# profile. Precomputed values are returned under the key given here instead of the field name.
+ROADMAP_HOSTS_FIELDS = {
+    "operating_system": (
+        "operating_system",
+        "jsonb_build_object('name', os_name, 'major', os_major, 'minor', os_minor)",
+    ),
+    "installed_products": ("lifecycle", "to_jsonb(lifecycle)"),
+    "dnf_modules": ("dnf_modules", "dnf_modules"),
+    "installed_packages": ("package_names", "to_jsonb(package_names)"),
+}
+
+# Return only the package names in the :packages parameter. This keeps package names
+# that cannot match an app stream from being sent to the application.
+ROADMAP_HOSTS_PACKAGE_FILTER_SQL = (
+    "to_jsonb(ARRAY(SELECT name FROM unnest(package_names) AS name WHERE name = ANY(CAST(:packages AS text[]))))"
+)
+
+HOST_TABLES = {
+    "hosts": "hbi.hosts",
+    "roadmap_hosts": "hbi.roadmap_hosts",
+}
+
+# These must exactly match the expressions in the hosts_org_id_os_version_index
+# created by scripts/replication.py so the index can be used for filtering.
+OS_MAJOR_SQL = "system_profile_facts #>> '{operating_system,major}'"
+OS_MINOR_SQL = "system_profile_facts #>> '{operating_system,minor}'"
+
+# Hosts become stale at stale_timestamp, reach stale warning seven days later,
+# and are culled fourteen days later. These match hbi.hosts_view.
+# Hosts are included if stale_timestamp is after the cutoff.
+STALENESS_CUTOFF_SQL = {
+    HostStaleness.fresh: "now()",
+    HostStaleness.stale: "now() - INTERVAL '7 days'",
+    HostStaleness.stale_warning: "now() - INTERVAL '14 days'",
+    HostStaleness.culled: "",
+}
+
+# Comparing stale_timestamp directly allows hosts_stale_timestamp_index to be used.
+STALENESS_SQL = {
+    staleness: f"stale_timestamp > {cutoff}" if cutoff else "" for staleness, cutoff in STALENESS_CUTOFF_SQL.items()
+}
+
+# Keep in sync with get_lifecycle_type()
+LIFECYCLE_TYPE_SQL = f"""CASE
+                WHEN system_profile_facts -> 'installed_products' @> '[{{"id": "241"}}]' THEN '{LifecycleType.e4s}'
+                WHEN system_profile_facts -> 'installed_products' @> '[{{"id": "204"}}]' THEN '{LifecycleType.els}'
+                WHEN system_profile_facts -> 'installed_products' @> ANY (
+                    ARRAY['[{{"id": "70"}}]', '[{{"id": "73"}}]', '[{{"id": "75"}}]']::jsonb[]
+                ) THEN '{LifecycleType.eus}'
+                ELSE '{LifecycleType.mainline}'
+            END"""
+
+
+def _host_filter(
     major: int | None = None,
     minor: int | None = None,
-):
+    staleness: HostStaleness = HostStaleness.culled,
+    source: str = "hosts",
+) -> str:
+    query = "org_id = :org_id"
+    if staleness_filter := STALENESS_SQL[staleness]:
+        query = f"{query} AND {staleness_filter}"
+
+    if source == "hosts":
+        major_filter, minor_filter = f"{OS_MAJOR_SQL} = :major", f"{OS_MINOR_SQL} = :minor"
+    else:
+        major_filter, minor_filter = "os_major = CAST(:major AS integer)", "os_minor = CAST(:minor AS integer)"
+
+    if major is not None:
+        query = f"{query} AND {major_filter}"
+
+    if minor is not None:
+        query = f"{query} AND {minor_filter}"
+
+    return query
+
+
+def _host_params(
+    org_id: str,
+    major: int | None = None,
+    minor: int | None = None,
+    packages: t.Collection[str] | None = None,
+) -> dict[str, t.Any]:
+    params = {
+        "org_id": org_id,
+        "major": str(major),
+        "minor": str(minor),
+    }
+    if packages is not None:
+        params["packages"] = sorted(packages)
+
+    return params
+
+
+def _resolve_org_id(org_id: str, settings: Settings, groups: list[str]) -> str:
     if settings.dev:
         org_id = "1234"
 
@@ -118,27 +219,722 @@ async def query_host_inventory(
         # TODO: Implement group filtering
         raise HTTPException(501, detail="Group filtering is not yet implemented")
 
-    query = "SELECT * FROM hbi.hosts WHERE org_id = :org_id"
-    if major is not None:
-        query = f"{query} AND system_profile_facts #>> '{{operating_system,major}}' = :major"
+    return org_id
 
-    if minor is not None:
-        query = f"{query} AND system_profile_facts #>> '{{operating_system,minor}}' = :minor"
-
-    result = await session.stream(
-        text(query),
-        params={
-            "org_id": org_id,
-            "major": str(major),
-            "minor": str(minor),
-        },
+
+@asynccontextmanager
+async def cancel_on_disconnect(request: Request, session: AsyncSession, interval: float):
+    """Cancel the query running on the session if the client disconnects.
+
+    The client is polled in the background while the context is active.
+    """
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+
+    async def _watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(interval)
+
+        logger.info(f"Client disconnected from {request.url.path}, canceling query")
+        await driver_connection.cancel_safe()
+
+    task = asyncio.create_task(_watch())
+    try:
+        yield
+    finally:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+async def _raise_for_canceled(exc: DBAPIError, request: Request) -> t.NoReturn:
+    """Turn a canceled query into an HTTP error that explains why it was canceled."""
+    if not isinstance(exc.orig, QueryCanceled):
+        raise exc
+
+    if await request.is_disconnected():
+        raise HTTPException(499, detail="Client disconnected")
+
+    raise HTTPException(504, detail="Host inventory query timed out")
+
+
+def build_host_query(
+    fields: t.Iterable[str],
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+    source: str = "hosts",
+    filter_packages: bool = False,
+) -> str:
+    """Build a host inventory query that selects only the given system profile fields.
+
+    The selected fields are returned in a ``system_profile_facts`` object so consumers
+    can treat the result the same as the full system profile. When reading from
+    hbi.roadmap_hosts, precomputed fields use the keys in ROADMAP_HOSTS_FIELDS.
+
+    Set filter_packages to return only the package names in the :packages parameter.
+    This only applies to hbi.roadmap_hosts, where package names are already parsed.
+    """
+    try:
+        if source == "hosts":
+            projection = ", ".join(f"'{field}', {SYSTEM_PROFILE_FIELDS[field]}" for field in fields)
+        else:
+            columns = ROADMAP_HOSTS_FIELDS | (
+                {"installed_packages": ("package_names", ROADMAP_HOSTS_PACKAGE_FILTER_SQL)} if filter_packages else {}
+            )
+            projection = ", ".join("'{}', {}".format(*columns[field]) for field in fields)
+    except KeyError as err:
+        raise ValueError(f"Unknown system profile field {err}")
+
+    return (
+        f"SELECT id, jsonb_strip_nulls(jsonb_build_object({projection})) AS system_profile_facts"
+        f" FROM {HOST_TABLES[source]} WHERE {_host_filter(major, minor, staleness, source)}"
     )
-    yield result
+
+
+def build_host_page_query(
+    fields: t.Iterable[str],
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+    after_id: bool = False,
+    source: str = "hosts",
+    filter_packages: bool = False,
+) -> str:
+    """Build a query for one page of hosts ordered by id.
+
+    This walks the (org_id, id) index. Set after_id to start after the :last_id parameter.
+    """
+    query = build_host_query(fields, major, minor, staleness, source, filter_packages)
+    if after_id:
+        query = f"{query} AND id > :last_id"
+
+    return f"{query} ORDER BY id LIMIT :limit"
+
+
+def build_host_count_query(
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+    source: str = "hosts",
+) -> str:
+    """Build a query that counts hosts by OS name, version, and lifecycle type.
+
+    Hosts without a system profile are counted in a separate bucket with ``no_profile`` set.
+    A major or minor version that is not a number is counted as NULL.
+    hbi.roadmap_hosts does not record whether a profile was present, so those hosts are
+    counted as missing an OS instead.
+    """
+    if source == "roadmap_hosts":
+        return f"""
+        SELECT
+            false AS no_profile,
+            os_name AS name,
+            os_major AS major,
+            os_minor AS minor,
+            lifecycle,
+            count(*) AS count
+        FROM hbi.roadmap_hosts
+        WHERE {_host_filter(major, minor, staleness, source)}
+        GROUP BY 1, 2, 3, 4, 5
+    """
+
+    return f"""
+        SELECT
+            system_profile_facts IS NULL OR system_profile_facts = '{{}}'::jsonb AS no_profile,
+            system_profile_facts #>> '{{operating_system,name}}' AS name,
+            CASE WHEN {OS_MAJOR_SQL} ~ '^[0-9]+$' THEN ({OS_MAJOR_SQL})::int END AS major,
+            CASE WHEN {OS_MINOR_SQL} ~ '^[0-9]+$' THEN ({OS_MINOR_SQL})::int END AS minor,
+            {LIFECYCLE_TYPE_SQL} AS lifecycle,
+            count(*) AS count
+        FROM hbi.hosts
+        WHERE {_host_filter(major, minor, staleness)}
+        GROUP BY 1, 2, 3, 4, 5
+    """
+
+
+# Normalized package names, matching get_package_names()
+PACKAGE_NAMES_SQL = """ARRAY(
+                SELECT regexp_replace(split_part(package, ':', 1), '-[^-]*$', '')
+                FROM jsonb_array_elements_text(
+                    CASE WHEN jsonb_typeof(system_profile_facts -> 'installed_packages') = 'array'
+                    THEN system_profile_facts -> 'installed_packages' ELSE '[]' END
+                ) AS package
+            )"""
+
+
+def build_app_stream_matches_sql(source: str, where: str) -> str:
+    """Build the ``hosts`` and ``matches`` common table expressions used to match hosts to app streams.
+
+    ``matches`` has one row for each host and app stream it uses, including rolling app streams.
+    Only hosts from the source table that match the where clause are included.
+    """
+    if source == "hosts":
+        hosts = f"""
+            SELECT
+                id,
+                org_id,
+                stale_timestamp,
+                system_profile_facts #>> '{{operating_system,name}}' AS os_name,
+                CASE WHEN {OS_MAJOR_SQL} ~ '^[0-9]+$' THEN ({OS_MAJOR_SQL})::int END AS os_major,
+                CASE WHEN {OS_MINOR_SQL} ~ '^[0-9]+$' THEN ({OS_MINOR_SQL})::int END AS os_minor,
+                CASE WHEN jsonb_typeof(system_profile_facts -> 'dnf_modules') = 'array'
+                    THEN system_profile_facts -> 'dnf_modules' ELSE '[]' END AS dnf_modules,
+                {PACKAGE_NAMES_SQL} AS package_names
+            FROM hbi.hosts
+            WHERE {where}"""
+    else:
+        hosts = f"""
+            SELECT id, org_id, stale_timestamp, os_name, os_major, os_minor, dnf_modules, package_names
+            FROM hbi.roadmap_hosts
+            WHERE {where}"""
+
+    return f"""
+        hosts AS (
+            SELECT * FROM ({hosts}
+            ) AS source
+            WHERE os_name = 'RHEL'
+        ),
+        matches AS (
+            SELECT
+                hosts.id,
+                hosts.org_id,
+                hosts.stale_timestamp,
+                hosts.os_minor,
+                'dnf_module' AS impl,
+                module ->> 'name' AS name,
+                coalesce(catalog.application_stream_name, 'Unknown') AS application_stream_name,
+                module ->> 'stream' AS stream,
+                catalog.start_date,
+                catalog.end_date,
+                hosts.os_major,
+                coalesce(catalog.rolling, false) AS rolling
+            FROM hosts
+            CROSS JOIN LATERAL jsonb_array_elements(hosts.dnf_modules) AS module
+            LEFT JOIN app_stream_catalog AS catalog
+                ON catalog.impl = 'dnf_module'
+                AND catalog.name = module ->> 'name'
+                AND catalog.os_major = hosts.os_major
+                AND catalog.stream = module ->> 'stream'
+            -- Bug with Perl data currently. Omit for now.
+            WHERE strpos(lower(module ->> 'name'), 'perl') = 0
+                AND EXISTS (
+                    SELECT 1 FROM app_stream_catalog AS known
+                    WHERE known.impl = 'dnf_module'
+                        AND known.name = module ->> 'name'
+                        AND known.os_major = hosts.os_major
+                )
+            UNION ALL
+            SELECT
+                hosts.id,
+                hosts.org_id,
+                hosts.stale_timestamp,
+                hosts.os_minor,
+                'package' AS impl,
+                catalog.application_stream_name AS name,
+                catalog.application_stream_name,
+                catalog.stream,
+                catalog.start_date,
+                catalog.end_date,
+                hosts.os_major,
+                catalog.rolling
+            FROM hosts
+            CROSS JOIN LATERAL unnest(hosts.package_names) AS package(name)
+            JOIN app_stream_catalog AS catalog
+                ON catalog.impl = 'package'
+                AND catalog.name = package.name
+                AND catalog.os_major = hosts.os_major
+        )"""
+
+
+def build_app_stream_match_query(
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+    source: str = "hosts",
+) -> str:
+    """Build a query that matches hosts against the app_stream_catalog table.
+
+    Returns one row per non-rolling app stream with the ids of the hosts using it.
+    This gives the same result as app_streams_from_modules() and app_streams_from_packages().
+    """
+    return f"""
+        WITH {build_app_stream_matches_sql(source, _host_filter(major, minor, staleness, source))}
+        SELECT
+            impl, name, application_stream_name, stream, start_date, end_date, os_major,
+            array_agg(DISTINCT id) AS systems
+        FROM matches
+        WHERE NOT rolling
+        GROUP BY impl, name, application_stream_name, stream, start_date, end_date, os_major
+    """
+
+
+def build_host_app_streams_query(
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+) -> str:
+    """Build a query that reads app streams from the host_app_streams table.
+
+    Returns the same rows as build_app_stream_match_query().
+    """
+    return f"""
+        SELECT
+            impl, name, application_stream_name, stream, start_date, end_date, os_major,
+            array_agg(host_id) AS systems
+        FROM host_app_streams
+        WHERE {_host_filter(major, minor, staleness, "host_app_streams")}
+        GROUP BY impl, name, application_stream_name, stream, start_date, end_date, os_major
+    """
+
+
+def build_watermark_query(
+    staleness: HostStaleness = HostStaleness.culled,
+    source: str = "hosts",
+    precomputed: bool = False,
+) -> str:
+    """Build a query for the current state of an org's hosts.
+
+    The result changes when a host is added, changed, or removed, and when a host
+    passes the staleness cutoff. If precomputed is True, it also changes when
+    host_app_streams is refreshed or deleted hosts are swept from it.
+    """
+    columns = ["max(modified_on) AS modified_on", "count(*) AS count"]
+    if staleness_filter := STALENESS_SQL[staleness]:
+        columns.append(f"count(*) FILTER (WHERE {staleness_filter}) AS current")
+
+    if precomputed:
+        columns.append("(SELECT max(watermark) FROM host_app_streams_state) AS refreshed")
+        columns.append("(SELECT max(generation) FROM host_app_streams_state) AS generation")
+
+    return f"SELECT {', '.join(columns)} FROM {HOST_TABLES[source]} WHERE org_id = :org_id"
+
+
+def _build_rollup_query(
+    rollup_table: str,
+    detail_table: str,
+    columns: str,
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+) -> str:
+    """Build a query that sums host counts from a rollup table.
+
+    Rollup rows count hosts by the hour of their stale_timestamp. Hours entirely after
+    the staleness cutoff are summed from the rollup. Hosts in the hour containing the
+    cutoff are counted from the detail table, so the result is exact.
+    """
+    where = _host_filter(major, minor, HostStaleness.culled, source=rollup_table)
+    if cutoff := STALENESS_CUTOFF_SQL[staleness]:
+        boundary = f"date_trunc('hour', {cutoff}, 'UTC') + INTERVAL '1 hour'"
+        counts = f"""
+            SELECT {columns}, count FROM {rollup_table}
+            WHERE {where} AND stale_bucket >= {boundary}
+            UNION ALL
+            SELECT {columns}, count(*) FROM {detail_table}
+            WHERE {where} AND stale_timestamp > {cutoff} AND stale_timestamp < {boundary}
+            GROUP BY {columns}"""
+    else:
+        counts = f"SELECT {columns}, count FROM {rollup_table} WHERE {where}"
+
+    return f"SELECT {columns}, sum(count)::int AS count FROM ({counts}) AS counts GROUP BY {columns}"
+
+
+def build_host_count_rollup_query(
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+) -> str:
+    """Build a query that reads host counts from hbi.roadmap_rhel_counts.
+
+    Returns the same rows as build_host_count_query() for hbi.roadmap_hosts.
+    """
+    rollup = _build_rollup_query(
+        "hbi.roadmap_rhel_counts",
+        "hbi.roadmap_hosts",
+        "os_name, os_major, os_minor, lifecycle",
+        major,
+        minor,
+        staleness,
+    )
+    return f"""
+        SELECT false AS no_profile, os_name AS name, os_major AS major, os_minor AS minor, lifecycle, count
+        FROM ({rollup}) AS rollup
+    """
+
+
+def build_app_stream_count_rollup_query(
+    major: int | None = None,
+    minor: int | None = None,
+    staleness: HostStaleness = HostStaleness.culled,
+) -> str:
+    """Build a query that reads app stream host counts from host_app_stream_counts.
+
+    Returns the same rows as build_host_app_streams_query() with a count instead of system ids.
+    """
+    return _build_rollup_query(
+        "host_app_stream_counts",
+        "host_app_streams",
+        "impl, name, application_stream_name, stream, start_date, end_date, os_major",
+        major,
+        minor,
+        staleness,
+    )
+
+
+class KeysetScan:
+    """Scan hosts one page at a time using keyset pagination on (org_id, id).
+
+    Each page is fetched in its own transaction, so a long scan never holds one
+    snapshot open. The id of the last host returned is kept as a checkpoint. If the
+    connection is lost, the page is retried from the checkpoint.
+
+    This provides the parts of AsyncResult used by iter_hosts().
+    """
+
+    retries = 1
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        settings: Settings,
+        fields: t.Iterable[str],
+        org_id: str,
+        major: int | None = None,
+        minor: int | None = None,
+        packages: t.Collection[str] | None = None,
+    ):
+        self.session = session
+        self.settings = settings
+        self.fields = fields
+        self.org_id = org_id
+        self.major = major
+        self.minor = minor
+        self.packages = packages
+        self.page_size = settings.db_fetch_batch_size
+        self.last_id = None
+        self.closed = False
+
+    def mappings(self):
+        return self
+
+    async def partitions(self) -> t.AsyncIterator[list[RowMapping]]:
+        while not self.closed:
+            rows = await self._fetch_page()
+            if rows:
+                self.last_id = rows[-1]["id"]
+                yield rows
+
+            if len(rows) < self.page_size:
+                break
+
+    async def close(self):
+        self.closed = True
+        await self.session.rollback()
+
+    async def _fetch_page(self) -> list[RowMapping]:
+        query = build_host_page_query(
+            self.fields,
+            self.major,
+            self.minor,
+            self.settings.host_staleness,
+            after_id=self.last_id is not None,
+            source=self.settings.host_source,
+            filter_packages=self.packages is not None,
+        )
+        params = _host_params(self.org_id, self.major, self.minor, self.packages) | {
+            "last_id": self.last_id,
+            "limit": self.page_size,
+        }
+
+        attempt = 0
+        while True:
+            try:
+                await set_statement_timeout(self.session, self.settings.db_statement_timeout)
+                result = await self.session.execute(
+                    text(query), params, execution_options={"statement_name": "host_page"}
+                )
+                rows = result.mappings().all()
+                await self.session.commit()
+                return rows
+            except DBAPIError as exc:
+                await self.session.rollback()
+                if not exc.connection_invalidated or attempt >= self.retries:
+                    raise
+
+                attempt += 1
+                logger.warning(f"Lost connection during host scan, resuming after {self.last_id}")
+
+
+async def open_inventory_db(
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    # Resolve access before opening a database session, so unauthorized requests never use a connection
+    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+):
+    """Provide a function that opens the read only session of the request on first use.
+
+    Every dependency of the request shares the session, and nothing is opened if no query is run.
+    """
+    async with AsyncExitStack() as stack:
+        session = None
+
+        async def open_session() -> AsyncSession:
+            nonlocal session
+            if session is None:
+                session = await anext(await stack.enter_async_context(aclosing(get_read_db(settings))))
+
+            return session
+
+        yield open_session
+
+
+async def cached_response(
+    request: Request,
+    org_id: t.Annotated[str, Depends(decode_header)],
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+    open_session: t.Annotated[t.Callable[[], t.Awaitable[AsyncSession]], Depends(open_inventory_db)],
+):
+    """Look up the response to this request in the response cache.
+
+    A cached response is only used if the org's hosts are in the same state as when
+    it was computed, so a hit costs one watermark query instead of a host scan.
+
+    If an identical request is already computing its response, wait for it and
+    use that response instead.
+
+    An outdated response may be used if it is recent enough. It is then recomputed
+    in the background so the next request gets a current response.
+
+    The result is shared with every dependency of the request, so query dependencies
+    can skip their queries on a hit.
+    """
+    if settings.response_cache_backend == "none" and not settings.coalesce_requests:
+        yield NOT_CACHED
+        return
+
+    org_id = _resolve_org_id(org_id, settings, groups)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", request.url.path)
+    params = [*request.path_params.items(), *request.query_params.multi_items()]
+    key = cache_key(org_id, endpoint, params)
+    flight = None
+    if settings.coalesce_requests:
+        if (value := await IN_FLIGHT.join(key)) is not ABORTED:
+            cached = CachedResponse(key=key)
+            cached.hit = True
+            cached.value = value
+            yield cached
+            return
+
+        # Start the flight before anything else is awaited, so identical requests
+        # arriving during the cache lookup wait for it as well
+        flight = IN_FLIGHT.start(key)
+
+    try:
+        if settings.response_cache_backend == "none":
+            cached = CachedResponse(key=key)
+        else:
+            query = build_watermark_query(
+                settings.host_staleness, settings.host_source, settings.app_stream_matching == "precomputed"
+            )
+            session = await open_session()
+            result = await session.execute(
+                text(query), params={"org_id": org_id}, execution_options={"statement_name": "watermark"}
+            )
+            watermark = tuple(result.one())
+
+            # A request recomputing an outdated response must not accept it
+            revalidating = request.scope.get(REVALIDATE_SCOPE_KEY, False)
+            cached = await get_response_cache(settings).lookup(
+                key, watermark, settings.response_cache_ttl, stale=not revalidating
+            )
+            if cached.stale:
+                schedule_revalidation(request, key)
+
+        if cached.hit:
+            if flight is not None:
+                IN_FLIGHT.land(key, flight, cached.value)
+        else:
+            cached.flight = flight
+
+        yield cached
+    finally:
+        if flight is not None:
+            # Release waiting requests if no response was computed
+            IN_FLIGHT.land(key, flight)
+
+
+async def get_inventory_db(
+    cached: t.Annotated[CachedResponse, Depends(cached_response)],
+    open_session: t.Annotated[t.Callable[[], t.Awaitable[AsyncSession]], Depends(open_inventory_db)],
+) -> AsyncSession | None:
+    """Return the read only session of the request, or None if the response is cached."""
+    if cached.hit:
+        return None
+
+    return await open_session()
+
+
+def host_inventory(*fields: str, packages: t.Collection[str] | None = None) -> t.Callable:
+    """Return a dependency that queries host inventory for the given system profile fields.
+
+    If packages is given, hosts read from hbi.roadmap_hosts only include those package names.
+    """
+    if not fields:
+        fields = tuple(SYSTEM_PROFILE_FIELDS)
+
+    # Fail at import time rather than on the first request
+    for source in HOST_TABLES:
+        build_host_query(fields, source=source)
+
+    async def _query_host_inventory(
+        request: Request,
+        org_id: t.Annotated[str, Depends(decode_header)],
+        settings: t.Annotated[Settings, Depends(Settings.create)],
+        groups: t.Annotated[list[str], Depends(check_inventory_access)],
+        session: t.Annotated[AsyncSession, Depends(get_inventory_db)],
+        major: int | None = None,
+        minor: int | None = None,
+    ):
+        org_id = _resolve_org_id(org_id, settings, groups)
+        if settings.host_scan_mode == "keyset":
+            # Each page is a short query, so the disconnect check between pages is enough.
+            yield KeysetScan(session, settings, fields, org_id, major, minor, packages)
+            return
+
+        query = build_host_query(
+            fields, major, minor, settings.host_staleness, settings.host_source, filter_packages=packages is not None
+        )
+        async with cancel_on_disconnect(request, session, settings.disconnect_poll_interval):
+            try:
+                result = await session.stream(
+                    text(query),
+                    params=_host_params(org_id, major, minor, packages),
+                    execution_options={"yield_per": settings.db_fetch_batch_size, "statement_name": "host_inventory"},
+                )
+            except DBAPIError as exc:
+                await _raise_for_canceled(exc, request)
+
+            yield result
+
+    return _query_host_inventory
+
+
+query_host_inventory = host_inventory(*SYSTEM_PROFILE_FIELDS)
+
+
+async def iter_hosts(result: AsyncResult, request: Request) -> t.AsyncIterator[RowMapping]:
+    """Iterate over host rows one batch at a time.
+
+    The batch size is set by the yield_per execution option of the query,
+    so only one batch is held in memory at once.
+
+    Stop fetching and close the server side cursor if the client disconnects.
+    """
+    batches = 0
+    rows = 0
+    partitions = result.mappings().partitions()
+    while True:
+        try:
+            partition = await anext(partitions)
+        except StopAsyncIteration:
+            break
+        except DBAPIError as exc:
+            await _raise_for_canceled(exc, request)
+
+        batches += 1
+        rows += len(partition)
+        HOST_FETCH_BATCH_ROWS.observe(len(partition))
+        for row in partition:
+            yield row
+
+        if await request.is_disconnected():
+            await result.close()
+            raise HTTPException(499, detail="Client disconnected")
+
+    HOST_FETCH_BATCHES.observe(batches)
+    DB_QUERY_ROWS.labels("host_inventory").observe(rows)
+    logger.debug(f"Fetched {rows} hosts in {batches} batches")
+
+
+async def query_host_counts(
+    request: Request,
+    org_id: t.Annotated[str, Depends(decode_header)],
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+    session: t.Annotated[AsyncSession, Depends(get_inventory_db)],
+    cached: t.Annotated[CachedResponse, Depends(cached_response)] = NOT_CACHED,
+    major: int | None = None,
+    minor: int | None = None,
+):
+    """Count hosts grouped by OS name, version, and lifecycle type unless the response is cached."""
+    if cached.hit:
+        return []
+
+    org_id = _resolve_org_id(org_id, settings, groups)
+    async with cancel_on_disconnect(request, session, settings.disconnect_poll_interval):
+        if settings.use_rollups:
+            query = build_host_count_rollup_query(major, minor, settings.host_staleness)
+        else:
+            query = build_host_count_query(major, minor, settings.host_staleness, settings.host_source)
+
+        try:
+            result = await session.execute(
+                text(query),
+                params=_host_params(org_id, major, minor),
+                execution_options={"statement_name": "host_counts"},
+            )
+        except DBAPIError as exc:
+            await _raise_for_canceled(exc, request)
+
+    rows = result.mappings().all()
+    DB_QUERY_ROWS.labels("host_counts").observe(len(rows))
+
+    return rows
+
+
+async def query_app_stream_matches(
+    request: Request,
+    org_id: t.Annotated[str, Depends(decode_header)],
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+    session: t.Annotated[AsyncSession, Depends(get_inventory_db)],
+    major: int | None = None,
+    minor: int | None = None,
+    include_systems: bool = True,
+):
+    """Match hosts against the app stream catalog in the database, returning one row per app stream."""
+    org_id = _resolve_org_id(org_id, settings, groups)
+    if settings.app_stream_matching != "precomputed":
+        query = build_app_stream_match_query(major, minor, settings.host_staleness, settings.host_source)
+    elif include_systems or not settings.use_rollups:
+        query = build_host_app_streams_query(major, minor, settings.host_staleness)
+    else:
+        query = build_app_stream_count_rollup_query(major, minor, settings.host_staleness)
+
+    async with cancel_on_disconnect(request, session, settings.disconnect_poll_interval):
+        try:
+            result = await session.execute(
+                text(query),
+                params=_host_params(org_id, major, minor),
+                execution_options={"statement_name": "app_stream_matches"},
+            )
+        except DBAPIError as exc:
+            await _raise_for_canceled(exc, request)
+
+    rows = result.mappings().all()
+    DB_QUERY_ROWS.labels("app_stream_matches").observe(len(rows))
+
+    return rows
 
 
 def get_lifecycle_type(products: list[dict[str, str]]) -> LifecycleType:
     """Calculate lifecycle type based on the product ID.
 
+    This is also done in the database by LIFECYCLE_TYPE_SQL. Changes here must be made there as well.
+
     https://downloads.corp.redhat.com/internal/products
     https://github.com/RedHatInsights/rhsm-subscriptions/tree/main/swatch-product-configuration/src/main/resources/subscription_configs/RHEL
 
@@ -164,6 +960,17 @@ def get_lifecycle_type(products: list[dict[str, str]]) -> LifecycleType:
     return type
 
 
+def get_package_names(packages: t.Iterable[str]) -> set[str]:
+    """Return the package names from a list of installed packages.
+
+    Packages are in the form ``name-epoch:version-release.arch``.
+
+    This is also done in the database by PACKAGE_NAMES_SQL and by hbi.roadmap_host()
+    in scripts/replication.py. Changes here must be made there as well.
+    """
+    return {package.split(":")[0].rsplit("-", 1)[0] for package in packages}
+
+
 def sort_attrs(attr, /, *attrs) -> t.Callable:
     def _getter(item):
         # If an attribute is None, use a 0 instead of None for the purpose of sorting
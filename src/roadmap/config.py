@@ -1,4 +1,6 @@
 import os
+import typing as t
+import urllib.parse
 
 from functools import lru_cache
 from pathlib import Path
@@ -11,6 +13,8 @@ from pydantic import SecretStr
 from pydantic_settings import BaseSettings
 from pydantic_settings import SettingsConfigDict
 
+from roadmap.models import HostStaleness
+
 
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="ROADMAP_", env_ignore_empty=True)
@@ -20,13 +24,91 @@ class Settings(BaseSettings):
     db_password: SecretStr = SecretStr("postgres")
     db_host: str = "localhost"
     db_port: int = 5432
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 3600
+    # Seconds to wait for a pooled connection to become available
+    db_pool_timeout: float = 30
+    # Seconds to wait for a new connection to be established. Zero waits as long as the OS does.
+    db_connect_timeout: int = 5
+    db_echo: bool = False
+    db_json_loader: t.Literal["json", "orjson"] = "orjson"
+    db_replica_urls: list[PostgresDsn] = []
+    # Seconds to wait before using a read replica again after it fails to connect or its pool is exhausted
+    db_replica_retry_interval: float = 30
+    # Seconds a single statement may run before it is canceled. Zero disables the timeout.
+    db_statement_timeout: float = 30
+    # Seconds between checks for a disconnected client while a query is running
+    disconnect_poll_interval: float = 0.5
+    # Rows fetched per round trip when streaming hosts. At most this many rows are buffered at once.
+    db_fetch_batch_size: int = 500
+    # cursor: stream all hosts through one server side cursor.
+    # keyset: fetch pages of hosts ordered by id, each in a short transaction.
+    host_scan_mode: t.Literal["cursor", "keyset"] = "cursor"
+    # hosts: read and parse system profiles from hbi.hosts.
+    # roadmap_hosts: read the precomputed projection maintained by scripts/replication.py.
+    host_source: t.Literal["hosts", "roadmap_hosts"] = "hosts"
+    # python: match each host against the app stream catalog in the application.
+    # sql: load the catalog into the database and match hosts with a single query.
+    # precomputed: like sql, but a background worker keeps the matches in host_app_streams.
+    app_stream_matching: t.Literal["python", "sql", "precomputed"] = "python"
+    # Seconds between refreshes of host_app_streams
+    host_app_streams_interval: float = 60
+    # Seconds between removing deleted hosts from host_app_streams. Deleted hosts do not
+    # advance the watermark, so finding them scans the whole table. Until then they are still counted.
+    host_app_streams_sweep_interval: float = 3600
+    # Read host counts from the per-org rollup tables when system ids are not needed
+    use_rollups: bool = False
+    # Listen for host change notifications and evict cached results for the changed org.
+    # Requires the hosts_notify trigger created by scripts/replication.py.
+    host_change_notifications: bool = False
+    # Seconds to wait before reconnecting a lost host change listener
+    host_change_retry_interval: float = 5
+    # none: compute every response.
+    # memory: keep computed responses in each worker, up to response_cache_size.
+    # redis: share computed responses between workers and replicas through the server at redis_url.
+    response_cache_backend: t.Literal["none", "memory", "redis"] = "none"
+    response_cache_size: int = 1000
+    # Seconds a cached response may be used. Responses also expire when a support status in them
+    # changes, and are validated against the org's hosts, so this only bounds how long a response
+    # is kept without being requested.
+    response_cache_ttl: float = 604800
+    # Seconds after it was computed that an outdated response may still be returned while
+    # a new one is computed in the background. Older responses are recomputed before returning.
+    # Zero disables returning outdated responses.
+    response_cache_max_stale: float = 0
+    # Let concurrent identical requests for an org wait for one computation of the response
+    coalesce_requests: bool = True
+    # Orgs whose relevant responses are computed and cached at startup, before reporting ready.
+    # Requires a response cache backend.
+    warm_up_org_ids: list[str] = []
+    # Also warm up this many orgs with the most hosts
+    warm_up_top_orgs: int = 0
+    # Seconds to spend warming up before reporting ready anyway
+    warm_up_timeout: float = 120
     debug: bool = False
     dev: bool = False
     host_inventory_url: str = "https://console.redhat.com"
+    host_staleness: HostStaleness = HostStaleness.stale_warning
     upcoming_json_path: FilePath = Path(__file__).parent.joinpath("data").joinpath("upcoming.json")
     test: bool = False
     rbac_hostname: str = ""
     rbac_port: int = 8000
+    # Seconds to wait for RBAC
+    rbac_timeout: float = 5
+    # Connections kept open to RBAC by each worker
+    rbac_max_connections: int = 20
+    # Seconds to reuse the access of an identity. Zero disables caching.
+    rbac_cache_ttl: float = 60
+    # Seconds to reuse a denial from RBAC. Zero disables caching denials.
+    rbac_denied_cache_ttl: float = 10
+    rbac_cache_size: int = 10000
+    redis_hostname: str = ""
+    redis_port: int = 6379
+    redis_password: SecretStr = SecretStr("")
+    # Seconds to wait for the Redis server before treating a lookup as a miss
+    redis_timeout: float = 0.5
 
     @property
     def database_url(self) -> PostgresDsn:
@@ -41,6 +123,15 @@ class Settings(BaseSettings):
 
         return f"http://{self.rbac_hostname}:{self.rbac_port}"
 
+    @property
+    def redis_url(self) -> str:
+        if not self.redis_hostname:
+            return ""
+
+        password = self.redis_password.get_secret_value()
+        credentials = f":{urllib.parse.quote(password, safe='')}@" if password else ""
+        return f"redis://{credentials}{self.redis_hostname}:{self.redis_port}"
+
     @classmethod
     @lru_cache
     def create(cls):
@@ -73,6 +164,14 @@ class Settings(BaseSettings):
                     "rbac_port": rbac.port,
                 }
 
+            redis_kwargs = {}
+            if in_memory_db := config.inMemoryDb:
+                redis_kwargs = {
+                    "redis_hostname": in_memory_db.hostname,
+                    "redis_port": in_memory_db.port,
+                    "redis_password": SecretStr(in_memory_db.password or ""),
+                }
+
             return cls(
                 db_name=db.name,
                 db_user=db.username,
@@ -80,6 +179,7 @@ class Settings(BaseSettings):
                 db_host=db.hostname,
                 db_port=db.port,
                 **rbac_kwargs,
+                **redis_kwargs,
             )
 
         return cls()
@@ -2,6 +2,8 @@
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from roadmap.metrics import DB_QUERY_ROWS
+
 
 async def get_paragraphs(db: AsyncSession, release_note_id: str, keywords: list[str]):
     query = text("""
@@ -17,8 +19,13 @@ async def get_paragraphs(db: AsyncSession, release_note_id: str, keywords: list[
         ;
     """)
 
-    result = await db.execute(query, {"release_note_id": release_note_id, "keyword": "|".join(keywords)})
+    result = await db.execute(
+        query,
+        {"release_note_id": release_note_id, "keyword": "|".join(keywords)},
+        execution_options={"statement_name": "paragraphs"},
+    )
     rows = result.fetchall()
+    DB_QUERY_ROWS.labels("paragraphs").observe(len(rows))
 
     paragraphs = [{"section_id": row.section_id, "raw_text": row.raw_text, "metadata": row.metadata} for row in rows]
     return paragraphs
@@ -1,14 +1,206 @@
+import json
+import logging
+import time
 import typing as t
 
+import orjson
+
 from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.sql import text
 
 from roadmap.config import Settings
+from roadmap.metrics import DB_CONNECTIONS_IN_USE
+from roadmap.metrics import DB_POOL_CHECKOUT_SECONDS
+from roadmap.metrics import DB_QUERY_SECONDS
+
+
+logger = logging.getLogger("uvicorn.error")
+
+JSON_LOADERS = {
+    "json": json.loads,
+    "orjson": orjson.loads,
+}
+
+_engine: AsyncEngine | None = None
+_sessionmaker: async_sessionmaker[AsyncSession] | None = None
+_replica_router: "ReplicaRouter | None" = None
+
+
+class ReplicaRouter:
+    """Choose an engine for read only queries.
+
+    Replicas are used in turn. A replica that fails to connect is skipped until
+    the retry interval has passed. The primary is always the last choice.
+    """
+
+    def __init__(self, primary: AsyncEngine, replicas: list[AsyncEngine], retry_interval: float):
+        self.primary = primary
+        self.replicas = replicas
+        self.retry_interval = retry_interval
+        self._failed: dict[AsyncEngine, float] = {}
+        self._next = 0
+
+    def candidates(self) -> list[AsyncEngine]:
+        now = time.monotonic()
+        start = self._next
+        if self.replicas:
+            self._next = (self._next + 1) % len(self.replicas)
+
+        rotated = self.replicas[start:] + self.replicas[:start]
+        healthy = [engine for engine in rotated if self._failed.get(engine, 0) <= now]
+
+        return [*healthy, self.primary]
+
+    def mark_failed(self, engine: AsyncEngine):
+        self._failed[engine] = time.monotonic() + self.retry_interval
+
+    def mark_healthy(self, engine: AsyncEngine):
+        self._failed.pop(engine, None)
+
+
+def instrument_engine(engine: Engine, pool: str):
+    """Record connection pool usage and statement execution time.
+
+    Statements are labeled by the ``statement_name`` execution option.
+    """
+    connections_in_use = DB_CONNECTIONS_IN_USE.labels(pool)
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connections_in_use.inc()
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        connections_in_use.dec()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_start")
+        statement_name = context.execution_options.get("statement_name", "other")
+        DB_QUERY_SECONDS.labels(statement_name).observe(elapsed)
+
+
+def create_engine(settings: Settings, url: str | None = None, pool: str = "primary") -> AsyncEngine:
+    """Create a pooled async engine configured from settings.
+
+    The JSON loader is registered with psycopg and used to decode json and jsonb columns.
+    Connecting times out so an unreachable host fails before the request does.
+    """
+    engine = create_async_engine(
+        url or str(settings.database_url),
+        echo=settings.db_echo,
+        json_deserializer=JSON_LOADERS[settings.db_json_loader],
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+        pool_timeout=settings.db_pool_timeout,
+        connect_args={"connect_timeout": settings.db_connect_timeout},
+    )
+    instrument_engine(engine.sync_engine, pool)
+
+    return engine
+
+
+def init_engine(settings: Settings) -> AsyncEngine:
+    """Create the process wide engines and session factory.
+
+    This is called from the application lifespan. Any existing engine is replaced.
+    """
+    global _engine, _sessionmaker, _replica_router
+
+    _engine = create_engine(settings)
+    _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    _replica_router = ReplicaRouter(
+        _engine,
+        [create_engine(settings, str(url), "replica") for url in settings.db_replica_urls],
+        settings.db_replica_retry_interval,
+    )
+
+    return _engine
+
+
+def get_engine(settings: Settings) -> AsyncEngine:
+    """Return the process wide engine, creating it if the lifespan has not run."""
+    if _engine is None:
+        return init_engine(settings)
+
+    return _engine
+
+
+async def dispose_engine() -> None:
+    """Close all pooled connections and discard the process wide engines."""
+    global _engine, _sessionmaker, _replica_router
+
+    if _replica_router is not None:
+        for replica in _replica_router.replicas:
+            await replica.dispose()
+
+    if _engine is not None:
+        await _engine.dispose()
+
+    _engine = None
+    _sessionmaker = None
+    _replica_router = None
+
+
+async def set_statement_timeout(session: AsyncSession, timeout: float):
+    """Set the statement timeout in seconds for the current transaction. Zero disables the timeout."""
+    if not timeout:
+        return
+
+    await session.execute(
+        text("SELECT set_config('statement_timeout', :timeout, true)"),
+        {"timeout": f"{int(timeout * 1000)}ms"},
+    )
 
 
 async def get_db(settings: t.Annotated[Settings, Depends(Settings.create)]):
-    engine = create_async_engine(str(settings.database_url), echo=True)
-    async_session = async_sessionmaker(engine, expire_on_commit=False)
-    async with async_session() as session:
+    get_engine(settings)
+    async with _sessionmaker() as session:
+        with DB_POOL_CHECKOUT_SECONDS.labels("primary").time():
+            await session.connection()
+
+        yield session
+
+
+async def get_read_db(settings: t.Annotated[Settings, Depends(Settings.create)]):
+    """Return a session for read only queries.
+
+    Use a read replica if one is configured and reachable, otherwise use the primary.
+    A replica whose pool is exhausted is skipped as well.
+    The statement timeout is set for the transaction so it applies only to this request.
+    """
+    get_engine(settings)
+    for engine in _replica_router.candidates():
+        session = _sessionmaker(bind=engine)
+        pool = "primary" if engine is _replica_router.primary else "replica"
+        try:
+            with DB_POOL_CHECKOUT_SECONDS.labels(pool).time():
+                await session.connection()
+        except (DBAPIError, PoolTimeoutError) as exc:
+            await session.close()
+            if engine is _replica_router.primary:
+                raise
+
+            logger.warning(f"Read replica {engine.url.host} is unavailable: {getattr(exc, 'orig', exc)}")
+            _replica_router.mark_failed(engine)
+        else:
+            _replica_router.mark_healthy(engine)
+            break
+
+    async with session:
+        await set_statement_timeout(session, settings.db_statement_timeout)
         yield session
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import UTC
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import text
+
+from roadmap.catalog import CATALOG_VERSION
+from roadmap.common import build_app_stream_matches_sql
+from roadmap.common import HOST_TABLES
+from roadmap.config import Settings
+from roadmap.metrics import HOST_APP_STREAMS_REFRESH_SECONDS
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# os_major and os_minor are the OS version of the host, so the table can be
+# filtered the same way as hbi.roadmap_hosts.
+HOST_APP_STREAMS_DDL = (
+    """CREATE TABLE IF NOT EXISTS host_app_streams (
+        host_id uuid NOT NULL,
+        org_id character varying(36) NOT NULL,
+        stale_timestamp timestamp with time zone NOT NULL,
+        os_major integer,
+        os_minor integer,
+        impl text NOT NULL,
+        name text NOT NULL,
+        application_stream_name text NOT NULL,
+        stream text NOT NULL,
+        start_date date,
+        end_date date
+    )""",
+    "CREATE INDEX IF NOT EXISTS host_app_streams_org_id_index ON host_app_streams (org_id, os_major, os_minor)",
+    "CREATE INDEX IF NOT EXISTS host_app_streams_host_id_index ON host_app_streams (host_id)",
+    "CREATE INDEX IF NOT EXISTS host_app_streams_org_id_stale_timestamp_index"
+    " ON host_app_streams (org_id, stale_timestamp)",
+    # Host counts per org and app stream, bucketed by the hour of stale_timestamp
+    """CREATE TABLE IF NOT EXISTS host_app_stream_counts (
+        org_id character varying(36) NOT NULL,
+        stale_bucket timestamp with time zone NOT NULL,
+        os_major integer,
+        os_minor integer,
+        impl text NOT NULL,
+        name text NOT NULL,
+        application_stream_name text NOT NULL,
+        stream text NOT NULL,
+        start_date date,
+        end_date date,
+        count bigint NOT NULL,
+        UNIQUE NULLS NOT DISTINCT (
+            org_id, stale_bucket, os_major, os_minor, impl, name, application_stream_name, stream, start_date, end_date
+        )
+    )""",
+    "CREATE OR REPLACE TRIGGER host_app_stream_counts_sync AFTER INSERT OR DELETE ON host_app_streams"
+    " FOR EACH ROW EXECUTE FUNCTION host_app_stream_counts_sync()",
+    """CREATE TABLE IF NOT EXISTS host_app_streams_state (
+        catalog_version text NOT NULL,
+        watermark timestamp with time zone,
+        swept_on timestamp with time zone,
+        generation bigint NOT NULL DEFAULT 0
+    )""",
+    "ALTER TABLE host_app_streams_state ADD COLUMN IF NOT EXISTS swept_on timestamp with time zone",
+    "ALTER TABLE host_app_streams_state ADD COLUMN IF NOT EXISTS generation bigint NOT NULL DEFAULT 0",
+)
+
+
+# Rows are only inserted and deleted. The trigger is skipped while the whole table is rebuilt.
+HOST_APP_STREAM_COUNTS_FUNCTION = """CREATE OR REPLACE FUNCTION host_app_stream_counts_sync() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF current_setting('roadmap.skip_app_stream_counts', true) = 'on' THEN
+            RETURN NULL;
+        END IF;
+
+        IF TG_OP = 'DELETE' THEN
+            UPDATE host_app_stream_counts SET count = count - 1
+            WHERE org_id = OLD.org_id
+                AND stale_bucket = date_trunc('hour', OLD.stale_timestamp, 'UTC')
+                AND os_major IS NOT DISTINCT FROM OLD.os_major
+                AND os_minor IS NOT DISTINCT FROM OLD.os_minor
+                AND impl = OLD.impl
+                AND name = OLD.name
+                AND application_stream_name = OLD.application_stream_name
+                AND stream = OLD.stream
+                AND start_date IS NOT DISTINCT FROM OLD.start_date
+                AND end_date IS NOT DISTINCT FROM OLD.end_date;
+            DELETE FROM host_app_stream_counts
+            WHERE org_id = OLD.org_id
+                AND stale_bucket = date_trunc('hour', OLD.stale_timestamp, 'UTC')
+                AND count <= 0;
+            RETURN NULL;
+        END IF;
+
+        INSERT INTO host_app_stream_counts
+        VALUES (
+            NEW.org_id, date_trunc('hour', NEW.stale_timestamp, 'UTC'), NEW.os_major, NEW.os_minor, NEW.impl,
+            NEW.name, NEW.application_stream_name, NEW.stream, NEW.start_date, NEW.end_date, 1
+        )
+        ON CONFLICT (
+            org_id, stale_bucket, os_major, os_minor, impl, name, application_stream_name, stream, start_date, end_date
+        )
+        DO UPDATE SET count = host_app_stream_counts.count + 1;
+        RETURN NULL;
+    END
+    $$"""
+
+# Hosts are replicated in commit order, but modified_on is set when the host is
+# changed in inventory. Look back this far before the watermark so a host that
+# committed late is not missed. Recomputing a host is idempotent.
+WATERMARK_OVERLAP = timedelta(minutes=5)
+
+
+async def _insert_matches(connection: AsyncConnection, source: str, where: str, params: dict) -> None:
+    """Insert the app streams of the hosts in the source table that match the where clause."""
+    await connection.execute(
+        text(f"""
+            INSERT INTO host_app_streams
+            WITH {build_app_stream_matches_sql(source, where)}
+            SELECT DISTINCT
+                id, org_id, stale_timestamp, os_major, os_minor,
+                impl, name, application_stream_name, stream, start_date, end_date
+            FROM matches
+            WHERE NOT rolling
+        """),
+        params,
+        execution_options={"statement_name": "host_app_streams_refresh"},
+    )
+
+
+async def create_host_app_streams_tables(engine: AsyncEngine) -> None:
+    """Create host_app_streams and the tables and trigger that keep it.
+
+    Called once at startup so the tables exist before they are read. The trigger
+    function is always replaced. Tables that already exist are left alone, since
+    creating an index waits for a refresh running in another process.
+    """
+    async with engine.begin() as connection:
+        await connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('host_app_streams_ddl'))"))
+        await connection.execute(text(HOST_APP_STREAM_COUNTS_FUNCTION))
+        # generation is added last, so everything else exists if it does
+        current = await connection.scalar(
+            text(
+                "SELECT EXISTS (SELECT FROM information_schema.columns"
+                " WHERE table_name = 'host_app_streams_state' AND column_name = 'generation')"
+            )
+        )
+        if not current:
+            for statement in HOST_APP_STREAMS_DDL:
+                await connection.execute(text(statement))
+
+
+async def refresh_host_app_streams(engine: AsyncEngine, settings: Settings) -> bool:
+    """Bring host_app_streams up to date with the hosts table and the app stream catalog.
+
+    Only hosts modified since the last refresh are recomputed. Everything is
+    recomputed when the catalog version changes. Deleted hosts are removed every
+    host_app_streams_sweep_interval seconds. Return False if another process is
+    already refreshing.
+
+    The generation in host_app_streams_state is incremented when rows change for any
+    reason other than a modified host, so cached responses that used them are invalidated.
+    """
+    source = settings.host_source
+    async with engine.begin() as connection:
+        locked = await connection.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('host_app_streams'))"))
+        if not locked:
+            return False
+
+        state = (
+            await connection.execute(
+                text("SELECT catalog_version, watermark, swept_on, generation FROM host_app_streams_state")
+            )
+        ).first()
+        watermark = await connection.scalar(text(f"SELECT max(modified_on) FROM {HOST_TABLES[source]}"))
+        now = datetime.now(UTC)
+        swept_on = now
+        generation = 0 if state is None else state.generation
+        if state is None or state.catalog_version != CATALOG_VERSION or state.watermark is None:
+            mode = "full"
+            generation += 1
+            with HOST_APP_STREAMS_REFRESH_SECONDS.labels(mode).time():
+                # Counting one row at a time is slow for the whole table, so count afterward instead.
+                await connection.execute(text("SELECT set_config('roadmap.skip_app_stream_counts', 'on', true)"))
+                # DELETE rather than TRUNCATE, which would block readers until the rebuild commits.
+                # Readers keep seeing the previous rows until then.
+                await connection.execute(text("DELETE FROM host_app_streams"))
+                await connection.execute(text("DELETE FROM host_app_stream_counts"))
+                await _insert_matches(connection, source, "true", {})
+                await connection.execute(text("SELECT set_config('roadmap.skip_app_stream_counts', 'off', true)"))
+                await connection.execute(
+                    text("""
+                        INSERT INTO host_app_stream_counts
+                        SELECT
+                            org_id, date_trunc('hour', stale_timestamp, 'UTC'), os_major, os_minor, impl,
+                            name, application_stream_name, stream, start_date, end_date, count(*)
+                        FROM host_app_streams
+                        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9, 10
+                    """)
+                )
+        else:
+            mode = "incremental"
+            where = "modified_on > :since"
+            params = {"since": state.watermark - WATERMARK_OVERLAP}
+            with HOST_APP_STREAMS_REFRESH_SECONDS.labels(mode).time():
+                await connection.execute(
+                    text(
+                        "DELETE FROM host_app_streams"
+                        f" WHERE host_id IN (SELECT id FROM {HOST_TABLES[source]} WHERE {where})"
+                    ),
+                    params,
+                )
+                await _insert_matches(connection, source, where, params)
+
+            sweep_interval = timedelta(seconds=settings.host_app_streams_sweep_interval)
+            if state.swept_on is not None and now - state.swept_on < sweep_interval:
+                swept_on = state.swept_on
+            else:
+                with HOST_APP_STREAMS_REFRESH_SECONDS.labels("sweep").time():
+                    swept = await connection.execute(
+                        text(
+                            "DELETE FROM host_app_streams WHERE NOT EXISTS"
+                            f" (SELECT 1 FROM {HOST_TABLES[source]} AS hosts WHERE hosts.id = host_app_streams.host_id)"
+                        )
+                    )
+
+                # The deleted hosts are no longer counted, so the host watermark does not change again
+                if swept.rowcount:
+                    generation += 1
+
+        await connection.execute(text("DELETE FROM host_app_streams_state"))
+        await connection.execute(
+            text(
+                "INSERT INTO host_app_streams_state (catalog_version, watermark, swept_on, generation)"
+                " VALUES (:version, :watermark, :swept_on, :generation)"
+            ),
+            {"version": CATALOG_VERSION, "watermark": watermark, "swept_on": swept_on, "generation": generation},
+        )
+
+    logger.debug(f"Refreshed host_app_streams ({mode}) up to {watermark}")
+    return True
+
+
+async def run_host_app_streams_worker(engine: AsyncEngine, settings: Settings) -> None:
+    """Refresh host_app_streams until canceled.
+
+    Every process runs the worker. An advisory lock ensures only one refreshes at a time.
+    """
+    while True:
+        try:
+            await refresh_host_app_streams(engine, settings)
+        except Exception:
+            logger.exception("Failed to refresh host_app_streams")
+
+        await asyncio.sleep(settings.host_app_streams_interval)
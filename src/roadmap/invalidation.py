@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import typing as t
+
+from contextlib import suppress
+
+import psycopg
+
+from roadmap.config import Settings
+from roadmap.metrics import HOST_CHANGE_NOTIFICATIONS
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# Channel used by the hbi.hosts_notify() trigger created by scripts/replication.py
+HOSTS_CHANGED_CHANNEL = "roadmap_hosts_changed"
+
+# Called with the org_id whose hosts changed, or None if every org may have changed
+OrgListener = t.Callable[[str | None], None]
+
+_listeners: list[OrgListener] = []
+
+
+def add_listener(listener: OrgListener):
+    _listeners.append(listener)
+
+
+def remove_listener(listener: OrgListener):
+    with suppress(ValueError):
+        _listeners.remove(listener)
+
+
+def dispatch(org_id: str | None):
+    """Call every listener with the changed org. A failing listener does not stop the others."""
+    for listener in list(_listeners):
+        try:
+            listener(org_id)
+        except Exception:
+            logger.exception(f"Error handling a host change for org {org_id}")
+
+
+async def listen_for_host_changes(settings: Settings):
+    """Dispatch host change notifications until canceled.
+
+    The connection is reopened if it is lost or anything else fails. Notifications sent
+    while disconnected are not delivered, so every org is dispatched each time the
+    connection is opened.
+    """
+    conninfo = str(settings.database_url).replace("postgresql+psycopg://", "postgresql://", 1)
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as connection:
+                await connection.execute(f"LISTEN {HOSTS_CHANGED_CHANNEL}")
+                logger.info(f"Listening for host changes on {HOSTS_CHANGED_CHANNEL}")
+                dispatch(None)
+                async for notify in connection.notifies():
+                    HOST_CHANGE_NOTIFICATIONS.inc()
+                    dispatch(notify.payload or None)
+        except psycopg.Error as exc:
+            logger.warning(f"Host change listener disconnected: {exc}")
+        except Exception:
+            # Keep listening, or host changes would never evict cached responses again
+            logger.exception("Error listening for host changes")
+
+        await asyncio.sleep(settings.host_change_retry_interval)
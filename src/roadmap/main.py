@@ -1,17 +1,34 @@
+import asyncio
 import logging
 import os
 
+from contextlib import asynccontextmanager
+from contextlib import suppress
+
 import sentry_sdk
 
 from fastapi import APIRouter
 from fastapi import FastAPI
+from fastapi import HTTPException
+from fastapi import Request
 from prometheus_fastapi_instrumentator import Instrumentator
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 from sentry_sdk.integrations.starlette import StarletteIntegration
 
 import roadmap.v1
 
+from roadmap.cache import close_response_cache
+from roadmap.catalog import load_app_stream_catalog
 from roadmap.common import HealthCheckFilter
+from roadmap.config import Settings
+from roadmap.database import dispose_engine
+from roadmap.database import init_engine
+from roadmap.host_app_streams import create_host_app_streams_tables
+from roadmap.host_app_streams import run_host_app_streams_worker
+from roadmap.invalidation import listen_for_host_changes
+from roadmap.rbac import close_rbac_client
+from roadmap.warm_up import warm_up
+from roadmap.warm_up import warm_up_enabled
 
 
 if os.getenv("SENTRY_DSN"):
@@ -33,8 +50,40 @@ if os.getenv("SENTRY_DSN"):
 logging.getLogger("uvicorn.access").addFilter(HealthCheckFilter())
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = Settings.create()
+    engine = init_engine(settings)
+    if settings.app_stream_matching != "python":
+        await load_app_stream_catalog(engine)
+
+    tasks = []
+    if settings.app_stream_matching == "precomputed":
+        await create_host_app_streams_tables(engine)
+        tasks.append(asyncio.create_task(run_host_app_streams_worker(engine, settings)))
+
+    if settings.host_change_notifications:
+        tasks.append(asyncio.create_task(listen_for_host_changes(settings)))
+
+    app.state.ready = True
+    if warm_up_enabled(settings):
+        app.state.ready = False
+        tasks.append(asyncio.create_task(warm_up(app, engine, settings)))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+    await close_rbac_client()
+    await close_response_cache()
+    await dispose_engine()
+
+
 # Initialize FastAPI app
-app = FastAPI(redirect_slashes=False)
+app = FastAPI(redirect_slashes=False, lifespan=lifespan)
 
 # Add Prometheus metrics
 instrumentor = Instrumentator()
@@ -56,5 +105,13 @@ async def ping():
     return {"status": "pong"}
 
 
+@api_router.get("/v1/ready", tags=["Status"])
+async def ready(request: Request):
+    if not getattr(request.app.state, "ready", True):
+        raise HTTPException(status_code=503, detail="Warming up")
+
+    return {"status": "ready"}
+
+
 # Include the main API router in the FastAPI app
 app.include_router(api_router)
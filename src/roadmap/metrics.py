@@ -0,0 +1,85 @@
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+
+
+NAMESPACE = "roadmap"
+
+HOST_FETCH_BATCH_ROWS = Histogram(
+    "host_fetch_batch_rows",
+    "Number of host rows fetched from the database in each batch",
+    namespace=NAMESPACE,
+    buckets=(1, 10, 50, 100, 250, 500, 1_000, 2_500, 5_000),
+)
+HOST_FETCH_BATCHES = Histogram(
+    "host_fetch_batches",
+    "Number of batches fetched from the database for each host inventory request",
+    namespace=NAMESPACE,
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the pool",
+    ["pool"],
+    namespace=NAMESPACE,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use",
+    "Number of connections checked out from the pool",
+    ["pool"],
+    namespace=NAMESPACE,
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_seconds",
+    "Time spent executing a database statement",
+    ["statement"],
+    namespace=NAMESPACE,
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DB_QUERY_ROWS = Histogram(
+    "db_query_rows",
+    "Number of rows returned by a database query",
+    ["statement"],
+    namespace=NAMESPACE,
+    buckets=(0, 1, 10, 100, 1_000, 10_000, 50_000, 100_000, 250_000, 500_000),
+)
+
+HOST_APP_STREAMS_REFRESH_SECONDS = Histogram(
+    "host_app_streams_refresh_seconds",
+    "Time spent refreshing the host_app_streams table",
+    ["mode"],
+    namespace=NAMESPACE,
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900),
+)
+
+HOST_CHANGE_NOTIFICATIONS = Counter(
+    "host_change_notifications",
+    "Number of host change notifications received from the database",
+    namespace=NAMESPACE,
+)
+
+RESPONSE_CACHE_REQUESTS = Counter(
+    "response_cache_requests",
+    "Number of response cache lookups by result",
+    ["result"],
+    namespace=NAMESPACE,
+)
+RESPONSE_CACHE_ENTRY_BYTES = Histogram(
+    "response_cache_entry_bytes",
+    "Size of compressed responses written to the response cache",
+    namespace=NAMESPACE,
+    buckets=(1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000),
+)
+COALESCED_REQUESTS = Counter(
+    "coalesced_requests",
+    "Number of requests answered with the response computed for a concurrent identical request",
+    namespace=NAMESPACE,
+)
+RBAC_CACHE_REQUESTS = Counter(
+    "rbac_cache_requests",
+    "Number of RBAC access lookups by result",
+    ["result"],
+    namespace=NAMESPACE,
+)
@@ -15,6 +15,13 @@ class Meta(BaseModel):
     total: int | None = None
 
 
+class RelevantMeta(Meta):
+    """Meta for responses computed from host inventory."""
+
+    # Seconds since the response was computed. Cached responses may be older than the inventory.
+    age: int = 0
+
+
 class LifecycleType(StrEnum):
     mainline = "mainline"
     eus = "EUS"
@@ -22,6 +29,18 @@ class LifecycleType(StrEnum):
     e4s = "E4S"
 
 
+class HostStaleness(StrEnum):
+    """The most stale hosts to include in inventory results.
+
+    Each level includes hosts from all the less stale levels.
+    """
+
+    fresh = "fresh"
+    stale = "stale"
+    stale_warning = "stale_warning"
+    culled = "culled"
+
+
 class SupportStatus(StrEnum):
     supported = "Supported"
     six_months = "Support ends within 6 months"
@@ -112,3 +131,38 @@ def _calculate_support_status(
         return SupportStatus.supported
 
     return support_status
+
+
+def _next_support_status_change(
+    start_date: date | str | None, end_date: date | str | None, current_date: date
+) -> date | None:
+    """Return the first date after current_date on which the support status changes.
+
+    The status only changes on the start date, 180 days before the end date, and the
+    day after the end date. Return None if it never changes.
+    """
+    status = _calculate_support_status(start_date=start_date, end_date=end_date, current_date=current_date)
+    transitions = []
+    if isinstance(start_date, date):
+        transitions.append(start_date)
+
+    if isinstance(end_date, date):
+        transitions.extend((end_date - timedelta(days=180), end_date + timedelta(days=1)))
+
+    for transition in sorted(transition for transition in transitions if transition > current_date):
+        if _calculate_support_status(start_date=start_date, end_date=end_date, current_date=transition) != status:
+            return transition
+
+    return None
+
+
+def next_support_status_change(
+    dates: t.Iterable[tuple[date | str | None, date | str | None]], current_date: date
+) -> date | None:
+    """Return the first date after current_date on which any of the support statuses
+    calculated from (start_date, end_date) pairs changes, or None if none of them change.
+
+    A response containing those statuses is correct until that date.
+    """
+    transitions = (_next_support_status_change(start, end, current_date) for start, end in dates)
+    return min((transition for transition in transitions if transition is not None), default=None)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+import typing as t
+
+from collections import OrderedDict
+
+import httpx
+
+from fastapi import HTTPException
+
+from roadmap.config import Settings
+from roadmap.metrics import RBAC_CACHE_REQUESTS
+
+
+logger = logging.getLogger("uvicorn.error")
+
+_client: "RBACClient | None" = None
+
+
+class RBACClient:
+    """Query RBAC for the access of an identity.
+
+    Connections to RBAC are pooled and kept alive between requests.
+
+    Access lists are cached per identity for ttl seconds, and denials for denied_ttl
+    seconds, keeping at most max_entries. Concurrent requests for an identity that is
+    not cached share one query.
+    """
+
+    params = {
+        "application": "inventory",
+        "limit": 1000,
+    }
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float,
+        max_connections: int,
+        ttl: float,
+        denied_ttl: float,
+        max_entries: int,
+    ):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.ttl = ttl
+        self.denied_ttl = denied_ttl
+        self.max_entries = max_entries
+        # Values are the time.monotonic() the entry expires and the access list, or
+        # the status code and detail of a denial
+        self._entries: OrderedDict[str, tuple[float, list[dict[t.Any, t.Any]] | tuple[int, str]]] = OrderedDict()
+        self._queries: dict[str, asyncio.Task] = {}
+
+    async def get_access(self, identity: str | None) -> list[dict[t.Any, t.Any]]:
+        """Return the inventory access of identity.
+
+        Raise HTTPException if RBAC returns an error or cannot be reached.
+        """
+        key = identity or ""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, result = entry
+            if expires > time.monotonic():
+                RBAC_CACHE_REQUESTS.labels("hit").inc()
+                self._entries.move_to_end(key)
+                if isinstance(result, tuple):
+                    # A new exception each time, since raising one adds to its traceback
+                    raise HTTPException(status_code=result[0], detail=result[1])
+
+                return result
+
+            del self._entries[key]
+
+        query = self._queries.get(key)
+        if query is None:
+            RBAC_CACHE_REQUESTS.labels("miss").inc()
+            query = asyncio.create_task(self._query(key, identity))
+            self._queries[key] = query
+            query.add_done_callback(lambda query: self._queries.pop(key, None))
+        else:
+            RBAC_CACHE_REQUESTS.labels("coalesced").inc()
+
+        # Do not cancel the query for everyone else if this request is canceled
+        return await asyncio.shield(query)
+
+    async def _query(self, key: str, identity: str | None) -> list[dict[t.Any, t.Any]]:
+        headers = {"X-RH-Identity": identity} if identity else {}
+        try:
+            response = await self.client.get("/api/rbac/v1/access/", params=self.params, headers=headers)
+        except httpx.HTTPError as exc:
+            logger.error(f"Problem querying RBAC: {exc!r}")
+            raise HTTPException(status_code=503, detail="Unable to query RBAC")
+
+        if response.is_error:
+            logger.error(f"Problem querying RBAC: {response.status_code} {response.reason_phrase}")
+            if response.status_code == 403:
+                self._store(key, (response.status_code, response.reason_phrase), self.denied_ttl)
+
+            raise HTTPException(status_code=response.status_code, detail=response.reason_phrase)
+
+        data = response.json().get("data", [{}])
+        self._store(key, data, self.ttl)
+        return data
+
+    def _store(self, key: str, result: list[dict[t.Any, t.Any]] | tuple[int, str], ttl: float):
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def close(self):
+        for query in list(self._queries.values()):
+            query.cancel()
+
+        await self.client.aclose()
+
+
+def get_rbac_client(settings: Settings) -> RBACClient:
+    """Return the process wide RBAC client, creating it on first use."""
+    global _client
+
+    if _client is None:
+        _client = RBACClient(
+            settings.rbac_url,
+            timeout=settings.rbac_timeout,
+            max_connections=settings.rbac_max_connections,
+            ttl=settings.rbac_cache_ttl,
+            denied_ttl=settings.rbac_denied_cache_ttl,
+            max_entries=settings.rbac_cache_size,
+        )
+
+    return _client
+
+
+async def close_rbac_client():
+    """Close the connections to RBAC and discard the process wide client."""
+    global _client
+
+    if _client is not None:
+        await _client.close()
+
+    _client = None
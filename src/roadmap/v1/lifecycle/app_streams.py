@@ -2,11 +2,13 @@ import logging
 import typing as t
 
 from collections import defaultdict
+from contextlib import aclosing
 from datetime import date
 from uuid import UUID
 
 from fastapi import APIRouter
 from fastapi import Path
+from fastapi import Request
 from fastapi.exceptions import HTTPException
 from fastapi.param_functions import Query
 from fastapi.params import Depends
@@ -14,12 +16,22 @@ from pydantic import AfterValidator
 from pydantic import BaseModel
 from pydantic import ConfigDict
 from pydantic import model_validator
+from sqlalchemy.engine import RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from roadmap.cache import CachedResponse
+from roadmap.common import cached_response
+from roadmap.common import check_inventory_access
 from roadmap.common import decode_header
 from roadmap.common import ensure_date
+from roadmap.common import get_inventory_db
 from roadmap.common import get_lifecycle_type
-from roadmap.common import query_host_inventory
+from roadmap.common import get_package_names
+from roadmap.common import host_inventory
+from roadmap.common import iter_hosts
+from roadmap.common import query_app_stream_matches
 from roadmap.common import sort_attrs
+from roadmap.config import Settings
 from roadmap.data.app_streams import APP_STREAM_MODULES_BY_KEY
 from roadmap.data.app_streams import APP_STREAM_MODULES_PACKAGES
 from roadmap.data.app_streams import APP_STREAM_PACKAGES
@@ -29,6 +41,8 @@ from roadmap.data.app_streams import OS_MAJORS_BY_APP_NAME
 from roadmap.models import _calculate_support_status
 from roadmap.models import LifecycleType
 from roadmap.models import Meta
+from roadmap.models import next_support_status_change
+from roadmap.models import RelevantMeta
 from roadmap.models import SupportStatus
 
 
@@ -74,6 +88,15 @@ async def filter_params(
 AppStreamFilter = t.Annotated[dict, Depends(filter_params)]
 
 
+async def include_systems_param(
+    include_systems: t.Annotated[bool, Query(description="Include the IDs of systems using each app stream")] = True,
+):
+    return include_systems
+
+
+IncludeSystems = t.Annotated[bool, Depends(include_systems_param)]
+
+
 class AppStreamKey(BaseModel):
     """All these things must match in order for a module to be considered the same."""
 
@@ -120,7 +143,7 @@ class RelevantAppStream(BaseModel):
 
 
 class RelevantAppStreamsResponse(BaseModel):
-    meta: Meta
+    meta: RelevantMeta
     data: list[RelevantAppStream]
 
 
@@ -201,16 +224,117 @@ relevant = APIRouter(
 )
 
 
+query_app_stream_hosts = host_inventory(
+    "operating_system",
+    "installed_products",
+    "dnf_modules",
+    "installed_packages",
+    packages=APP_STREAM_PACKAGES,
+)
+
+
+async def relevant_systems(
+    request: Request,
+    org_id: t.Annotated[str, Depends(decode_header)],
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    groups: t.Annotated[list[str], Depends(check_inventory_access)],
+    session: t.Annotated[AsyncSession, Depends(get_inventory_db)],
+    include_systems: IncludeSystems,
+    cached: t.Annotated[CachedResponse, Depends(cached_response)],
+    major: int | None = None,
+    minor: int | None = None,
+):
+    """Provide hosts or matched app streams unless the response is cached."""
+    if cached.hit:
+        yield None
+        return
+
+    args = {
+        "request": request,
+        "org_id": org_id,
+        "settings": settings,
+        "groups": groups,
+        "session": session,
+        "major": major,
+        "minor": minor,
+    }
+    if settings.app_stream_matching != "python":
+        yield await query_app_stream_matches(**args, include_systems=include_systems)
+        return
+
+    async with aclosing(query_app_stream_hosts(**args)) as hosts:
+        yield await anext(hosts)
+
+
 @relevant.get("", response_model=RelevantAppStreamsResponse)
 async def get_relevant_app_streams(
+    request: Request,
     org_id: t.Annotated[str, Depends(decode_header)],
-    systems: t.Annotated[t.Any, Depends(query_host_inventory)],
+    settings: t.Annotated[Settings, Depends(Settings.create)],
+    include_systems: IncludeSystems,
+    cached: t.Annotated[CachedResponse, Depends(cached_response)],
+    systems: t.Annotated[t.Any, Depends(relevant_systems)],
 ):
+    if cached.hit:
+        return cached.value
+
     logger.info(f"Getting relevant app streams for {org_id or 'UNKNOWN'}")
+    # Taken before support statuses are calculated so the response never expires late
+    today = date.today()
+
+    if settings.app_stream_matching == "python":
+        systems_by_stream = await app_streams_from_hosts(systems, request, org_id)
+        counts_by_stream = {app_stream: len(systems) for app_stream, systems in systems_by_stream.items()}
+    else:
+        systems_by_stream, counts_by_stream = app_streams_from_matches(systems)
+
+    response = []
+    for app_stream, count in counts_by_stream.items():
+        # Omit rolling app streams.
+        if app_stream.rolling:
+            continue
 
+        try:
+            response.append(
+                RelevantAppStream(
+                    name=app_stream.name,
+                    application_stream_name=app_stream.application_stream_name,
+                    stream=app_stream.stream,
+                    start_date=app_stream.start_date,
+                    end_date=app_stream.end_date,
+                    os_major=app_stream.os_major,
+                    os_minor=app_stream.os_minor,
+                    os_lifecycle=app_stream.os_lifecycle,
+                    impl=app_stream.impl,
+                    count=count,
+                    rolling=app_stream.rolling,
+                    systems=systems_by_stream[app_stream] if include_systems else [],
+                )
+            )
+        except Exception as exc:
+            raise HTTPException(detail=str(exc), status_code=400)
+
+    result = {
+        "meta": {
+            "count": len(response),
+            "total": sum(item.count for item in response),
+        },
+        "data": sorted(response, key=sort_attrs("name", "os_major", "os_minor", "os_lifecycle")),
+    }
+    status_change = next_support_status_change(((item.start_date, item.end_date) for item in response), today)
+    await cached.set(result, status_change)
+
+    return result
+
+
+async def app_streams_from_hosts(systems, request: Request, org_id: str) -> dict[AppStreamKey, list[UUID]]:
+    """Match each host against the app stream catalog.
+
+    Return the ids of the hosts using each app stream.
+    """
     missing = defaultdict(int)
     systems_by_stream = defaultdict(list)
-    async for system in systems.mappings():
+    async for system in iter_hosts(systems, request):
         system_profile = system.get("system_profile_facts")
         if not system_profile:
             missing["system_profile"] += 1
@@ -222,16 +346,21 @@ async def get_relevant_app_streams(
 
         os_major = system_profile.get("operating_system", {}).get("major")
         os_minor = system_profile.get("operating_system", {}).get("minor")
-        os_lifecycle = get_lifecycle_type(system_profile.get("installed_products", [{}]))
+        if "lifecycle" in system_profile:
+            # Precomputed by hbi.roadmap_hosts
+            os_lifecycle = LifecycleType(system_profile["lifecycle"])
+            package_names = system_profile.get("package_names", [])
+        else:
+            os_lifecycle = get_lifecycle_type(system_profile.get("installed_products", [{}]))
+            package_names = get_package_names(system_profile.get("installed_packages", []))
+
         dnf_modules = system_profile.get("dnf_modules", [])
 
         if not dnf_modules:
             missing["dnf_modules"] += 1
 
         module_app_streams = app_streams_from_modules(dnf_modules, os_major, os_minor, os_lifecycle)
-        package_app_streams = app_streams_from_packages(
-            system_profile.get("installed_packages", ""), os_major, os_minor, os_lifecycle
-        )
+        package_app_streams = app_streams_from_packages(package_names, os_major, os_minor, os_lifecycle)
 
         if not package_app_streams:
             missing["package_names"] += 1
@@ -246,39 +375,37 @@ async def get_relevant_app_streams(
         missing_items = ", ".join(f"{key}: {value}" for key, value in missing.items())
         logger.info(f"Missing {missing_items} for org {org_id or 'UNKNOWN'}")
 
-    response = []
-    for app_stream, systems in systems_by_stream.items():
-        # Omit rolling app streams.
-        if app_stream.rolling:
-            continue
-
-        try:
-            response.append(
-                RelevantAppStream(
-                    name=app_stream.name,
-                    application_stream_name=app_stream.application_stream_name,
-                    stream=app_stream.stream,
-                    start_date=app_stream.start_date,
-                    end_date=app_stream.end_date,
-                    os_major=app_stream.os_major,
-                    os_minor=app_stream.os_minor,
-                    os_lifecycle=app_stream.os_lifecycle,
-                    impl=app_stream.impl,
-                    count=len(systems),
-                    rolling=app_stream.rolling,
-                    systems=systems,
-                )
-            )
-        except Exception as exc:
-            raise HTTPException(detail=str(exc), status_code=400)
+    return systems_by_stream
+
+
+def app_streams_from_matches(
+    rows: t.Iterable[RowMapping],
+) -> tuple[dict[AppStreamKey, list[UUID]], dict[AppStreamKey, int]]:
+    """Build app stream keys from rows matched in the database.
+
+    Return the system ids and the number of systems for each app stream.
+    Rows read from a rollup have a count and no system ids.
+
+    Rolling app streams are left out by the query, so the OS minor version
+    and lifecycle are never part of the key.
+    """
+    systems_by_stream = {}
+    counts_by_stream = {}
+    for row in rows:
+        app_stream = AppStreamKey(
+            name=row["name"],
+            application_stream_name=row["application_stream_name"],
+            stream=row["stream"],
+            start_date=row["start_date"],
+            end_date=row["end_date"],
+            os_major=row["os_major"],
+            os_lifecycle=None,
+            impl=row["impl"],
+        )
+        systems_by_stream[app_stream] = row.get("systems", [])
+        counts_by_stream[app_stream] = row["count"] if "count" in row else len(row["systems"])
 
-    return {
-        "meta": {
-            "count": len(response),
-            "total": sum(item.count for item in response),
-        },
-        "data": sorted(response, key=sort_attrs("name", "os_major", "os_minor", "os_lifecycle")),
-    }
+    return systems_by_stream, counts_by_stream
 
 
 def app_streams_from_modules(dnf_modules: list[dict], os_major: str, os_minor: str, os_lifecycle: str):
@@ -324,9 +451,7 @@ def app_streams_from_modules(dnf_modules: list[dict], os_major: str, os_minor: s
     return app_streams
 
 
-def app_streams_from_packages(package_names_string: str, os_major: str, os_minor: str, os_lifecycle: str):
-    package_names = {pkg.split(":")[0].rsplit("-", 1)[0] for pkg in package_names_string}
-
+def app_streams_from_packages(package_names: t.Iterable[str], os_major: str, os_minor: str, os_lifecycle: str):
     app_streams = set()
     for package_name in package_names:
         if app_stream_package := APP_STREAM_PACKAGES.get(package_name):
@@ -2,6 +2,7 @@ import logging
 import typing as t
 
 from collections import defaultdict
+from datetime import date
 from operator import attrgetter
 
 from fastapi import APIRouter
@@ -9,14 +10,16 @@ from fastapi import Depends
 from fastapi import Path
 from pydantic import BaseModel
 
+from roadmap.cache import CachedResponse
+from roadmap.common import cached_response
 from roadmap.common import decode_header
-from roadmap.common import get_lifecycle_type
-from roadmap.common import query_host_inventory
+from roadmap.common import query_host_counts
 from roadmap.common import sort_attrs
 from roadmap.data.systems import OS_LIFECYCLE_DATES
 from roadmap.models import HostCount
 from roadmap.models import LifecycleType
-from roadmap.models import Meta
+from roadmap.models import next_support_status_change
+from roadmap.models import RelevantMeta
 from roadmap.models import RHELLifecycle
 from roadmap.models import System
 
@@ -34,7 +37,7 @@ MinorVersion = t.Annotated[int, Path(description="Minor version number", ge=0, l
 
 
 class RelevantSystemsResponse(BaseModel):
-    meta: Meta
+    meta: RelevantMeta
     data: list[System]
 
 
@@ -85,28 +88,36 @@ relevant = APIRouter(
 @relevant.get("")
 async def get_relevant_systems(
     org_id: t.Annotated[str, Depends(decode_header)],
-    systems: t.Annotated[t.Any, Depends(query_host_inventory)],
+    cached: t.Annotated[CachedResponse, Depends(cached_response)],
+    host_counts: t.Annotated[t.Any, Depends(query_host_counts)],
 ) -> RelevantSystemsResponse:
+    if cached.hit:
+        return cached.value
+
+    # Taken before support statuses are calculated so the response never expires late
+    today = date.today()
     system_counts = defaultdict(int)
     missing = defaultdict(int)
-    async for result in systems.mappings():
-        system_profile = result.get("system_profile_facts")
-        if not system_profile:
-            missing["system_profile"] += 1
+    for result in host_counts:
+        if result["no_profile"]:
+            missing["system_profile"] += result["count"]
             continue
 
-        name = system_profile.get("operating_system", {}).get("name")
-        if name is None:
-            missing["os_profile"] += 1
+        if result["name"] is None:
+            missing["os_profile"] += result["count"]
             continue
 
-        installed_products = system_profile.get("installed_products", [{}])
-        os_major = system_profile.get("operating_system", {}).get("major")
-        os_minor = system_profile.get("operating_system", {}).get("minor")
-        lifecycle_type = get_lifecycle_type(installed_products)
+        if result["major"] is None:
+            missing["os_version"] += result["count"]
+            continue
 
-        count_key = HostCount(name=name, major=os_major, minor=os_minor, lifecycle=lifecycle_type)
-        system_counts[count_key] += 1
+        count_key = HostCount(
+            name=result["name"],
+            major=result["major"],
+            minor=result["minor"],
+            lifecycle=result["lifecycle"],
+        )
+        system_counts[count_key] += result["count"]
 
     results = []
     for count_key, count in system_counts.items():
@@ -143,7 +154,13 @@ async def get_relevant_systems(
         missing_items = ", ".join(f"{key}: {value}" for key, value in missing.items())
         logger.info(f"Missing {missing_items} for org {org_id or 'UNKNOWN'}")
 
-    return RelevantSystemsResponse(
-        meta=Meta(total=sum(system.count for system in results), count=len(results)),
+    response = RelevantSystemsResponse(
+        meta=RelevantMeta(total=sum(system.count for system in results), count=len(results)),
         data=sorted(results, key=sort_attrs("lifecycle_type", "major", "minor"), reverse=True),
     )
+    status_change = next_support_status_change(
+        ((system.release_date, system.retirement_date) for system in results), today
+    )
+    await cached.set(response, status_change)
+
+    return response
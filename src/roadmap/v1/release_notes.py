@@ -7,7 +7,7 @@ from fastapi import Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from roadmap.crud import get_paragraphs
-from roadmap.database import get_db
+from roadmap.database import get_read_db
 from roadmap.models import TaggedParagraph
 
 
@@ -19,7 +19,7 @@ async def get_release_notes(
     major: int = Query(..., description="Major version number"),
     minor: int = Query(..., description="Minor version number"),
     keywords: Optional[list[str]] = Query(None, description="List of keywords to search for"),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     release_note_id = f"RHEL_{major}.{minor}"
     keyword = keywords or ["security"]
@@ -0,0 +1,91 @@
+import asyncio
+import base64
+import logging
+import time
+import typing as t
+
+import orjson
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.sql import text
+
+from roadmap.cache import send_request
+from roadmap.cache import WARM_UP_SCOPE_KEY
+from roadmap.config import Settings
+
+
+logger = logging.getLogger("uvicorn.error")
+
+# Responses computed for each org. Their default parameters match the requests made by the UI.
+WARM_UP_PATHS = (
+    "/api/roadmap/v1/relevant/lifecycle/rhel",
+    "/api/roadmap/v1/relevant/lifecycle/app-streams",
+)
+
+TOP_ORGS_QUERY = """
+    SELECT org_id
+    FROM hbi.hosts
+    GROUP BY org_id
+    ORDER BY count(*) DESC
+    LIMIT :limit
+"""
+
+
+def warm_up_enabled(settings: Settings) -> bool:
+    return settings.response_cache_backend != "none" and bool(settings.warm_up_org_ids or settings.warm_up_top_orgs)
+
+
+async def get_warm_up_org_ids(engine: AsyncEngine, settings: Settings) -> list[str]:
+    """Return the configured orgs followed by the orgs with the most hosts."""
+    org_ids = list(settings.warm_up_org_ids)
+    if settings.warm_up_top_orgs:
+        async with engine.connect() as connection:
+            result = await connection.execute(text(TOP_ORGS_QUERY), {"limit": settings.warm_up_top_orgs})
+            org_ids.extend(row.org_id for row in result if row.org_id not in org_ids)
+
+    return org_ids
+
+
+def warm_up_scope(path: str, org_id: str) -> dict[str, t.Any]:
+    identity = base64.b64encode(orjson.dumps({"identity": {"org_id": org_id}}))
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"x-rh-identity", identity)],
+        WARM_UP_SCOPE_KEY: True,
+    }
+
+
+async def warm_up(app: t.Any, engine: AsyncEngine, settings: Settings):
+    """Compute and cache the relevant responses for the warm-up orgs.
+
+    Requests are sent through the application one at a time so warm-up does not
+    compete with traffic for database connections. app.state.ready is set once
+    every org is done or warm_up_timeout seconds have passed.
+    """
+    start = time.perf_counter()
+    warmed = 0
+    try:
+        async with asyncio.timeout(settings.warm_up_timeout):
+            for org_id in await get_warm_up_org_ids(engine, settings):
+                for path in WARM_UP_PATHS:
+                    status = await send_request(app, warm_up_scope(path, org_id))
+                    if status != 200:
+                        logger.warning(f"Warming up {path} for org {org_id} failed with status {status}")
+
+                warmed += 1
+    except TimeoutError:
+        logger.warning(f"Warm-up did not finish within {settings.warm_up_timeout} seconds")
+    except Exception:
+        logger.exception("Error warming up the response cache")
+    finally:
+        app.state.ready = True
+
+    logger.info(f"Warmed up the response cache for {warmed} orgs in {time.perf_counter() - start:.1f} seconds")
@@ -1,6 +1,10 @@
 import gzip
 import json
+import threading
+import time
 
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from pathlib import Path
 
 import pytest
@@ -10,9 +14,55 @@ from fastapi.testclient import TestClient
 from roadmap.main import app
 
 
+class RBACStandIn:
+    """A server that answers RBAC access queries with the configured response."""
+
+    def __init__(self):
+        self.status = 200
+        self.reason = "OK"
+        self.body = {"data": [{"permission": "inventory:*:*", "resourceDefinitions": []}]}
+        # Seconds to wait before responding
+        self.delay = 0
+        # The identity header and client address of each request
+        self.requests: list[tuple[str | None, tuple[str, int]]] = []
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open between requests
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stand_in.requests.append((self.headers.get("X-RH-Identity"), self.client_address))
+                time.sleep(stand_in.delay)
+                body = json.dumps(stand_in.body).encode()
+                self.send_response(stand_in.status, stand_in.reason)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.hostname, self.port = self.server.server_address
+
+
+@pytest.fixture
+def rbac_server():
+    stand_in = RBACStandIn()
+    thread = threading.Thread(target=stand_in.server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield stand_in
+    stand_in.server.shutdown()
+    stand_in.server.server_close()
+
+
 @pytest.fixture(scope="function")
 def client():
-    return TestClient(app)
+    with TestClient(app) as client:
+        yield client
 
 
 @pytest.fixture
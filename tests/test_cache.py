@@ -0,0 +1,316 @@
+import asyncio
+import time
+
+from datetime import date
+from datetime import timedelta
+
+import pytest
+
+from fastapi import Request
+
+from roadmap.cache import ABORTED
+from roadmap.cache import cache_key
+from roadmap.cache import CachedResponse
+from roadmap.cache import close_response_cache
+from roadmap.cache import get_response_cache
+from roadmap.cache import MemoryBackend
+from roadmap.cache import NOT_CACHED
+from roadmap.cache import RedisBackend
+from roadmap.cache import ResponseCache
+from roadmap.cache import REVALIDATE_SCOPE_KEY
+from roadmap.cache import schedule_revalidation
+from roadmap.cache import SingleFlight
+from roadmap.catalog import DATA_VERSION
+from roadmap.config import Settings
+from roadmap.invalidation import dispatch
+
+
+class RedisStandIn:
+    """A server that understands the few Redis commands used by RedisBackend."""
+
+    def __init__(self):
+        self.data: dict[bytes, tuple[float | None, bytes]] = {}
+        self.commands: list[list[bytes]] = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while command := await self.read_command(reader):
+                self.commands.append(command)
+                writer.write(self.execute(command))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def read_command(self, reader: asyncio.StreamReader) -> list[bytes]:
+        line = await reader.readline()
+        if not line:
+            return []
+
+        command = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            command.append((await reader.readexactly(length + 2))[:-2])
+
+        return command
+
+    def execute(self, command: list[bytes]) -> bytes:
+        name, *args = command
+        match name.upper():
+            case b"GET":
+                expires, value = self.data.get(args[0], (None, None))
+                if value is None or (expires is not None and expires <= time.monotonic()):
+                    return b"$-1\r\n"
+
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            case b"SET":
+                expires = None
+                if len(args) == 4 and args[2].upper() == b"PX":
+                    expires = time.monotonic() + int(args[3]) / 1000
+
+                self.data[args[0]] = (expires, args[1])
+                return b"+OK\r\n"
+            case b"PING":
+                return b"+PONG\r\n"
+            case b"CLIENT" | b"SELECT":
+                return b"+OK\r\n"
+
+        return b"-ERR unknown command\r\n"
+
+
+@pytest.fixture
+async def redis_server():
+    stand_in = RedisStandIn()
+    server = await asyncio.start_server(stand_in.handle, "127.0.0.1", 0)
+    stand_in.url = f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    async with server:
+        yield stand_in
+
+
+@pytest.fixture(params=("memory", "redis"))
+async def backend(request, redis_server):
+    if request.param == "memory":
+        yield MemoryBackend(10)
+        return
+
+    backend = RedisBackend(redis_server.url, timeout=1)
+    yield backend
+    await backend.close()
+
+
+@pytest.fixture
+async def response_cache(monkeypatch):
+    monkeypatch.setattr("roadmap.cache._cache", None)
+    yield get_response_cache(Settings(response_cache_backend="memory", response_cache_size=10))
+    await close_response_cache()
+
+
+def test_cache_key():
+    key = cache_key("1234", "/relevant/lifecycle/rhel/{major}", [("major", 9), ("b", "2"), ("a", "1")])
+
+    assert key == f"1234:{DATA_VERSION}:/relevant/lifecycle/rhel/{{major}}?a=1&b=2&major=9"
+
+
+async def test_lookup(backend):
+    cache = ResponseCache(backend)
+    key = cache_key("1234", "/", [])
+
+    miss = await cache.lookup(key, ("now", 3), ttl=60)
+    await miss.set({"data": [{"count": 3}]})
+    hit = await cache.lookup(key, ("now", 3), ttl=60)
+    changed = await cache.lookup(key, ("now", 4), ttl=60)
+
+    assert not miss.hit
+    assert hit.hit
+    assert hit.value == {"data": [{"count": 3}]}
+    assert not changed.hit
+
+
+async def test_lookup_expired(backend):
+    cache = ResponseCache(backend)
+    key = cache_key("1234", "/", [])
+
+    cached = await cache.lookup(key, (), ttl=0.001)
+    await cached.set("value")
+    await asyncio.sleep(0.01)
+
+    assert not (await cache.lookup(key, (), ttl=0.001)).hit
+
+
+async def test_lookup_stale(backend):
+    cache = ResponseCache(backend, max_stale=60)
+    key = cache_key("1234", "/", [])
+    await (await cache.lookup(key, ("now", 3), ttl=60)).set({"meta": {"count": 1}, "data": [1]})
+
+    current = await cache.lookup(key, ("now", 3), ttl=60)
+    stale = await cache.lookup(key, ("now", 4), ttl=60)
+    revalidating = await cache.lookup(key, ("now", 4), ttl=60, stale=False)
+
+    assert (current.hit, current.stale) == (True, False)
+    assert (stale.hit, stale.stale) == (True, True)
+    assert stale.value == {"meta": {"count": 1, "age": 0}, "data": [1]}
+    assert not revalidating.hit
+
+
+async def test_lookup_stale_expired():
+    """An expired response is stale while it is younger than max_stale."""
+    cache = ResponseCache(MemoryBackend(10), max_stale=60)
+    key = cache_key("1234", "/", [])
+    await (await cache.lookup(key, (), ttl=0)).set("value")
+
+    stale = await cache.lookup(key, (), ttl=0)
+    too_old = await ResponseCache(cache.backend, max_stale=0).lookup(key, (), ttl=0)
+
+    assert (stale.hit, stale.stale) == (True, True)
+    assert not too_old.hit
+
+
+async def test_lookup_status_change(backend):
+    """Responses expire when a support status in them changes, even if they may be stale."""
+    cache = ResponseCache(backend, max_stale=60)
+    today = date.today()
+    changed = cache_key("1234", "/changed", [])
+    unchanged = cache_key("1234", "/unchanged", [])
+    await (await cache.lookup(changed, (), ttl=60)).set("value", today)
+    await (await cache.lookup(unchanged, (), ttl=60)).set("value", today + timedelta(days=1))
+
+    assert not (await cache.lookup(changed, (), ttl=60)).hit
+    assert (await cache.lookup(unchanged, (), ttl=60)).hit
+
+
+async def test_evict_org_stale():
+    """Entries are kept for stale lookups when a host changes."""
+    cache = ResponseCache(MemoryBackend(10), max_stale=60)
+    key = cache_key("1234", "/", [])
+    await (await cache.lookup(key, (), ttl=60)).set("value")
+
+    cache.evict_org("1234")
+
+    assert len(cache.backend) == 1
+
+
+async def test_schedule_revalidation():
+    requests = []
+    done = asyncio.Event()
+
+    async def app(scope, receive, send):
+        requests.append(scope)
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+        done.set()
+
+    scope = {
+        "type": "http",
+        "app": app,
+        "method": "GET",
+        "path": "/relevant",
+        "query_string": b"name=nodejs",
+        "headers": [(b"x-rh-identity", b"identity")],
+        "route": object(),
+    }
+    schedule_revalidation(Request(scope), "key")
+    schedule_revalidation(Request(scope), "key")
+    await asyncio.wait_for(done.wait(), 1)
+
+    assert len(requests) == 1
+    assert requests[0][REVALIDATE_SCOPE_KEY] is True
+    assert requests[0]["headers"] == scope["headers"]
+    assert "route" not in requests[0]
+
+
+async def test_redis_backend_stores_compressed(redis_server):
+    backend = RedisBackend(redis_server.url, timeout=1)
+    cache = ResponseCache(backend)
+    key = cache_key("1234", "/", [])
+    value = {"data": [{"name": "RHEL", "count": 1}] * 100}
+
+    await (await cache.lookup(key, (), ttl=60)).set(value)
+    await backend.close()
+    stored = redis_server.data[f"roadmap:response:{key}".encode()][1]
+
+    assert len(stored) < len(str(value))
+    assert (await ResponseCache(RedisBackend(redis_server.url, timeout=1)).lookup(key, (), ttl=60)).value == value
+
+
+async def test_redis_backend_unavailable():
+    """Errors talking to the server are treated as a miss."""
+    backend = RedisBackend("redis://127.0.0.1:1", timeout=0.1)
+    cache = ResponseCache(backend)
+    key = cache_key("1234", "/", [])
+
+    cached = await cache.lookup(key, (), ttl=60)
+    await cached.set("value")
+    await backend.close()
+
+    assert not cached.hit
+
+
+async def test_least_recently_used_eviction():
+    cache = ResponseCache(MemoryBackend(2))
+    keys = [cache_key("1234", f"/{n}", []) for n in range(3)]
+    await CachedResponse(cache, keys[0], "[]", 60).set(0)
+    await CachedResponse(cache, keys[1], "[]", 60).set(1)
+    # Use the first entry so the second is the least recently used
+    assert (await cache.lookup(keys[0], (), 60)).hit
+    await CachedResponse(cache, keys[2], "[]", 60).set(2)
+
+    assert len(cache.backend) == 2
+    assert (await cache.lookup(keys[0], (), 60)).hit
+    assert not (await cache.lookup(keys[1], (), 60)).hit
+    assert (await cache.lookup(keys[2], (), 60)).hit
+
+
+async def test_evict_org(response_cache):
+    for org_id in ("123", "1234"):
+        await (await response_cache.lookup(cache_key(org_id, "/", []), (), 60)).set(org_id)
+
+    dispatch("123")
+
+    assert not (await response_cache.lookup(cache_key("123", "/", []), (), 60)).hit
+    assert (await response_cache.lookup(cache_key("1234", "/", []), (), 60)).hit
+
+    dispatch(None)
+
+    assert len(response_cache.backend) == 0
+
+
+async def test_not_cached():
+    await NOT_CACHED.set("value")
+
+    assert not NOT_CACHED.hit
+    assert NOT_CACHED.value is None
+
+
+async def test_single_flight():
+    flights = SingleFlight()
+    flight = flights.start("key")
+    followers = [asyncio.create_task(flights.join("key")) for _ in range(3)]
+    await asyncio.sleep(0)
+    flights.land("key", flight, "value")
+
+    assert await asyncio.gather(*followers) == ["value"] * 3
+    # The flight has landed, so a later request computes its own response
+    assert await flights.join("key") is ABORTED
+
+
+async def test_single_flight_aborted():
+    flights = SingleFlight()
+    flight = flights.start("key")
+    follower = asyncio.create_task(flights.join("key"))
+    await asyncio.sleep(0)
+    flights.land("key", flight)
+
+    assert await follower is ABORTED
+
+
+async def test_single_flight_follower_canceled():
+    """Canceling a waiting request does not cancel the flight."""
+    flights = SingleFlight()
+    flight = flights.start("key")
+    follower = asyncio.create_task(flights.join("key"))
+    await asyncio.sleep(0)
+    follower.cancel()
+    flights.land("key", flight, "value")
+
+    assert not flight.cancelled()
+    assert flight.result() == "value"
@@ -0,0 +1,36 @@
+from sqlalchemy import text
+
+from roadmap.catalog import catalog_entries
+from roadmap.catalog import CATALOG_VERSION
+from roadmap.catalog import get_catalog_version
+from roadmap.catalog import load_app_stream_catalog
+from roadmap.config import Settings
+from roadmap.data.app_streams import APP_STREAM_MODULES_BY_KEY
+from roadmap.data.app_streams import APP_STREAM_PACKAGES
+from roadmap.database import get_engine
+
+
+def test_catalog_entries():
+    entries = catalog_entries()
+
+    assert len(entries) == len(APP_STREAM_MODULES_BY_KEY) + len(APP_STREAM_PACKAGES)
+
+
+def test_catalog_version():
+    entries = catalog_entries()
+
+    assert get_catalog_version(entries) == CATALOG_VERSION
+    assert get_catalog_version(entries[1:]) != CATALOG_VERSION
+
+
+async def test_load_app_stream_catalog():
+    engine = get_engine(Settings.create())
+    await load_app_stream_catalog(engine)
+
+    async with engine.connect() as connection:
+        count = await connection.scalar(text("SELECT count(*) FROM app_stream_catalog"))
+        version = await connection.scalar(text("SELECT version FROM app_stream_catalog_version"))
+
+    assert count == len(catalog_entries())
+    assert version == CATALOG_VERSION
+    assert await load_app_stream_catalog(engine) is False
@@ -1,19 +1,62 @@
+import asyncio
+
+from collections import defaultdict
 from datetime import date
-from email.message import Message
-from io import BytesIO
-from urllib.error import HTTPError
+from pathlib import Path
 
 import pytest
 
 from fastapi import HTTPException
-
+from fastapi import Request
+from prometheus_client import REGISTRY
+from psycopg.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import text
+
+from roadmap.cache import WARM_UP_SCOPE_KEY
+from roadmap.common import _raise_for_canceled
+from roadmap.common import build_app_stream_count_rollup_query
+from roadmap.common import build_app_stream_match_query
+from roadmap.common import build_host_app_streams_query
+from roadmap.common import build_host_count_query
+from roadmap.common import build_host_count_rollup_query
+from roadmap.common import build_host_page_query
+from roadmap.common import build_host_query
+from roadmap.common import build_watermark_query
+from roadmap.common import cancel_on_disconnect
 from roadmap.common import check_inventory_access
 from roadmap.common import decode_header
 from roadmap.common import ensure_date
+from roadmap.common import get_lifecycle_type
+from roadmap.common import get_package_names
+from roadmap.common import host_inventory
+from roadmap.common import iter_hosts
+from roadmap.common import KeysetScan
+from roadmap.common import OS_MAJOR_SQL
+from roadmap.common import OS_MINOR_SQL
+from roadmap.common import query_host_counts
 from roadmap.common import query_host_inventory
 from roadmap.common import query_rbac
 from roadmap.config import Settings
 from roadmap.database import get_db
+from roadmap.database import get_read_db
+from roadmap.models import HostStaleness
+from roadmap.rbac import close_rbac_client
+
+
+def make_request(disconnect_after=None):
+    """Create a request that reports a client disconnect after the given number of checks."""
+    checks = 0
+
+    async def receive():
+        nonlocal checks
+        checks += 1
+        if disconnect_after is not None and checks > disconnect_after:
+            return {"type": "http.disconnect"}
+
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "query_string": b""}, receive)
 
 
 @pytest.fixture(scope="module")
@@ -21,6 +64,7 @@ async def base_args():
     settings = Settings.create()
     session = await anext(get_db(settings))
     return {
+        "request": make_request(),
         "org_id": "1234",
         "session": session,
         "settings": settings,
@@ -74,6 +118,485 @@ async def test_query_host_inventory_major_minor(base_args, major, minor):
     assert minor_versions == {minor}, "Minor version mismatch"
 
 
+async def test_query_host_inventory_fields(base_args):
+    query = host_inventory("operating_system", "installed_products")
+    records = await anext(query(**base_args))
+    results = [item async for item in records.mappings()]
+
+    assert len(results) > 1
+    assert results[0].keys() == {"id", "system_profile_facts"}
+    assert all(set(result["system_profile_facts"]) <= {"operating_system", "installed_products"} for result in results)
+
+
+def test_build_host_query():
+    query = build_host_query(["operating_system"])
+
+    assert query.startswith("SELECT id, jsonb_strip_nulls(jsonb_build_object('operating_system', ")
+    assert "installed_packages" not in query
+    assert "SELECT *" not in query
+    assert "major" not in query
+
+
+def test_build_host_query_major_minor():
+    query = build_host_query(["operating_system"], major=9, minor=5)
+
+    assert "#>> '{operating_system,major}' = :major" in query
+    assert "#>> '{operating_system,minor}' = :minor" in query
+
+
+def test_os_version_filter_matches_index():
+    """The version filter must use the same expressions as the index created during replication."""
+    replication_script = Path(__file__).parent.parent.joinpath("scripts", "replication.py").read_text()
+    query = build_host_query(["operating_system"], major=9, minor=5)
+
+    assert f"{OS_MAJOR_SQL} = :major" in query
+    assert f"{OS_MINOR_SQL} = :minor" in query
+    assert f"({OS_MAJOR_SQL})" in replication_script
+    assert f"({OS_MINOR_SQL})" in replication_script
+
+
+@pytest.mark.parametrize(
+    ("staleness", "expected"),
+    (
+        (HostStaleness.fresh, "stale_timestamp > now()"),
+        (HostStaleness.stale, "stale_timestamp > now() - INTERVAL '7 days'"),
+        (HostStaleness.stale_warning, "stale_timestamp > now() - INTERVAL '14 days'"),
+    ),
+)
+def test_build_host_query_staleness(staleness, expected):
+    query = build_host_query(["operating_system"], staleness=staleness)
+
+    assert query.endswith(f"WHERE org_id = :org_id AND {expected}")
+
+
+def test_build_host_query_culled():
+    query = build_host_query(["operating_system"], staleness=HostStaleness.culled)
+
+    assert "stale_timestamp" not in query
+
+
+async def test_query_host_inventory_staleness(base_args):
+    """Fresh hosts are a subset of all hosts."""
+    fresh_settings = Settings(host_staleness=HostStaleness.fresh)
+    culled_settings = Settings(host_staleness=HostStaleness.culled)
+
+    records = await anext(query_host_inventory(**base_args | {"settings": fresh_settings}))
+    fresh = {item["id"] async for item in records.mappings()}
+    records = await anext(query_host_inventory(**base_args | {"settings": culled_settings}))
+    everything = {item["id"] async for item in records.mappings()}
+
+    assert fresh <= everything
+    assert len(everything) > 1
+
+
+def test_build_host_query_roadmap_hosts():
+    query = build_host_query(["installed_products", "installed_packages"], major=9, minor=5, source="roadmap_hosts")
+
+    assert "'lifecycle', to_jsonb(lifecycle)" in query
+    assert "'package_names', to_jsonb(package_names)" in query
+    assert "FROM hbi.roadmap_hosts WHERE" in query
+    assert "os_major = CAST(:major AS integer)" in query
+    assert "os_minor = CAST(:minor AS integer)" in query
+    assert "system_profile_facts ->" not in query
+
+
+def test_build_host_query_filter_packages():
+    query = build_host_query(["installed_packages"], source="roadmap_hosts", filter_packages=True)
+    hosts_query = build_host_query(["installed_packages"], source="hosts", filter_packages=True)
+
+    assert "name = ANY(CAST(:packages AS text[]))" in query
+    assert ":packages" not in hosts_query
+
+
+async def test_query_host_inventory_filter_packages(base_args):
+    settings = Settings(host_source="roadmap_hosts", host_staleness=HostStaleness.culled)
+    packages = {"nodejs", "python3.11", "postgresql"}
+    records = await anext(host_inventory("installed_packages")(**base_args | {"settings": settings}))
+    expected = {
+        record["id"]: set(record["system_profile_facts"]["package_names"]) async for record in records.mappings()
+    }
+
+    query = host_inventory("installed_packages", packages=packages)
+    records = await anext(query(**base_args | {"settings": settings}))
+    results = {
+        record["id"]: set(record["system_profile_facts"]["package_names"]) async for record in records.mappings()
+    }
+
+    assert results == {id: names & packages for id, names in expected.items()}
+
+
+async def test_query_host_inventory_roadmap_hosts(base_args):
+    """The projection maintained by the trigger matches parsing the system profile."""
+    settings = Settings(host_source="roadmap_hosts", host_staleness=HostStaleness.culled)
+    fields = ("operating_system", "installed_products", "installed_packages")
+    records = await anext(host_inventory(*fields)(**base_args | {"settings": Settings(host_staleness="culled")}))
+    expected = {}
+    async for record in records.mappings():
+        system_profile = record["system_profile_facts"]
+        expected[record["id"]] = (
+            system_profile.get("operating_system", {}).get("major"),
+            get_lifecycle_type(system_profile.get("installed_products", [{}])),
+            get_package_names(system_profile.get("installed_packages", [])),
+        )
+
+    records = await anext(host_inventory(*fields)(**base_args | {"settings": settings}))
+    results = {}
+    async for record in records.mappings():
+        system_profile = record["system_profile_facts"]
+        results[record["id"]] = (
+            system_profile.get("operating_system", {}).get("major"),
+            system_profile["lifecycle"],
+            set(system_profile["package_names"]),
+        )
+
+    assert results == expected
+
+
+def test_get_package_names():
+    packages = [
+        "NetworkManager-1:1.44.0-5.el9_3.x86_64",
+        "python3-libs-0:3.9.18-1.el9_3.x86_64",
+        "python3-libs-0:3.9.18-3.el9_4.x86_64",
+    ]
+
+    assert get_package_names(packages) == {"NetworkManager", "python3-libs"}
+
+
+def test_build_host_query_unknown_field():
+    with pytest.raises(ValueError, match="Unknown system profile field"):
+        build_host_query(["facts"])
+
+
+def test_host_inventory_unknown_field():
+    with pytest.raises(ValueError, match="Unknown system profile field"):
+        host_inventory("tags")
+
+
+@pytest.mark.parametrize(("major", "minor"), ((None, None), (9, None), (8, 1)))
+async def test_query_host_counts(base_args, major, minor):
+    """Counting in the database must match counting each host in Python."""
+    records = await anext(query_host_inventory(**base_args, major=major, minor=minor))
+    expected = defaultdict(int)
+    async for record in records.mappings():
+        system_profile = record["system_profile_facts"]
+        if name := system_profile.get("operating_system", {}).get("name"):
+            key = (
+                name,
+                system_profile["operating_system"]["major"],
+                system_profile["operating_system"].get("minor"),
+                get_lifecycle_type(system_profile.get("installed_products", [{}])),
+            )
+            expected[key] += 1
+
+    results = await query_host_counts(**base_args, major=major, minor=minor)
+    counts = {
+        (row["name"], row["major"], row["minor"], row["lifecycle"]): row["count"]
+        for row in results
+        if row["name"] is not None
+    }
+
+    assert counts == expected
+
+
+def test_build_host_count_query():
+    query = build_host_count_query(9)
+
+    assert "GROUP BY" in query
+    assert "count(*)" in query
+    assert "#>> '{operating_system,major}' = :major" in query
+    assert ":minor" not in query
+    assert f"CASE WHEN {OS_MAJOR_SQL} ~ '^[0-9]+$' THEN ({OS_MAJOR_SQL})::int END AS major" in query
+
+
+async def test_query_host_counts_malformed_version(base_args):
+    """A host with a version that is not a number is counted without one rather than failing the query."""
+    session = base_args["session"]
+    try:
+        await session.execute(
+            text(
+                """
+                INSERT INTO hbi.hosts
+                SELECT (jsonb_populate_record(hosts, jsonb_build_object(
+                    'id', gen_random_uuid(),
+                    'org_id', 'malformed',
+                    'system_profile_facts', '{"operating_system": {"name": "RHEL", "major": "nine", "minor": "x"}}'::jsonb
+                ))).*
+                FROM hbi.hosts
+                LIMIT 1
+                """
+            )
+        )
+        results = await query_host_counts(**base_args | {"org_id": "malformed"})
+    finally:
+        await session.rollback()
+
+    assert [(row["name"], row["major"], row["minor"], row["count"]) for row in results] == [("RHEL", None, None, 1)]
+
+
+def test_build_host_count_query_roadmap_hosts():
+    query = build_host_count_query(9, source="roadmap_hosts")
+
+    assert "FROM hbi.roadmap_hosts" in query
+    assert "os_major = CAST(:major AS integer)" in query
+    assert "system_profile_facts" not in query
+
+
+@pytest.mark.parametrize(("source", "table"), (("hosts", "hbi.hosts"), ("roadmap_hosts", "hbi.roadmap_hosts")))
+def test_build_app_stream_match_query(source, table):
+    query = build_app_stream_match_query(9, source=source)
+
+    assert f"FROM {table}" in query
+    assert "JOIN app_stream_catalog AS catalog" in query
+    assert "array_agg(DISTINCT id) AS systems" in query
+    assert "WHERE NOT rolling" in query
+    assert ":major" in query
+    assert ":minor" not in query
+
+
+def test_build_host_app_streams_query():
+    query = build_host_app_streams_query(9, 4, HostStaleness.fresh)
+
+    assert "FROM host_app_streams" in query
+    assert "os_major = CAST(:major AS integer)" in query
+    assert "os_minor = CAST(:minor AS integer)" in query
+    assert "stale_timestamp > now()" in query
+    assert "array_agg(host_id) AS systems" in query
+
+
+def test_build_host_count_rollup_query():
+    query = build_host_count_rollup_query(9, staleness=HostStaleness.fresh)
+
+    assert "FROM hbi.roadmap_rhel_counts" in query
+    assert "stale_bucket >= date_trunc('hour', now(), 'UTC') + INTERVAL '1 hour'" in query
+    # Hosts in the hour containing the cutoff are counted exactly
+    assert "FROM hbi.roadmap_hosts" in query
+    assert "stale_timestamp > now() AND stale_timestamp < date_trunc('hour', now(), 'UTC')" in query
+    assert "os_major = CAST(:major AS integer)" in query
+
+
+def test_build_host_count_rollup_query_culled():
+    query = build_host_count_rollup_query(staleness=HostStaleness.culled)
+
+    assert "FROM hbi.roadmap_rhel_counts" in query
+    assert "hbi.roadmap_hosts" not in query
+    assert "stale" not in query
+
+
+def test_build_app_stream_count_rollup_query():
+    query = build_app_stream_count_rollup_query(staleness=HostStaleness.stale_warning)
+
+    assert "FROM host_app_stream_counts" in query
+    assert "FROM host_app_streams" in query
+    assert "sum(count)::int AS count" in query
+
+
+@pytest.mark.parametrize("staleness", (HostStaleness.fresh, HostStaleness.culled))
+async def test_query_host_counts_rollup(base_args, staleness):
+    """Counts read from the rollup table match counting hbi.roadmap_hosts."""
+    settings = Settings(host_source="roadmap_hosts", host_staleness=staleness)
+    expected = await query_host_counts(**base_args | {"settings": settings})
+    results = await query_host_counts(**base_args | {"settings": settings.model_copy(update={"use_rollups": True})})
+
+    assert sorted(map(dict, results), key=repr) == sorted(map(dict, expected), key=repr)
+
+
+def test_build_watermark_query():
+    query = build_watermark_query(HostStaleness.fresh, "roadmap_hosts")
+
+    assert "max(modified_on)" in query
+    assert "count(*) FILTER (WHERE stale_timestamp > now())" in query
+    assert "FROM hbi.roadmap_hosts WHERE org_id = :org_id" in query
+    assert "host_app_streams_state" not in query
+
+
+def test_build_watermark_query_precomputed():
+    query = build_watermark_query(precomputed=True)
+
+    assert "FILTER" not in query
+    assert "FROM host_app_streams_state" in query
+    assert "max(generation)" in query
+
+
+async def test_query_host_inventory_batches(base_args):
+    settings = Settings(db_fetch_batch_size=10)
+    records = await anext(query_host_inventory(**base_args | {"settings": settings}))
+    partitions = [partition async for partition in records.mappings().partitions()]
+
+    assert len(partitions) > 1
+    assert all(len(partition) <= 10 for partition in partitions)
+
+
+class FakeMappings:
+    async def partitions(self):
+        for partition in ([{"id": 1}, {"id": 2}], [{"id": 3}]):
+            yield partition
+
+
+class FakeResult:
+    closed = False
+
+    def mappings(self):
+        return FakeMappings()
+
+    async def close(self):
+        self.closed = True
+
+
+async def test_iter_hosts():
+    batches_before = REGISTRY.get_sample_value("roadmap_host_fetch_batches_sum") or 0
+    rows_before = REGISTRY.get_sample_value("roadmap_host_fetch_batch_rows_sum") or 0
+
+    results = [row["id"] async for row in iter_hosts(FakeResult(), make_request())]
+
+    assert results == [1, 2, 3]
+    assert REGISTRY.get_sample_value("roadmap_host_fetch_batches_sum") - batches_before == 2
+    assert REGISTRY.get_sample_value("roadmap_host_fetch_batch_rows_sum") - rows_before == 3
+
+
+async def test_iter_hosts_disconnect():
+    result = FakeResult()
+    rows = []
+    with pytest.raises(HTTPException, match="Client disconnected"):
+        async for row in iter_hosts(result, make_request(disconnect_after=0)):
+            rows.append(row["id"])
+
+    assert rows == [1, 2]
+    assert result.closed
+
+
+async def test_cancel_on_disconnect(mocker):
+    driver_connection = mocker.AsyncMock()
+    session = mocker.AsyncMock()
+    session.connection.return_value.get_raw_connection.return_value.driver_connection = driver_connection
+
+    async with cancel_on_disconnect(make_request(disconnect_after=1), session, interval=0.01):
+        await asyncio.sleep(0.1)
+
+    driver_connection.cancel_safe.assert_awaited_once()
+
+
+async def test_cancel_on_disconnect_connected(mocker):
+    driver_connection = mocker.AsyncMock()
+    session = mocker.AsyncMock()
+    session.connection.return_value.get_raw_connection.return_value.driver_connection = driver_connection
+
+    async with cancel_on_disconnect(make_request(), session, interval=0.01):
+        await asyncio.sleep(0.05)
+
+    driver_connection.cancel_safe.assert_not_awaited()
+
+
+@pytest.mark.parametrize(
+    ("disconnect_after", "status_code"),
+    (
+        (0, 499),
+        (None, 504),
+    ),
+)
+async def test_raise_for_canceled(disconnect_after, status_code):
+    exc = OperationalError("SELECT", {}, QueryCanceled("canceling statement"))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await _raise_for_canceled(exc, make_request(disconnect_after))
+
+    assert exc_info.value.status_code == status_code
+
+
+async def test_raise_for_canceled_other_error():
+    exc = OperationalError("SELECT", {}, Exception("connection lost"))
+
+    with pytest.raises(OperationalError):
+        await _raise_for_canceled(exc, make_request())
+
+
+async def test_query_host_inventory_statement_timeout(base_args):
+    settings = Settings(db_statement_timeout=1)
+    async for session in get_read_db(settings):
+        result = await session.execute(text("SHOW statement_timeout"))
+
+        assert result.scalar() == "1s"
+
+
+def test_build_host_page_query():
+    first_page = build_host_page_query(["operating_system"])
+    next_page = build_host_page_query(["operating_system"], after_id=True)
+
+    assert first_page.endswith("WHERE org_id = :org_id ORDER BY id LIMIT :limit")
+    assert next_page.endswith("WHERE org_id = :org_id AND id > :last_id ORDER BY id LIMIT :limit")
+
+
+async def test_query_host_inventory_keyset(base_args):
+    """Keyset pages return the same hosts as a single cursor."""
+    settings = Settings(host_scan_mode="keyset", db_fetch_batch_size=7)
+    records = await anext(query_host_inventory(**base_args))
+    expected = [item["id"] async for item in records.mappings()]
+
+    scan = await anext(query_host_inventory(**base_args | {"settings": settings}))
+    results = [item["id"] async for item in iter_hosts(scan, make_request())]
+
+    assert isinstance(scan, KeysetScan)
+    assert sorted(results) == sorted(expected)
+    assert results == sorted(results)
+
+
+def fake_page_session(mocker, pages):
+    """Create a session that returns each page in turn. An exception in pages is raised instead."""
+    session = mocker.AsyncMock()
+    results = []
+    for page in pages:
+        if isinstance(page, Exception):
+            results.append(page)
+            continue
+
+        result = mocker.Mock()
+        result.mappings.return_value.all.return_value = page
+        results.append(result)
+
+    session.execute.side_effect = results
+    return session
+
+
+async def test_keyset_scan(mocker):
+    session = fake_page_session(mocker, [[{"id": 1}, {"id": 2}], [{"id": 3}]])
+    settings = Settings(db_fetch_batch_size=2, db_statement_timeout=0)
+    scan = KeysetScan(session, settings, ["operating_system"], "1234")
+
+    pages = [page async for page in scan.mappings().partitions()]
+    params = [call.args[1] for call in session.execute.call_args_list]
+
+    assert pages == [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+    assert [param["last_id"] for param in params] == [None, 2]
+    assert scan.last_id == 3
+    assert session.commit.await_count == 2
+
+
+async def test_keyset_scan_packages(mocker):
+    session = fake_page_session(mocker, [[{"id": 1}]])
+    settings = Settings(db_fetch_batch_size=2, db_statement_timeout=0, host_source="roadmap_hosts")
+    scan = KeysetScan(session, settings, ["installed_packages"], "1234", packages={"nodejs", "git"})
+
+    [page async for page in scan.mappings().partitions()]
+    query, params = session.execute.call_args.args
+
+    assert ":packages" in str(query)
+    assert params["packages"] == ["git", "nodejs"]
+
+
+async def test_keyset_scan_resume(mocker):
+    lost_connection = OperationalError("SELECT", {}, Exception("server closed the connection"))
+    lost_connection.connection_invalidated = True
+    session = fake_page_session(mocker, [[{"id": 1}, {"id": 2}], lost_connection, [{"id": 3}]])
+    settings = Settings(db_fetch_batch_size=2, db_statement_timeout=0)
+    scan = KeysetScan(session, settings, ["operating_system"], "1234")
+
+    pages = [page async for page in scan.mappings().partitions()]
+    params = [call.args[1] for call in session.execute.call_args_list]
+
+    assert pages == [[{"id": 1}, {"id": 2}], [{"id": 3}]]
+    assert [param["last_id"] for param in params] == [None, 2, 2]
+    session.rollback.assert_awaited_once()
+
+
 async def test_query_host_inventory_groups(base_args):
     with pytest.raises(HTTPException, match="not yet implemented"):
         await anext(query_host_inventory(**base_args | {"groups": ["some_groups"]}))
@@ -133,41 +656,48 @@ async def test_decode_header(value, expected):
     assert result == expected
 
 
-async def test_query_rbac(mocker, read_fixture_file):
-    settings = Settings(rbac_hostname="example.com")
-    mocker.patch(
-        "roadmap.common.urllib.request.urlopen",
-        return_value=BytesIO(read_fixture_file("rbac_response.json", mode="rb")),
-    )
+@pytest.fixture
+async def rbac_settings(rbac_server):
+    yield Settings(rbac_hostname=rbac_server.hostname, rbac_port=rbac_server.port)
+    await close_rbac_client()
+
 
-    result = await query_rbac(settings)
+async def test_query_rbac(rbac_server, rbac_settings, read_json_fixture):
+    rbac_server.body = read_json_fixture("rbac_response.json")
+
+    result = await query_rbac(make_request(), rbac_settings, "identity")
 
     assert result == [{"permission": "inventory:*:*:foo", "resourceDefinitions": []}]
+    assert rbac_server.requests[0][0] == "identity"
 
 
-async def test_query_rbac_error(mocker):
-    settings = Settings(rbac_hostname="example.com")
-    mocker.patch(
-        "roadmap.common.urllib.request.urlopen",
-        side_effect=HTTPError(url="url", code=401, hdrs=Message(), msg="Raised intentionally", fp=BytesIO()),
-    )
+async def test_query_rbac_error(rbac_server, rbac_settings):
+    rbac_server.status, rbac_server.reason = 401, "Raised intentionally"
 
     with pytest.raises(HTTPException, match="Raised intentionally"):
-        await query_rbac(settings)
+        await query_rbac(make_request(), rbac_settings)
 
 
 async def test_query_rbac_dev_mode():
     settings = Settings(dev=True)
 
-    result = await query_rbac(settings)
+    result = await query_rbac(make_request(), settings)
+
+    assert result == [{"permission": "inventory:*:*", "resourceDefinitions": []}]
+
+
+async def test_query_rbac_warm_up(rbac_server, rbac_settings):
+    """Requests made at startup to fill the cache do not query RBAC."""
+    result = await query_rbac(Request({"type": "http", WARM_UP_SCOPE_KEY: True}), rbac_settings)
 
     assert result == [{"permission": "inventory:*:*", "resourceDefinitions": []}]
+    assert rbac_server.requests == []
 
 
 async def test_query_rbac_no_url():
     settings = Settings(rbac_hostname="")
 
-    result = await query_rbac(settings)
+    result = await query_rbac(make_request(), settings)
 
     assert result == [{}]
 
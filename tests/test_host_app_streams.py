@@ -0,0 +1,198 @@
+import asyncio
+import json
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import UTC
+from types import SimpleNamespace
+
+import pytest
+
+from sqlalchemy import text
+
+from roadmap.cache import cache_key
+from roadmap.cache import MemoryBackend
+from roadmap.cache import ResponseCache
+from roadmap.catalog import CATALOG_VERSION
+from roadmap.catalog import load_app_stream_catalog
+from roadmap.common import build_app_stream_count_rollup_query
+from roadmap.common import build_app_stream_match_query
+from roadmap.common import build_host_app_streams_query
+from roadmap.common import build_watermark_query
+from roadmap.config import Settings
+from roadmap.database import get_engine
+from roadmap.host_app_streams import create_host_app_streams_tables
+from roadmap.host_app_streams import refresh_host_app_streams
+from roadmap.host_app_streams import run_host_app_streams_worker
+
+
+async def test_refresh_host_app_streams():
+    """Precomputed rows match the app streams computed at request time."""
+    settings = Settings.create()
+    engine = get_engine(settings)
+    await load_app_stream_catalog(engine)
+    async with engine.begin() as connection:
+        await connection.execute(text("DROP TABLE IF EXISTS host_app_streams, host_app_streams_state"))
+
+    await create_host_app_streams_tables(engine)
+
+    assert await refresh_host_app_streams(engine, settings) is True
+    # The second refresh only recomputes recently modified hosts
+    assert await refresh_host_app_streams(engine, settings) is True
+
+    async with engine.connect() as connection:
+        params = {"org_id": "1234"}
+        expected = (await connection.execute(text(build_app_stream_match_query()), params)).mappings().all()
+        results = (await connection.execute(text(build_host_app_streams_query()), params)).mappings().all()
+
+    def normalize(rows):
+        return sorted(
+            ((*(value for key, value in row.items() if key != "systems"), sorted(row["systems"])) for row in rows),
+            key=repr,
+        )
+
+    assert len(results) > 0
+    assert normalize(results) == normalize(expected)
+
+
+async def test_host_app_stream_counts():
+    """The rollup counts match counting the rows in host_app_streams."""
+    settings = Settings.create()
+    engine = get_engine(settings)
+    await load_app_stream_catalog(engine)
+    await create_host_app_streams_tables(engine)
+    await refresh_host_app_streams(engine, settings)
+    async with engine.begin() as connection:
+        # Replace some rows so the trigger has to keep the counts current
+        await connection.execute(
+            text("DELETE FROM host_app_streams WHERE host_id IN (SELECT host_id FROM host_app_streams LIMIT 5)")
+        )
+        await connection.execute(text("UPDATE host_app_streams_state SET watermark = watermark - INTERVAL '1 day'"))
+
+    await refresh_host_app_streams(engine, settings)
+    async with engine.connect() as connection:
+        params = {"org_id": "1234"}
+        rows = (await connection.execute(text(build_host_app_streams_query()), params)).mappings().all()
+        counts = (await connection.execute(text(build_app_stream_count_rollup_query()), params)).mappings().all()
+
+    expected = {tuple(value for key, value in row.items() if key != "systems"): len(row["systems"]) for row in rows}
+    results = {tuple(value for key, value in row.items() if key != "count"): row["count"] for row in counts}
+
+    assert len(results) > 0
+    assert results == expected
+
+
+async def test_refresh_host_app_streams_sweep_watermark():
+    """Sweeping a deleted host changes the watermark of cached app stream responses."""
+    settings = Settings.create().model_copy(update={"host_app_streams_sweep_interval": 0})
+    engine = get_engine(settings)
+    await load_app_stream_catalog(engine)
+    await create_host_app_streams_tables(engine)
+    await refresh_host_app_streams(engine, settings)
+    cache = ResponseCache(MemoryBackend(100))
+    key = cache_key("1234", "/relevant/lifecycle/app-streams", [])
+    query = text(build_watermark_query(precomputed=True))
+    async with engine.begin() as connection:
+        host = await connection.scalar(
+            text(
+                "DELETE FROM hbi.hosts WHERE id = (SELECT host_id FROM host_app_streams WHERE org_id = '1234' LIMIT 1)"
+                " RETURNING to_jsonb(hosts)"
+            )
+        )
+
+    try:
+        # A response computed after the host is deleted but before it is swept
+        async with engine.connect() as connection:
+            watermark = tuple((await connection.execute(query, {"org_id": "1234"})).one())
+        await (await cache.lookup(key, watermark, ttl=60)).set({"data": []})
+
+        await refresh_host_app_streams(engine, settings)
+        async with engine.connect() as connection:
+            swept_watermark = tuple((await connection.execute(query, {"org_id": "1234"})).one())
+    finally:
+        async with engine.begin() as connection:
+            await connection.execute(
+                text(
+                    "INSERT INTO hbi.hosts SELECT * FROM jsonb_populate_record(NULL::hbi.hosts, CAST(:host AS jsonb))"
+                ),
+                {"host": json.dumps(host)},
+            )
+            # The restored host is not modified, so only a full refresh recomputes it
+            await connection.execute(text("DELETE FROM host_app_streams_state"))
+
+    assert (await cache.lookup(key, watermark, ttl=60)).hit
+    assert not (await cache.lookup(key, swept_watermark, ttl=60)).hit
+
+
+async def test_create_host_app_streams_tables():
+    """The tables exist before the first refresh and creating them again is harmless."""
+    settings = Settings.create()
+    engine = get_engine(settings)
+    async with engine.begin() as connection:
+        await connection.execute(
+            text("DROP TABLE IF EXISTS host_app_streams, host_app_stream_counts, host_app_streams_state")
+        )
+
+    await create_host_app_streams_tables(engine)
+    await create_host_app_streams_tables(engine)
+
+    async with engine.connect() as connection:
+        rows = (await connection.execute(text(build_host_app_streams_query()), {"org_id": "1234"})).all()
+
+    assert rows == []
+
+
+async def test_refresh_host_app_streams_locked(mocker):
+    connection = mocker.AsyncMock()
+    connection.scalar.return_value = False
+    engine = mocker.MagicMock()
+    engine.begin.return_value.__aenter__.return_value = connection
+
+    assert await refresh_host_app_streams(engine, Settings()) is False
+    connection.execute.assert_not_called()
+
+
+async def test_refresh_host_app_streams_full_does_not_truncate(mocker):
+    """A full refresh does not take a lock that blocks readers."""
+    connection = mocker.AsyncMock()
+    connection.scalar.side_effect = [True, None]
+    connection.execute.return_value = mocker.MagicMock(first=mocker.Mock(return_value=None))
+    engine = mocker.MagicMock()
+    engine.begin.return_value.__aenter__.return_value = connection
+
+    assert await refresh_host_app_streams(engine, Settings()) is True
+    statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+    assert "DELETE FROM host_app_streams" in statements
+    assert not any("TRUNCATE" in statement for statement in statements)
+
+
+@pytest.mark.parametrize(("swept_ago", "swept"), ((timedelta(minutes=1), False), (timedelta(hours=2), True)))
+async def test_refresh_host_app_streams_sweep(mocker, swept_ago, swept):
+    """Deleted hosts are only looked for every host_app_streams_sweep_interval seconds."""
+    now = datetime.now(UTC)
+    state = SimpleNamespace(catalog_version=CATALOG_VERSION, watermark=now, swept_on=now - swept_ago, generation=3)
+    connection = mocker.AsyncMock()
+    connection.scalar.side_effect = [True, now]
+    connection.execute.return_value = mocker.MagicMock(first=mocker.Mock(return_value=state), rowcount=1)
+    engine = mocker.MagicMock()
+    engine.begin.return_value.__aenter__.return_value = connection
+
+    assert await refresh_host_app_streams(engine, Settings(host_app_streams_sweep_interval=3600)) is True
+    statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+    assert any("NOT EXISTS" in statement for statement in statements) is swept
+    assert (connection.execute.call_args.args[1]["swept_on"] == state.swept_on) is not swept
+    # Removing rows for deleted hosts invalidates cached responses
+    assert connection.execute.call_args.args[1]["generation"] == 3 + swept
+
+
+async def test_run_host_app_streams_worker(mocker):
+    """Errors are logged and the worker keeps running until canceled."""
+    refresh = mocker.patch(
+        "roadmap.host_app_streams.refresh_host_app_streams",
+        side_effect=[RuntimeError("Raised intentionally"), True, asyncio.CancelledError()],
+    )
+
+    with pytest.raises(asyncio.CancelledError):
+        await run_host_app_streams_worker(mocker.Mock(), Settings(host_app_streams_interval=0))
+
+    assert refresh.await_count == 3
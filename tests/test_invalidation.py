@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from sqlalchemy import text
+
+from roadmap.config import Settings
+from roadmap.database import get_engine
+from roadmap.invalidation import add_listener
+from roadmap.invalidation import dispatch
+from roadmap.invalidation import listen_for_host_changes
+from roadmap.invalidation import remove_listener
+
+
+@pytest.fixture
+def changed_orgs():
+    queue = asyncio.Queue()
+    add_listener(queue.put_nowait)
+    yield queue
+    remove_listener(queue.put_nowait)
+
+
+def test_dispatch(changed_orgs):
+    dispatch("1234")
+    dispatch(None)
+
+    assert changed_orgs.get_nowait() == "1234"
+    assert changed_orgs.get_nowait() is None
+
+
+def test_dispatch_listener_error(changed_orgs):
+    def broken(org_id):
+        raise ValueError("Boom")
+
+    add_listener(broken)
+    try:
+        dispatch("1234")
+    finally:
+        remove_listener(broken)
+
+    assert changed_orgs.get_nowait() == "1234"
+
+
+def test_remove_listener_missing():
+    remove_listener(print)
+
+
+async def test_listen_for_host_changes_reconnect(changed_orgs):
+    """The listener keeps retrying while the database is unreachable."""
+    settings = Settings(db_port=1, host_change_retry_interval=0.01)
+    task = asyncio.create_task(listen_for_host_changes(settings))
+    await asyncio.sleep(0.1)
+
+    assert not task.done()
+    assert changed_orgs.empty()
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def test_listen_for_host_changes_unexpected_error(mocker):
+    """An error that is not from the database does not stop the listener."""
+    connect = mocker.patch("psycopg.AsyncConnection.connect", side_effect=OSError("Raised intentionally"))
+    settings = Settings(host_change_retry_interval=0.01)
+    task = asyncio.create_task(listen_for_host_changes(settings))
+    await asyncio.sleep(0.1)
+
+    assert not task.done()
+    assert connect.await_count > 1
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def test_listen_for_host_changes(changed_orgs):
+    settings = Settings.create()
+    task = asyncio.create_task(listen_for_host_changes(settings))
+    try:
+        # Every org is dispatched once the listener is connected
+        assert await asyncio.wait_for(changed_orgs.get(), 10) is None
+
+        engine = get_engine(settings)
+        async with engine.begin() as connection:
+            await connection.execute(
+                text(
+                    "UPDATE hbi.hosts SET modified_on = modified_on"
+                    " WHERE id IN (SELECT id FROM hbi.hosts WHERE org_id = '1234' LIMIT 10)"
+                )
+            )
+
+        assert await asyncio.wait_for(changed_orgs.get(), 10) == "1234"
+        assert changed_orgs.empty()
+    finally:
+        task.cancel()
@@ -5,11 +5,29 @@ def test_ping(client):
     assert response.json() == {"status": "pong"}
 
 
+def test_ready(client):
+    response = client.get("/api/roadmap/v1/ready")
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "ready"}
+
+
+def test_ready_warming_up(client):
+    client.app.state.ready = False
+
+    response = client.get("/api/roadmap/v1/ready")
+
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Warming up"}
+
+
 def test_metrics(client):
     response = client.get("/metrics")
+    body = response.read()
 
     assert response.status_code == 200
-    assert b"roadmap_http_request" in response.read()
+    assert b"roadmap_http_request" in body
+    assert b'roadmap_db_connections_in_use{pool="primary"}' in body
 
 
 def test_openapi_docs_root(client):
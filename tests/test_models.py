@@ -1,8 +1,11 @@
 from datetime import date
+from datetime import timedelta
 
 import pytest
 
+from roadmap.models import _calculate_support_status
 from roadmap.models import LifecycleType
+from roadmap.models import next_support_status_change
 from roadmap.models import SupportStatus
 from roadmap.models import System
 
@@ -78,3 +81,42 @@ def test_calculate_support_status_system(mocker, current_date, system_start, sys
     )
 
     assert app_stream.support_status == status
+
+
+@pytest.mark.parametrize(
+    ("current_date", "start", "end", "expected"),
+    (
+        # Upcoming until the start date
+        (date(2019, 12, 1), date(2020, 1, 1), date(2027, 12, 31), date(2020, 1, 1)),
+        # Supported until 180 days before the end date
+        (date(2025, 3, 27), date(2020, 1, 1), date(2027, 12, 31), date(2027, 7, 4)),
+        (date(2027, 7, 3), date(2020, 1, 1), date(2027, 12, 31), date(2027, 7, 4)),
+        # Support ends within 6 months until the day after the end date
+        (date(2027, 7, 4), date(2020, 1, 1), date(2027, 12, 31), date(2028, 1, 1)),
+        (date(2027, 12, 31), None, date(2027, 12, 31), date(2028, 1, 1)),
+        # Retired and unknown statuses never change
+        (date(2028, 1, 1), date(2020, 1, 1), date(2027, 12, 31), None),
+        (date(2025, 3, 27), date(2020, 1, 1), None, None),
+        (date(2025, 3, 27), "Unknown", "Unknown", None),
+        # An upcoming release with a short support period skips Supported
+        (date(2025, 3, 27), date(2026, 1, 1), date(2026, 3, 1), date(2026, 1, 1)),
+    ),
+)
+def test_next_support_status_change(current_date, start, end, expected):
+    result = next_support_status_change([(start, end)], current_date)
+
+    assert result == expected
+    if expected is not None:
+        before = _calculate_support_status(start_date=start, end_date=end, current_date=expected - timedelta(days=1))
+        assert _calculate_support_status(start_date=start, end_date=end, current_date=expected) != before
+
+
+def test_next_support_status_change_earliest():
+    dates = [
+        (date(2020, 1, 1), date(2030, 1, 1)),
+        (date(2020, 1, 1), date(2026, 1, 1)),
+        (date(2020, 1, 1), None),
+    ]
+
+    assert next_support_status_change(dates, date(2025, 3, 27)) == date(2025, 7, 5)
+    assert next_support_status_change([], date(2025, 3, 27)) is None
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from fastapi import HTTPException
+
+from roadmap.rbac import RBACClient
+
+
+@pytest.fixture
+async def rbac_client(rbac_server):
+    def create(ttl: float = 60, denied_ttl: float = 10, max_entries: int = 10, timeout: float = 1) -> RBACClient:
+        client = RBACClient(
+            f"http://{rbac_server.hostname}:{rbac_server.port}",
+            timeout=timeout,
+            max_connections=5,
+            ttl=ttl,
+            denied_ttl=denied_ttl,
+            max_entries=max_entries,
+        )
+        clients.append(client)
+        return client
+
+    clients = []
+    yield create
+    for client in clients:
+        await client.close()
+
+
+async def test_get_access_cached(rbac_server, rbac_client):
+    client = rbac_client()
+
+    first = await client.get_access("identity")
+    second = await client.get_access("identity")
+
+    assert first == second == [{"permission": "inventory:*:*", "resourceDefinitions": []}]
+    assert len(rbac_server.requests) == 1
+
+
+async def test_get_access_per_identity(rbac_server, rbac_client):
+    client = rbac_client()
+
+    await client.get_access("identity")
+    await client.get_access("other")
+
+    assert [identity for identity, address in rbac_server.requests] == ["identity", "other"]
+
+
+async def test_get_access_expired(rbac_server, rbac_client):
+    client = rbac_client(ttl=0.01)
+
+    await client.get_access("identity")
+    await asyncio.sleep(0.02)
+    await client.get_access("identity")
+
+    assert len(rbac_server.requests) == 2
+
+
+async def test_get_access_size(rbac_server, rbac_client):
+    client = rbac_client(max_entries=1)
+
+    await client.get_access("identity")
+    await client.get_access("other")
+    await client.get_access("identity")
+
+    assert len(rbac_server.requests) == 3
+
+
+async def test_get_access_denied_cached(rbac_server, rbac_client):
+    rbac_server.status, rbac_server.reason = 403, "Forbidden"
+    client = rbac_client()
+
+    errors = []
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc_info:
+            await client.get_access("identity")
+
+        assert exc_info.value.status_code == 403
+        assert exc_info.value.detail == "Forbidden"
+        errors.append(exc_info.value)
+
+    assert len(rbac_server.requests) == 1
+    # Cached denials are raised as new exceptions so tracebacks do not accumulate
+    assert errors[1] is not errors[2]
+
+
+async def test_get_access_error_not_cached(rbac_server, rbac_client):
+    rbac_server.status, rbac_server.reason = 500, "Internal Server Error"
+    client = rbac_client()
+
+    for _ in range(2):
+        with pytest.raises(HTTPException, match="Internal Server Error"):
+            await client.get_access("identity")
+
+    assert len(rbac_server.requests) == 2
+
+
+async def test_get_access_coalesced(rbac_server, rbac_client):
+    """Concurrent requests for the same identity share one query."""
+    rbac_server.delay = 0.1
+    client = rbac_client()
+
+    results = await asyncio.gather(*(client.get_access("identity") for _ in range(3)))
+
+    assert results == [[{"permission": "inventory:*:*", "resourceDefinitions": []}]] * 3
+    assert len(rbac_server.requests) == 1
+
+
+async def test_get_access_keep_alive(rbac_server, rbac_client):
+    client = rbac_client(ttl=0)
+
+    await client.get_access("identity")
+    await client.get_access("identity")
+
+    assert len(rbac_server.requests) == 2
+    # Both queries were sent over the same connection
+    assert len({address for identity, address in rbac_server.requests}) == 1
+
+
+async def test_get_access_timeout(rbac_server, rbac_client):
+    rbac_server.delay = 0.5
+    client = rbac_client(timeout=0.05)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await client.get_access("identity")
+
+    assert exc_info.value.status_code == 503
+
+
+async def test_get_access_unavailable():
+    client = RBACClient("http://127.0.0.1:1", timeout=1, max_connections=1, ttl=60, denied_ttl=10, max_entries=10)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await client.get_access("identity")
+
+    await client.close()
+    assert exc_info.value.status_code == 503
@@ -0,0 +1,99 @@
+import importlib
+import logging
+
+import replication
+
+from replication import _hosts_table_ddl
+from replication import _partition_index_ddl
+from replication import check_or_create_hosts_tables
+from replication import HOSTS_INDEXES
+from replication import HOSTS_REPLICA_IDENTITY_QUERY
+from sqlalchemy import create_engine
+from sqlalchemy import text
+
+from roadmap.config import Settings
+
+
+def test_hosts_table_ddl():
+    statements = _hosts_table_ddl(0)
+
+    assert len(statements) == 1
+    assert "PRIMARY KEY (id)" in statements[0]
+    assert "PARTITION BY" not in statements[0]
+
+
+def test_hosts_table_ddl_partitioned():
+    statements = _hosts_table_ddl(4)
+
+    assert "PRIMARY KEY (org_id, id)" in statements[0]
+    assert statements[0].endswith(") PARTITION BY HASH (org_id);")
+    assert statements[1:] == [
+        f"CREATE TABLE hbi.hosts_p{remainder} PARTITION OF hbi.hosts FOR VALUES WITH (MODULUS 4, REMAINDER {remainder})"
+        for remainder in range(4)
+    ]
+
+
+def test_partition_index_ddl():
+    name = "hosts_org_id_watermark_index"
+
+    create_index, attach_index = _partition_index_ddl(name, HOSTS_INDEXES[name], "hosts_p3")
+
+    assert create_index == (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS hosts_p3_org_id_watermark_index"
+        " ON hbi.hosts_p3 (org_id, modified_on, stale_timestamp)"
+    )
+    assert (
+        attach_index
+        == "ALTER INDEX hbi.hosts_org_id_watermark_index ATTACH PARTITION hbi.hosts_p3_org_id_watermark_index"
+    )
+
+
+def test_check_or_create_hosts_tables_replica_identity(mocker, monkeypatch):
+    """hbi.hosts is not partitioned unless the publisher's replica identity includes org_id."""
+    monkeypatch.setenv("HBI_HOSTS_PARTITIONS", "4")
+    mocker.patch("replication._publisher_replica_identity_includes_org_id", return_value=False)
+    session = mocker.MagicMock()
+    session.execute.return_value.fetchall.return_value = []
+
+    check_or_create_hosts_tables(logging.getLogger(__name__), session)
+
+    statements = [str(call.args[0]) for call in session.execute.call_args_list[1:]]
+    assert len(statements) == 1
+    assert "PARTITION" not in statements[0]
+
+
+def test_check_or_create_hosts_tables_partitioned(mocker, monkeypatch):
+    monkeypatch.setenv("HBI_HOSTS_PARTITIONS", "4")
+    mocker.patch("replication._publisher_replica_identity_includes_org_id", return_value=True)
+    session = mocker.MagicMock()
+    session.execute.return_value.fetchall.return_value = []
+
+    check_or_create_hosts_tables(logging.getLogger(__name__), session)
+
+    statements = [str(call.args[0]) for call in session.execute.call_args_list[1:]]
+    assert statements == _hosts_table_ddl(4)
+
+
+def test_hosts_replica_identity_query():
+    engine = create_engine(str(Settings.create().database_url))
+    try:
+        with engine.begin() as connection:
+            default = connection.scalar(text(HOSTS_REPLICA_IDENTITY_QUERY))
+            connection.execute(text("ALTER TABLE hbi.hosts REPLICA IDENTITY FULL"))
+            full = connection.scalar(text(HOSTS_REPLICA_IDENTITY_QUERY))
+            connection.execute(text("ALTER TABLE hbi.hosts REPLICA IDENTITY DEFAULT"))
+    finally:
+        engine.dispose()
+
+    # The primary key of the test table is (id)
+    assert default is False
+    assert full is True
+
+
+def test_import_does_not_configure_logging(monkeypatch):
+    """scripts/load_host_data.py imports replication without changing its logging."""
+    monkeypatch.setattr(logging.getLogger(), "handlers", [])
+
+    importlib.reload(replication)
+
+    assert logging.getLogger().handlers == []
@@ -0,0 +1,81 @@
+import asyncio
+import base64
+import json
+
+from starlette.datastructures import State
+
+from roadmap.cache import WARM_UP_SCOPE_KEY
+from roadmap.config import Settings
+from roadmap.database import get_engine
+from roadmap.warm_up import get_warm_up_org_ids
+from roadmap.warm_up import warm_up
+from roadmap.warm_up import warm_up_enabled
+
+
+class App:
+    def __init__(self, status: int = 200, delay: float = 0):
+        self.state = State()
+        self.state.ready = False
+        self.status = status
+        self.delay = delay
+        self.requests = []
+
+    async def __call__(self, scope, receive, send):
+        self.requests.append(scope)
+        await receive()
+        await asyncio.sleep(self.delay)
+        await send({"type": "http.response.start", "status": self.status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def test_warm_up_enabled():
+    assert not warm_up_enabled(Settings(warm_up_org_ids=["1234"]))
+    assert not warm_up_enabled(Settings(response_cache_backend="memory"))
+    assert warm_up_enabled(Settings(response_cache_backend="memory", warm_up_org_ids=["1234"]))
+    assert warm_up_enabled(Settings(response_cache_backend="redis", warm_up_top_orgs=10))
+
+
+async def test_warm_up():
+    app = App()
+    settings = Settings(response_cache_backend="memory", warm_up_org_ids=["1234", "5678"])
+
+    await warm_up(app, None, settings)
+
+    assert app.state.ready is True
+    assert [scope["path"] for scope in app.requests] == [
+        "/api/roadmap/v1/relevant/lifecycle/rhel",
+        "/api/roadmap/v1/relevant/lifecycle/app-streams",
+    ] * 2
+    assert all(scope[WARM_UP_SCOPE_KEY] for scope in app.requests)
+    identities = [json.loads(base64.b64decode(dict(scope["headers"])[b"x-rh-identity"])) for scope in app.requests]
+    assert [identity["identity"]["org_id"] for identity in identities] == ["1234", "1234", "5678", "5678"]
+
+
+async def test_warm_up_failed():
+    """A failed request does not stop warm-up."""
+    app = App(status=500)
+    settings = Settings(response_cache_backend="memory", warm_up_org_ids=["1234", "5678"])
+
+    await warm_up(app, None, settings)
+
+    assert app.state.ready is True
+    assert len(app.requests) == 4
+
+
+async def test_warm_up_timeout():
+    """The app reports ready once the time budget is spent."""
+    app = App(delay=10)
+    settings = Settings(response_cache_backend="memory", warm_up_org_ids=["1234"], warm_up_timeout=0.01)
+
+    await asyncio.wait_for(warm_up(app, None, settings), 1)
+
+    assert app.state.ready is True
+    assert len(app.requests) == 1
+
+
+async def test_get_warm_up_org_ids():
+    settings = Settings.create().model_copy(update={"warm_up_org_ids": ["5678", "1234"], "warm_up_top_orgs": 5})
+
+    result = await get_warm_up_org_ids(get_engine(settings), settings)
+
+    assert result == ["5678", "1234"]
@@ -1,17 +1,21 @@
 from datetime import date
-from email.message import Message
-from io import BytesIO
-from urllib.error import HTTPError
+from uuid import uuid4
 
+import httpx
 import pytest
 
+from roadmap.catalog import load_app_stream_catalog
 from roadmap.common import decode_header
 from roadmap.common import query_rbac
 from roadmap.config import Settings
 from roadmap.data.app_streams import AppStreamEntity
+from roadmap.database import get_engine
+from roadmap.main import app
 from roadmap.models import LifecycleType
 from roadmap.models import SupportStatus
+from roadmap.v1.lifecycle.app_streams import app_streams_from_matches
 from roadmap.v1.lifecycle.app_streams import AppStreamImplementation
+from roadmap.v1.lifecycle.app_streams import AppStreamKey
 from roadmap.v1.lifecycle.app_streams import RelevantAppStream
 
 
@@ -110,14 +114,124 @@ def test_get_relevant_app_stream(api_prefix, client):
     assert len(data) > 0
 
 
-def test_get_relevant_app_stream_error(api_prefix, client, mocker):
-    def settings_override():
-        return Settings(rbac_hostname="example.com")
+async def test_get_relevant_app_stream_sql_matching(api_prefix):
+    """Matching hosts in the database gives the same result as matching in Python."""
 
-    mocker.patch(
-        "roadmap.common.urllib.request.urlopen",
-        side_effect=HTTPError(url="url", code=400, hdrs=Message(), msg="Raised intentionally", fp=BytesIO()),
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def decode_header_override():
+        return "1234"
+
+    def sort_key(item):
+        return (item["impl"], item["name"], item["os_major"], item["stream"])
+
+    settings = Settings.create()
+    await load_app_stream_catalog(get_engine(settings))
+    app.dependency_overrides = {}
+    app.dependency_overrides[query_rbac] = query_rbac_override
+    app.dependency_overrides[decode_header] = decode_header_override
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        python_result = await client.get(f"{api_prefix}/relevant/lifecycle/app-streams")
+        app.dependency_overrides[Settings.create] = lambda: settings.model_copy(update={"app_stream_matching": "sql"})
+        sql_result = await client.get(f"{api_prefix}/relevant/lifecycle/app-streams")
+
+    app.dependency_overrides = {}
+    expected = sorted(python_result.json()["data"], key=sort_key)
+    data = sorted(sql_result.json()["data"], key=sort_key)
+    for item in expected + data:
+        item["systems"] = sorted(item["systems"])
+
+    assert sql_result.status_code == 200
+    assert len(data) > 0
+    assert data == expected
+
+
+def test_app_streams_from_matches():
+    systems = [uuid4(), uuid4()]
+    rows = [
+        {
+            "impl": "dnf_module",
+            "name": "nodejs",
+            "application_stream_name": "Node.js 18",
+            "stream": "18",
+            "start_date": date(2022, 11, 15),
+            "end_date": date(2025, 4, 30),
+            "os_major": 9,
+            "systems": systems,
+        }
+    ]
+
+    systems_by_stream, counts_by_stream = app_streams_from_matches(rows)
+    key = AppStreamKey(
+        name="nodejs",
+        application_stream_name="Node.js 18",
+        stream="18",
+        start_date=date(2022, 11, 15),
+        end_date=date(2025, 4, 30),
+        os_major=9,
+        os_lifecycle=None,
+        impl=AppStreamImplementation.module,
     )
+
+    assert systems_by_stream == {key: systems}
+    assert counts_by_stream == {key: 2}
+
+
+def test_app_streams_from_matches_counts():
+    """Rows read from a rollup have a count and no system ids."""
+    rows = [
+        {
+            "impl": "package",
+            "name": "Node.js",
+            "application_stream_name": "Node.js",
+            "stream": "22",
+            "start_date": date(2025, 5, 13),
+            "end_date": date(2030, 5, 31),
+            "os_major": 10,
+            "count": 7,
+        }
+    ]
+
+    systems_by_stream, counts_by_stream = app_streams_from_matches(rows)
+
+    assert list(systems_by_stream.values()) == [[]]
+    assert list(counts_by_stream.values()) == [7]
+
+
+def test_get_relevant_app_stream_without_systems(api_prefix, client):
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def decode_header_override():
+        return "1234"
+
+    client.app.dependency_overrides = {}
+    client.app.dependency_overrides[query_rbac] = query_rbac_override
+    client.app.dependency_overrides[decode_header] = decode_header_override
+    result = client.get(f"{api_prefix}/relevant/lifecycle/app-streams", params={"include_systems": False})
+    data = result.json().get("data", "")
+
+    assert result.status_code == 200
+    assert len(data) > 0
+    assert all(item["systems"] == [] and item["count"] > 0 for item in data)
+
+
+def test_get_relevant_app_stream_error(api_prefix, client, rbac_server):
+    def settings_override():
+        return Settings(rbac_hostname=rbac_server.hostname, rbac_port=rbac_server.port)
+
+    rbac_server.status, rbac_server.reason = 400, "Raised intentionally"
     client.app.dependency_overrides = {}
     client.app.dependency_overrides[Settings.create] = settings_override
 
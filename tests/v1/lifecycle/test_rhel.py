@@ -1,7 +1,19 @@
+import asyncio
+import typing as t
+
+import httpx
 import pytest
 
+from fastapi import Depends
+
+from roadmap.cache import CachedResponse
+from roadmap.cache import close_response_cache
+from roadmap.common import cached_response
 from roadmap.common import decode_header
+from roadmap.common import query_host_counts
 from roadmap.common import query_rbac
+from roadmap.config import Settings
+from roadmap.main import app
 from roadmap.models import System
 
 
@@ -74,3 +86,203 @@ def test_get_relevant_rhel_no_rbac_access(api_prefix, client):
     result = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
 
     assert result.status_code == 403
+
+
+def test_rhel_relevant_counts(client, api_prefix):
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def query_host_counts_override():
+        return [
+            {"no_profile": True, "name": None, "major": None, "minor": None, "lifecycle": "mainline", "count": 2},
+            {"no_profile": False, "name": None, "major": None, "minor": None, "lifecycle": "mainline", "count": 3},
+            {"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": 5},
+            {"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "EUS", "count": 1},
+            {"no_profile": False, "name": "RHEL", "major": 8, "minor": None, "lifecycle": "ELS", "count": 7},
+            {"no_profile": False, "name": "RHEL", "major": None, "minor": None, "lifecycle": "mainline", "count": 4},
+        ]
+
+    client.app.dependency_overrides = {}
+    client.app.dependency_overrides[query_rbac] = query_rbac_override
+    client.app.dependency_overrides[query_host_counts] = query_host_counts_override
+
+    response = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    data = response.json()
+    counts = {(item["major"], item["minor"], item["lifecycle_type"]): item["count"] for item in data["data"]}
+
+    assert response.status_code == 200
+    assert counts == {(9, 4, "mainline"): 5, (9, 4, "EUS"): 1, (8, None, "ELS"): 7}
+    assert data["meta"] == {"count": 3, "total": 13, "age": 0}
+
+
+def test_rhel_relevant_cached(client, api_prefix, monkeypatch):
+    """A second request for unchanged hosts is answered from the response cache."""
+
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def decode_header_override():
+        return "1234"
+
+    async def query_host_counts_override():
+        return [{"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": 5}]
+
+    async def changed_host_counts_override():
+        return [{"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": 6}]
+
+    monkeypatch.setattr("roadmap.cache._cache", None)
+    client.app.dependency_overrides = {}
+    client.app.dependency_overrides[Settings.create] = lambda: Settings(response_cache_backend="memory")
+    client.app.dependency_overrides[query_rbac] = query_rbac_override
+    client.app.dependency_overrides[decode_header] = decode_header_override
+    client.app.dependency_overrides[query_host_counts] = query_host_counts_override
+    first = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    client.app.dependency_overrides[query_host_counts] = changed_host_counts_override
+    second = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    other = client.get(f"{api_prefix}/relevant/lifecycle/rhel/9")
+    client.app.dependency_overrides = {}
+
+    assert first.status_code == 200
+    assert second.json() == first.json()
+    assert other.json()["meta"]["total"] == 6
+
+
+def test_rhel_relevant_sessions(client, api_prefix, monkeypatch, mocker):
+    """Each request uses at most one database session, and a request without access uses none."""
+    permissions = [{"permission": "inventory:*:*", "resourceDefinitions": []}]
+    sessions = []
+
+    async def query_rbac_override():
+        return permissions
+
+    async def get_read_db_override(settings):
+        result = mocker.Mock()
+        result.one.return_value = ("2026-10-18T00:00:00+00:00", 5)
+        result.mappings.return_value.all.return_value = [
+            {"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": 5}
+        ]
+        session = mocker.AsyncMock()
+        session.execute.return_value = result
+        sessions.append(session)
+        yield session
+
+    monkeypatch.setattr("roadmap.cache._cache", None)
+    monkeypatch.setattr("roadmap.common.get_read_db", get_read_db_override)
+    client.app.dependency_overrides = {}
+    client.app.dependency_overrides[Settings.create] = lambda: Settings(response_cache_backend="memory")
+    client.app.dependency_overrides[query_rbac] = query_rbac_override
+    miss = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    hit = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    permissions = [{}]
+    denied = client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+    client.app.dependency_overrides = {}
+
+    assert [miss.status_code, hit.status_code, denied.status_code] == [200, 200, 403]
+    assert hit.json() == miss.json()
+    # The watermark and host count queries share the session of the first request
+    assert [session.execute.await_count for session in sessions] == [2, 1]
+
+
+@pytest.mark.parametrize("backend", ("none", "memory"))
+async def test_rhel_relevant_coalesced(api_prefix, backend, monkeypatch, mocker):
+    """Concurrent identical requests share one computation, with or without a response cache."""
+    queries = []
+
+    async def get_read_db_override(settings):
+        # Opening a session takes a while, so the requests overlap during the cache lookup
+        await asyncio.sleep(0.05)
+        session = mocker.AsyncMock()
+        session.execute.return_value.one = mocker.Mock(return_value=("2026-10-18T00:00:00+00:00", 5))
+        yield session
+
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def decode_header_override():
+        return "1234"
+
+    async def query_host_counts_override(cached: t.Annotated[CachedResponse, Depends(cached_response)]):
+        if cached.hit:
+            return []
+
+        queries.append(cached.key)
+        await asyncio.sleep(0.1)
+        return [{"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": 5}]
+
+    monkeypatch.setattr("roadmap.cache._cache", None)
+    monkeypatch.setattr("roadmap.common.get_read_db", get_read_db_override)
+    app.dependency_overrides = {}
+    app.dependency_overrides[Settings.create] = lambda: Settings(response_cache_backend=backend)
+    app.dependency_overrides[query_rbac] = query_rbac_override
+    app.dependency_overrides[decode_header] = decode_header_override
+    app.dependency_overrides[query_host_counts] = query_host_counts_override
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        responses = await asyncio.gather(
+            *(client.get(f"{api_prefix}/relevant/lifecycle/rhel") for _ in range(3)),
+            client.get(f"{api_prefix}/relevant/lifecycle/rhel/9"),
+        )
+
+    app.dependency_overrides = {}
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert all(response.json() == responses[0].json() for response in responses[:3])
+    assert responses[0].json()["meta"]["total"] == 5
+    # One computation for the three identical requests and one for the other path
+    assert len(queries) == 2
+
+
+async def test_rhel_relevant_stale_while_revalidate(api_prefix):
+    """An outdated response is returned immediately and recomputed in the background."""
+    counts = [5]
+
+    async def query_rbac_override():
+        return [
+            {
+                "permission": "inventory:*:*",
+                "resourceDefinitions": [],
+            }
+        ]
+
+    async def decode_header_override():
+        return "1234"
+
+    async def query_host_counts_override():
+        return [
+            {"no_profile": False, "name": "RHEL", "major": 9, "minor": 4, "lifecycle": "mainline", "count": counts[0]}
+        ]
+
+    settings = Settings(response_cache_backend="memory", response_cache_ttl=0, response_cache_max_stale=60)
+    await close_response_cache()
+    app.dependency_overrides = {}
+    app.dependency_overrides[Settings.create] = lambda: settings
+    app.dependency_overrides[query_rbac] = query_rbac_override
+    app.dependency_overrides[decode_header] = decode_header_override
+    app.dependency_overrides[query_host_counts] = query_host_counts_override
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = await client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+        counts[0] = 6
+        stale = await client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+        await asyncio.sleep(0.5)
+        revalidated = await client.get(f"{api_prefix}/relevant/lifecycle/rhel")
+
+    app.dependency_overrides = {}
+    await close_response_cache()
+
+    assert first.json()["meta"]["total"] == 5
+    assert stale.json()["meta"]["total"] == 5
+    assert revalidated.json()["meta"]["total"] == 6